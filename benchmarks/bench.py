@@ -0,0 +1,392 @@
+"""Offline benchmarks of the storage hot paths.
+
+Every case runs in a fresh process so its peak RSS is its own. Transfers go
+through TelegramManager and core.transfer against benchmarks.fake_telegram,
+so no network or Telegram account is needed:
+
+    uv run python -m benchmarks.bench --sizes 16M,256M --catalog-sizes 1000,10000
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Callable, Optional
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+import core.file_processor as file_processor
+from core import (
+    Catalog,
+    ChunkInfo,
+    Config,
+    FileMetadata,
+    FileSplitRebuild,
+    ShardConfig,
+)
+from core.file_processor import HASH_ALGORITHMS, calculate_checksum
+from core.progress import TransferDashboard
+from core.telegram_client import TelegramManager
+from core.transfer import download_files, upload_files
+from utils import parse_size
+
+from .fake_telegram import FakeClient, NetworkProfile
+from .startup import import_seconds
+
+WRITE_BLOCK_SIZE = 8 * 1024 * 1024  # 8MB
+
+app = typer.Typer()
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process, in bytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def make_file(path: Path, size: int) -> Path:
+    with open(path, "wb") as f:
+        for start in range(0, size, WRITE_BLOCK_SIZE):
+            f.write(os.urandom(min(WRITE_BLOCK_SIZE, size - start)))
+    return path
+
+
+def timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    return time.perf_counter() - start
+
+
+def fake_manager(
+    workdir: Path, profile: NetworkProfile, shards: int = 1
+) -> tuple[TelegramManager, list[FakeClient]]:
+    """A manager over `shards` fake accounts, each with its own network link"""
+    # Built in one go: assigning Config fields would save over the real config
+    config = Config(
+        storage_chat_id=1,
+        metadata_message_id=0,
+        session_file=workdir / "session",
+        global_metafile=workdir / "global.json",
+        catalog_file=workdir / "catalog.db",
+        transfers_dir=workdir / "transfers",
+        chat_verified=True,
+        shards=[
+            ShardConfig(session_file=workdir / f"session{i}", storage_chat_id=1 + i)
+            for i in range(1, shards)
+        ],
+    )
+    manager = TelegramManager(config)
+    clients = [FakeClient(profile, name=f"fake{i}") for i in range(shards)]
+    for i, client in enumerate(clients):
+        manager.shard(i).client = client  # type: ignore[assignment]
+    manager.dashboard = TransferDashboard("quiet")
+    return manager, clients
+
+
+# Cases: each takes a scratch directory and its parameters, runs in its own
+# process, and returns {"seconds": ..., "bytes": ...} (bytes for throughput)
+
+
+def case_checksum(workdir: Path, size: int, algorithm: str) -> dict:
+    source = make_file(workdir / "source.bin", size)
+    return {
+        "seconds": timed(lambda: calculate_checksum(source, algorithm)),
+        "bytes": size,
+    }
+
+
+def case_split(workdir: Path, size: int) -> dict:
+    source = make_file(workdir / "source.bin", size)
+    splitter = FileSplitRebuild()
+    return {"seconds": timed(lambda: list(splitter._split_file(source))), "bytes": size}
+
+
+def case_slice(workdir: Path, size: int) -> dict:
+    """Reading every upload slice front to back, which also checksums it"""
+    source = make_file(workdir / "source.bin", size)
+
+    def read_slices():
+        for chunk in FileSplitRebuild()._iter_slices(source):
+            with chunk:
+                while chunk.read(file_processor.HASH_READ_SIZE):
+                    pass
+                chunk.checksum()
+
+    return {"seconds": timed(read_slices), "bytes": size}
+
+
+def case_recombine(workdir: Path, size: int) -> dict:
+    source = make_file(workdir / "source.bin", size)
+    splitter = FileSplitRebuild()
+    with contextlib.redirect_stdout(io.StringIO()):
+        parts = list(splitter._split_file(source))
+    output_dir = workdir / "out"
+    output_dir.mkdir()
+    for part in parts:
+        part.rename(output_dir / part.name)
+    metadata = {
+        "original_name": source.name,
+        "chunks": [{"name": part.name} for part in parts],
+    }
+    return {
+        "seconds": timed(lambda: splitter._recombine_files(metadata, output_dir)),
+        "bytes": size,
+    }
+
+
+def case_upload(
+    workdir: Path, size: int, concurrency: int, profile: NetworkProfile, shards: int
+) -> dict:
+    source = make_file(workdir / "source.bin", size)
+    manager, clients = fake_manager(workdir, profile, shards)
+
+    async def upload():
+        metadata = FileMetadata.new(source, checksum="")
+        chunks = list(FileSplitRebuild()._iter_slices(source))
+        await upload_files(manager, [(metadata, chunks)], concurrency)
+
+    seconds = timed(lambda: asyncio.run(upload()))
+    return {
+        "seconds": seconds,
+        "bytes": size,
+        "flood_waits": sum(client.flood_waits for client in clients),
+        "window": manager.scheduler.stats()["window"],
+    }
+
+
+def case_download(
+    workdir: Path, size: int, concurrency: int, profile: NetworkProfile, shards: int
+) -> dict:
+    source = make_file(workdir / "source.bin", size)
+    manager, clients = fake_manager(workdir, profile, shards)
+    metadata = FileMetadata.new(source, checksum="")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for idx, chunk in enumerate(FileSplitRebuild()._iter_slices(source), start=1):
+            part = workdir / chunk.name
+            with chunk, open(part, "wb") as f:
+                while data := chunk.read(file_processor.HASH_READ_SIZE):
+                    f.write(data)
+            # Spread over the shards as round-robin placement would
+            shard = (idx - 1) % shards
+            message = clients[shard].put_document(part)
+            metadata.chunks.append(
+                ChunkInfo.from_slice(
+                    message_id=message.id, chunk=chunk, index=idx, shard=shard or None
+                )
+            )
+            part.unlink()
+    source.unlink()
+
+    async def download():
+        await download_files(
+            manager, [(metadata, workdir / "downloaded.bin")], concurrency
+        )
+
+    seconds = timed(lambda: asyncio.run(download()))
+    return {
+        "seconds": seconds,
+        "bytes": size,
+        "flood_waits": sum(client.flood_waits for client in clients),
+        "window": manager.scheduler.stats()["window"],
+    }
+
+
+def fake_catalog_entries(count: int) -> list[FileMetadata]:
+    metadatas = []
+    for n in range(count):
+        metadata = FileMetadata(
+            original_name=f"file-{n:07d}.bin",
+            file_type="application/octet-stream",
+            extension=".bin",
+            checksum=f"{n:032x}",
+            file_size=n * 4096,
+        )
+        metadata.chunks = [
+            ChunkInfo(
+                message_id=n * 3 + i,
+                name=f"file-{n:07d}.part{i:03d}",
+                size=4096,
+                index=i,
+                checksum=f"{n * 3 + i:032x}",
+            )
+            for i in range(1, n % 3 + 2)
+        ]
+        metadatas.append(metadata)
+    return metadatas
+
+
+def case_metadata_load(workdir: Path, count: int) -> dict:
+    """Loading the JSON metafile, the form every snapshot is stored in"""
+    metafile = workdir / "global.json"
+    FileMetadata.push_metadatas(fake_catalog_entries(count), metafile)
+    return {"seconds": timed(lambda: FileMetadata.get_metadatas(metafile))}
+
+
+def case_catalog_import(workdir: Path, count: int) -> dict:
+    metafile = workdir / "global.json"
+    FileMetadata.push_metadatas(fake_catalog_entries(count), metafile)
+    catalog = Catalog(workdir / "catalog.db")
+    return {"seconds": timed(lambda: catalog.import_json(metafile))}
+
+
+def case_catalog_scan(workdir: Path, count: int) -> dict:
+    catalog = Catalog(workdir / "catalog.db")
+    catalog.replace_all(fake_catalog_entries(count))
+    return {"seconds": timed(lambda: list(catalog))}
+
+
+def case_catalog_lookup(workdir: Path, count: int) -> dict:
+    """1000 lookups by id, size and checksum"""
+    catalog = Catalog(workdir / "catalog.db")
+    metadatas = fake_catalog_entries(count)
+    catalog.replace_all(metadatas)
+    picks = metadatas[:: max(1, count // 1000)][:1000]
+
+    def lookups():
+        for metadata in picks:
+            catalog.get(metadata.file_id)
+            catalog.find_by_size(metadata.file_size)
+            catalog.find_by_checksum(metadata.checksum)
+
+    return {"seconds": timed(lookups)}
+
+
+def case_catalog_search(workdir: Path, count: int) -> dict:
+    """100 name searches, one page each, as `search` runs them"""
+    catalog = Catalog(workdir / "catalog.db")
+    catalog.replace_all(fake_catalog_entries(count))
+    queries = [f"{n:03d}" for n in range(100)]
+
+    def searches():
+        for query in queries:
+            catalog.search(name=query, sort="name", limit=50)
+
+    return {"seconds": timed(searches)}
+
+
+def case_startup(workdir: Path) -> dict:
+    """What `import cli` adds to interpreter startup (see benchmarks.startup)"""
+    return {"seconds": import_seconds()}
+
+
+def _run_case(case: Callable[..., dict], part_size: int, *args) -> dict:
+    """Entry point of a case's process"""
+    file_processor.PART_SIZE = part_size  # type: ignore[misc]
+    with tempfile.TemporaryDirectory(prefix="tg-storage-bench-") as workdir:
+        result = case(Path(workdir), *args)
+    result["peak_rss"] = peak_rss()
+    return result
+
+
+def run_isolated(case: Callable[..., dict], part_size: int, *args) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_run_case, case, part_size, *args).result()
+
+
+def mb(nbytes: float) -> str:
+    return f"{nbytes / 1024**2:.1f}"
+
+
+@app.command()
+def main(
+    sizes: str = typer.Option("16M,256M", help="File sizes, comma separated"),
+    catalog_sizes: str = typer.Option(
+        "1000,10000", help="Catalog entry counts, comma separated"
+    ),
+    part_size: str = typer.Option(
+        "64M", help="Chunk size to split at, standing in for Telegram's 2GB limit"
+    ),
+    concurrency: int = typer.Option(4, help="Transfer workers per shard"),
+    shards: int = typer.Option(
+        1, help="Accounts to spread transfers over, each with its own link"
+    ),
+    latency: float = typer.Option(0.0, help="Seconds of latency per request"),
+    bandwidth: Optional[str] = typer.Option(
+        None, help="Shared link bandwidth per second, e.g. 20M"
+    ),
+    flood_wait_rate: float = typer.Option(
+        0.0, help="Chance that a request hits a flood wait"
+    ),
+    flood_wait_seconds: int = typer.Option(1, help="Length of each flood wait"),
+    only: Optional[str] = typer.Option(
+        None, help="Run only the cases whose name contains this"
+    ),
+    output: Optional[Path] = typer.Option(
+        None, "--json", help="Also write the results to this JSON file"
+    ),
+) -> None:
+    """Benchmark splitting, hashing, transfers and metadata without a network"""
+    profile = NetworkProfile(
+        latency=latency,
+        bandwidth=parse_size(bandwidth) if bandwidth else None,
+        flood_wait_rate=flood_wait_rate,
+        flood_wait_seconds=flood_wait_seconds,
+    )
+    split_at = parse_size(part_size)
+    cases: list[tuple[str, str, Callable[..., dict], tuple]] = [
+        ("cli import", "startup", case_startup, ())
+    ]
+    for size_name in sizes.split(","):
+        size = parse_size(size_name)
+        for algorithm in HASH_ALGORITHMS:
+            cases.append(
+                (f"checksum {algorithm}", size_name, case_checksum, (size, algorithm))
+            )
+        cases.append(("split", size_name, case_split, (size,)))
+        cases.append(("slice", size_name, case_slice, (size,)))
+        cases.append(("recombine", size_name, case_recombine, (size,)))
+        transfer_args = (size, concurrency, profile, shards)
+        cases.append(("upload", size_name, case_upload, transfer_args))
+        cases.append(("download", size_name, case_download, transfer_args))
+    for count in catalog_sizes.split(","):
+        for name, case in [
+            ("metadata load", case_metadata_load),
+            ("catalog import", case_catalog_import),
+            ("catalog scan", case_catalog_scan),
+            ("catalog lookup", case_catalog_lookup),
+            ("catalog search", case_catalog_search),
+        ]:
+            cases.append((name, f"{int(count)} files", case, (int(count),)))
+    if only:
+        cases = [c for c in cases if only in c[0]]
+
+    table = Table("Case", "Input", "Seconds", "MB/s", "Peak RSS (MB)")
+    results = []
+    console = Console()
+    for name, label, case, args in cases:
+        with console.status(f"{name} ({label})"):
+            try:
+                result = run_isolated(case, split_at, *args)
+            except Exception as e:
+                # e.g. a flood wait longer than max_flood_wait
+                table.add_row(name, label, f"[red]failed: {type(e).__name__}[/red]")
+                results.append({"case": name, "input": label, "error": repr(e)})
+                continue
+        throughput = result["bytes"] / result["seconds"] if "bytes" in result else None
+        table.add_row(
+            name,
+            label,
+            f"{result['seconds']:.3f}",
+            mb(throughput) if throughput else "",
+            mb(result["peak_rss"]),
+        )
+        results.append({"case": name, "input": label, **result})
+    console.print(table)
+
+    if output is not None:
+        output.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    app()
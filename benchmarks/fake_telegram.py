@@ -0,0 +1,255 @@
+"""In-process stand-in for the parts of pyrogram.Client that TelegramManager uses"""
+
+import asyncio
+import itertools
+import logging
+import os
+import random
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import AsyncGenerator, Optional
+
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import FloodWait
+
+# pyrogram's save_file and stream_media part sizes
+UPLOAD_PART_SIZE = 512 * 1024
+DOWNLOAD_PART_SIZE = 1024 * 1024
+
+session_log = logging.getLogger("pyrogram.session.session")
+
+
+@dataclass
+class NetworkProfile:
+    """What the fake network costs.
+
+    latency is paid by every request (concurrently); bandwidth, in bytes per
+    second, is one link shared by every transfer; a request hits a flood wait
+    of flood_wait_seconds with probability flood_wait_rate.
+    """
+
+    latency: float = 0.0
+    bandwidth: Optional[float] = None
+    flood_wait_rate: float = 0.0
+    flood_wait_seconds: int = 1
+    seed: int = 0
+
+
+@dataclass
+class FakeDocument:
+    file_size: int
+    file_name: str
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    document: Optional[FakeDocument] = None
+    caption: str = ""
+    text: str = ""
+    empty: bool = False
+    _client: Optional["FakeClient"] = field(default=None, repr=False)
+
+    async def download(self, file_name: str, progress=None) -> str:
+        assert self._client is not None
+        with open(file_name, "wb") as f:
+            async for part in self._client.stream_media(self):
+                f.write(part)
+                if progress is not None:
+                    await progress(f.tell(), self.document.file_size)
+        return file_name
+
+
+class FakeClient:
+    """Stores documents in a temporary directory behind a simulated network.
+
+    Uploads are read in 512KB parts and downloads streamed in 1MB parts, under
+    the same save_file/get_file semaphores pyrogram uses, so
+    TelegramManager.set_concurrency behaves as it does against Telegram.
+    Flood waits up to sleep_threshold are slept through and logged, as
+    pyrogram's session does; longer ones raise FloodWait.
+
+    stream_faults are taken by the next stream_media calls, one each: an
+    exception to raise before the first part, or "drop" to end the stream
+    after its first part, which is what pyrogram's get_file does when the
+    connection drops. send_faults are likewise taken by the next
+    send_document calls: an exception to raise before storing anything, or
+    None to let that upload through.
+    """
+
+    def __init__(
+        self,
+        profile: Optional[NetworkProfile] = None,
+        name: str = "fake",
+        sleep_threshold: int = 10,
+        max_concurrent_transmissions: int = 1,
+    ):
+        self.profile = profile or NetworkProfile()
+        self.name = name
+        self.sleep_threshold = sleep_threshold
+        self.max_concurrent_transmissions = max_concurrent_transmissions
+        self.save_file_semaphore = asyncio.Semaphore(max_concurrent_transmissions)
+        self.get_file_semaphore = asyncio.Semaphore(max_concurrent_transmissions)
+        self.is_connected = False
+        self.messages: dict[int, FakeMessage] = {}
+        self.requests = 0
+        self.flood_waits = 0
+        self.stream_faults: list[BaseException | str] = []
+        self.send_faults: list[Optional[BaseException]] = []
+        self._ids = itertools.count(1)
+        self._rng = random.Random(self.profile.seed)
+        self._link = asyncio.Lock()
+        self._storage = tempfile.TemporaryDirectory(prefix="fake-telegram-")
+
+    def _path(self, message_id: int) -> Path:
+        return Path(self._storage.name) / str(message_id)
+
+    async def _request(self, nbytes: int = 0) -> None:
+        """Pay for one request carrying nbytes over the simulated network"""
+        self.requests += 1
+        profile = self.profile
+        if profile.flood_wait_rate and self._rng.random() < profile.flood_wait_rate:
+            self.flood_waits += 1
+            if profile.flood_wait_seconds > self.sleep_threshold:
+                raise FloodWait(value=profile.flood_wait_seconds)
+            session_log.warning(
+                '[%s] Waiting for %s seconds before continuing (required by "%s")',
+                self.name,
+                profile.flood_wait_seconds,
+                "fake.Request",
+            )
+            await asyncio.sleep(profile.flood_wait_seconds)
+        if profile.latency:
+            await asyncio.sleep(profile.latency)
+        if profile.bandwidth and nbytes:
+            async with self._link:
+                await asyncio.sleep(nbytes / profile.bandwidth)
+        else:
+            await asyncio.sleep(0)
+
+    async def start(self) -> "FakeClient":
+        await self._request()
+        self.is_connected = True
+        return self
+
+    async def stop(self) -> "FakeClient":
+        self.is_connected = False
+        return self
+
+    async def export_session_string(self) -> str:
+        return "fake-session"
+
+    async def get_me(self) -> SimpleNamespace:
+        await self._request()
+        return SimpleNamespace(id=1)
+
+    async def get_chat_member(self, chat_id: int, user_id: int) -> SimpleNamespace:
+        await self._request()
+        return SimpleNamespace(status=ChatMemberStatus.OWNER)
+
+    def _new_message(self, **kwargs) -> FakeMessage:
+        message = FakeMessage(id=next(self._ids), _client=self, **kwargs)
+        self.messages[message.id] = message
+        return message
+
+    async def send_message(self, chat_id: int, text: str) -> FakeMessage:
+        await self._request(len(text))
+        return self._new_message(text=text)
+
+    async def send_document(
+        self,
+        chat_id: int,
+        document,
+        file_name: Optional[str] = None,
+        caption: str = "",
+        progress=None,
+    ) -> FakeMessage:
+        fault = self.send_faults.pop(0) if self.send_faults else None
+        if fault is not None:
+            raise fault
+        async with self.save_file_semaphore:
+            fp = open(document, "rb") if isinstance(document, str) else document
+            try:
+                size = fp.seek(0, os.SEEK_END)
+                fp.seek(0)
+                message_id = next(self._ids)
+                with open(self._path(message_id), "wb") as out:
+                    while part := fp.read(UPLOAD_PART_SIZE):
+                        await self._request(len(part))
+                        out.write(part)
+                        if progress is not None:
+                            await progress(out.tell(), size)
+            finally:
+                if isinstance(document, str):
+                    fp.close()
+        await self._request()
+        message = FakeMessage(
+            id=message_id,
+            document=FakeDocument(size, file_name or getattr(fp, "name", "file")),
+            caption=caption,
+            _client=self,
+        )
+        self.messages[message_id] = message
+        return message
+
+    def put_document(self, path: Path, caption: str = "") -> FakeMessage:
+        """Store a document directly, without paying for an upload"""
+        message_id = next(self._ids)
+        with open(path, "rb") as src, open(self._path(message_id), "wb") as out:
+            while part := src.read(DOWNLOAD_PART_SIZE):
+                out.write(part)
+        message = FakeMessage(
+            id=message_id,
+            document=FakeDocument(path.stat().st_size, path.name),
+            caption=caption,
+            _client=self,
+        )
+        self.messages[message_id] = message
+        return message
+
+    async def get_messages(self, chat_id: int, message_ids):
+        await self._request()
+        if isinstance(message_ids, list):
+            return [
+                self.messages.get(i) or FakeMessage(id=i, empty=True)
+                for i in message_ids
+            ]
+        return self.messages.get(message_ids) or FakeMessage(id=message_ids, empty=True)
+
+    async def stream_media(
+        self, message: FakeMessage, limit: int = 0, offset: int = 0
+    ) -> AsyncGenerator[bytes, None]:
+        fault = self.stream_faults.pop(0) if self.stream_faults else None
+        if isinstance(fault, BaseException):
+            raise fault
+        async with self.get_file_semaphore:
+            with open(self._path(message.id), "rb") as f:
+                f.seek(offset * DOWNLOAD_PART_SIZE)
+                sent = 0
+                while part := f.read(DOWNLOAD_PART_SIZE):
+                    await self._request(len(part))
+                    yield part
+                    sent += 1
+                    if (limit and sent >= limit) or fault == "drop":
+                        break
+
+    async def search_messages(
+        self, chat_id: int, query: str = ""
+    ) -> AsyncGenerator[FakeMessage, None]:
+        await self._request()
+        for message_id in sorted(self.messages, reverse=True):
+            message = self.messages[message_id]
+            if query in (message.caption or message.text):
+                yield message
+
+    async def delete_messages(self, chat_id: int, message_ids) -> int:
+        await self._request()
+        ids = message_ids if isinstance(message_ids, list) else [message_ids]
+        deleted = 0
+        for message_id in ids:
+            if self.messages.pop(message_id, None) is not None:
+                self._path(message_id).unlink(missing_ok=True)
+                deleted += 1
+        return deleted
@@ -0,0 +1,85 @@
+"""CLI startup time against a budget.
+
+Fails (exit code 1) when importing cli takes longer than the budget, and
+lists the modules that took the longest, so a new eager import shows up
+before it reaches users:
+
+    uv run python -m benchmarks.startup --budget 0.5
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+ROOT = Path(__file__).resolve().parent.parent
+# Seconds that `import cli` may take, interpreter startup excluded
+IMPORT_BUDGET = 0.5
+
+app = typer.Typer()
+
+
+def _run(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_seconds(runs: int = 5) -> float:
+    """Median time `import cli` adds to a bare interpreter start"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        _run("pass")
+        bare = time.perf_counter() - start
+        start = time.perf_counter()
+        _run("import cli")
+        samples.append(time.perf_counter() - start - bare)
+    return max(0.0, statistics.median(samples))
+
+
+def slowest_imports(count: int = 15) -> list[tuple[str, float]]:
+    """Modules with the highest cumulative import time, from -X importtime"""
+    stderr = _run("import cli", "-X", "importtime").stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        timings.append((module.strip(), int(cumulative) / 1e6))
+    return sorted(timings, key=lambda t: t[1], reverse=True)[:count]
+
+
+@app.command()
+def main(
+    budget: float = typer.Option(IMPORT_BUDGET, help="Allowed seconds for import cli"),
+    runs: int = typer.Option(5, help="Runs to take the median of"),
+) -> None:
+    """Check that importing the CLI stays within its startup budget"""
+    console = Console()
+    seconds = import_seconds(runs)
+    table = Table("Module", "Cumulative (ms)")
+    for module, cumulative in slowest_imports():
+        table.add_row(module, f"{cumulative * 1000:.1f}")
+    console.print(table)
+    if seconds > budget:
+        console.print(
+            f"[red]import cli took {seconds:.3f}s, over the {budget:.3f}s budget[/red]"
+        )
+        raise typer.Exit(1)
+    console.print(
+        f"[green]import cli took {seconds:.3f}s, within the {budget:.3f}s budget[/green]"
+    )
+
+
+if __name__ == "__main__":
+    app()
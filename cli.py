@@ -1,18 +1,93 @@
+import asyncio
+import glob
+import os
+import sys
+import uuid
+from collections import Counter
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
 import typer
-from pyrogram.errors import ChannelPrivate, ChatAdminRequired
 
-from core import ChunkInfo, Config, FileMetadata, FileSplitRebuild, TelegramManager
-from core.file_processor import calculate_checksum
-from utils import Json, run_coroutine, size_in_humanize
+from core import (
+    Catalog,
+    ChunkCache,
+    ChunkInfo,
+    Config,
+    FileMetadata,
+    FileSplitRebuild,
+    HashCache,
+    MetadataJournal,
+    RangeReader,
+    ShardConfig,
+    TelegramManager,
+    TransferJournal,
+)
+from core.catalog import SORT_COLUMNS, FileEntry
+from core.compression import choose_codec
+from core.metrics import metrics
+from core.file_processor import (
+    HASH_ALGORITHMS,
+    PackSlice,
+    StreamSlices,
+    digest_algorithm,
+    group_packs,
+    resolve_algorithm,
+)
+from core.transfer import (
+    check_upload_journals,
+    download_files,
+    stored_sizes,
+    upload_files,
+    upload_packs,
+    verify_chunks,
+)
+from utils import parse_size, run_coroutine, size_in_humanize
 from pretty_print import print_info, print_error, print_success, print_warning
 
 
+# Bytes `cat` reads and writes at a time
+CAT_READ_SIZE = 8 * 1024 * 1024
+
 app = typer.Typer()
 config = Config.load()
 telegram_manager = TelegramManager(config)
+catalog = Catalog(config.catalog_file, legacy_metafile=config.global_metafile)
+journal = MetadataJournal(catalog, telegram_manager, config)
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    metrics_file: Optional[Path] = typer.Option(
+        None,
+        "--metrics",
+        help="Write per-phase timings, throughput and retry counts to this file "
+        "when the command ends: a Prometheus textfile if it ends in .prom, "
+        "JSON otherwise",
+    ),
+    progress: Optional[str] = typer.Option(
+        None,
+        "--progress",
+        help="auto, bar, json (a JSON line per update on stderr) or quiet; "
+        "defaults to progress in the config",
+    ),
+) -> None:
+    if progress is not None:
+        if progress not in ("auto", "bar", "json", "quiet"):
+            print_error(f"Unknown progress mode: {progress}")
+            raise typer.Exit(1)
+        telegram_manager.progress_mode = progress
+    if metrics_file is None:
+        return
+    metrics.reset(ctx.invoked_subcommand or "")
+    ctx.call_on_close(lambda: metrics.write(metrics_file))
+
+
+async def with_connection(coroutine) -> None:
+    """Run a command's coroutine on one long-lived Telegram connection"""
+    async with telegram_manager:
+        await coroutine
 
 
 def check_pre_requirements() -> bool:
@@ -48,10 +123,13 @@ def setup_storage_chat() -> None:
     print_info("Setting up storage chat")
 
     async def _setup_storage_chat():
+        from pyrogram.errors import ChannelPrivate, ChatAdminRequired
+
         try:
             await telegram_manager.validate_chat(storage_chat_id)
-            config.storage_chat_id = storage_chat_id
-            config.chat_verified = True
+            with config.batch():
+                config.storage_chat_id = storage_chat_id
+                config.chat_verified = True
             print_success("✅ Chat verification successful!")
             return
         except ChatAdminRequired:
@@ -64,55 +142,88 @@ def setup_storage_chat() -> None:
     print_success("✅ Storage chat setup complete!")
 
 
+@app.command()
+def add_shard() -> None:
+    """Add another account and storage chat to spread chunks over"""
+    index = len(config.shards) + 1
+    api_id = typer.prompt("Enter API ID", type=int)
+    api_hash = typer.prompt("Enter API Hash", type=str)
+    phone_number = typer.prompt("Enter Phone Number (+1234567890)", type=str)
+    storage_chat_id = typer.prompt("Enter Storage Chat ID", type=int)
+    shard = ShardConfig(
+        session_file=config.session_file.with_name(
+            f"{config.session_file.name}_shard{index}"
+        ),
+        storage_chat_id=storage_chat_id,
+    )
+    shard_config = config.for_shard(shard)
+    print_info("Creating session...")
+    TelegramManager.create_session(api_id, api_hash, phone_number, shard_config)
+
+    async def _add_shard():
+        from pyrogram.errors import ChannelPrivate, ChatAdminRequired
+
+        manager = TelegramManager(shard_config)
+        try:
+            await manager.validate_chat(storage_chat_id)
+        except ChatAdminRequired:
+            print_error("Bot needs admin privileges with post permission!")
+            return
+        except ChannelPrivate:
+            print_error("User not in channel! Join first then retry")
+            return
+        config.shards = [*config.shards, shard]
+        print_success(f"✅ Shard {index} added, chunks now go to {index + 1} chats")
+
+    run_coroutine(_add_shard())
+
+
+@app.command()
+def shards() -> None:
+    """List the storage shards and what each of them holds"""
+    usage = catalog.shard_usage()
+    targets = [
+        (config.storage_chat_id, config.session_file),
+        *((s.storage_chat_id, s.session_file) for s in config.shards),
+    ]
+    for index, (chat_id, session_file) in enumerate(targets):
+        documents, size = usage.get(index, (0, 0))
+        print_info(
+            f"{index:<3} | chat {chat_id:<16} | {session_file.name:<24} | "
+            f"{documents} documents | {size_in_humanize(size)}"
+        )
+    for index in sorted(set(usage) - set(range(len(targets)))):
+        print_warning(f"{index:<3} | not configured, {usage[index][0]} documents")
+    print_info(f"Placement: {config.shard_placement}")
+
+
 @app.command()
 def sync() -> None:
     """Sync metadata between Telegram and local storage"""
 
     async def _sync_metadata():
-        local_metadata: list[FileMetadata] = []
-        telegram_metadata: list[FileMetadata] = []
-
-        if config.global_metafile.exists():
-            local_metadata = FileMetadata.get_metadatas(config.global_metafile)
-        else:
-            print_warning("No metadata file found in configuration (Local)")
+        if not config.metadata_message_id:
+            print_warning("No metadata message found in configuration (Telegram)")
 
         try:
-            if not config.metadata_message_id:
-                print_warning("No metadata message found in configuration (Telegram)")
-            else:
-                temp_metadata_path = Path.cwd() / "temp_metadata.json"
-                await telegram_manager.download_metadata(temp_metadata_path)
-                telegram_metadata = FileMetadata.get_metadatas(temp_metadata_path)
-                temp_metadata_path.unlink()
+            pulled = await journal.pull()
         except Exception as e:
             print_error(f"Error downloading metadata from Telegram: {e}")
             return
+        if pulled:
+            print_success(f"✅ Local metadata updated from Telegram ({pulled} entries)")
 
-        if not config.global_metafile.exists():
-            print_warning("No metadata found in Telegram or locally")
-            print_info("Creating a new metadata file")
-            config.global_metafile.write_text(Json.dumps(local_metadata, indent=4))
-            global_metadata_message = await telegram_manager.upload_file(
-                config.global_metafile
-            )
-            config.metadata_message_id = global_metadata_message.id
-            return
-
-        if len(telegram_metadata) > len(local_metadata):
-            FileMetadata.push_metadatas(telegram_metadata, Config.global_metafile)
-            print_success("✅ Local metadata updated from Telegram")
-        elif len(local_metadata) > len(telegram_metadata):
-            config.global_metafile.write_text(Json.dumps(local_metadata, indent=4))
-            global_metadata_message = await telegram_manager.upload_file(
-                config.global_metafile
-            )
-            config.metadata_message_id = global_metadata_message.id
+        if not config.metadata_message_id:
+            print_info("Creating a new metadata snapshot")
+        if await journal.push():
             print_success("✅ Telegram metadata updated from local")
-        else:
+        elif not pulled:
             print_success("✅ Metadata is already in sync")
 
-    run_coroutine(_sync_metadata())
+        if not config.global_metafile.exists():
+            catalog.export_json(config.global_metafile)
+
+    run_coroutine(with_connection(_sync_metadata()))
 
 
 @app.command()
@@ -122,109 +233,1016 @@ def list_files() -> None:
         print_warning("No files uploaded yet.")
         return
 
-    global_metadatas = FileMetadata.get_metadatas(config.global_metafile)
+    entries, _ = catalog.search()
+    print_entries(entries)
+    size_str = size_in_humanize(catalog.total_size())
+    print_info(f"Total storage used: {size_str}")
+
 
-    total_storage = 0
-    for idx, meta in enumerate(global_metadatas, 1):
-        file_size_str = size_in_humanize(meta.file_size)
+def print_entries(entries: list[FileEntry], start: int = 1) -> None:
+    for idx, entry in enumerate(entries, start):
+        file_size_str = size_in_humanize(entry.file_size)
         print_info(
-            f"{idx:<3} | {meta.original_name:<50} | {file_size_str:<10} | ID: {meta.file_id} | {meta.file_type:<10}"
+            f"{idx:<3} | {entry.original_name:<50} | {file_size_str:<10} | ID: {entry.file_id} | {entry.file_type:<10}"
         )
-        total_storage += meta.file_size
-
-    size_str = size_in_humanize(total_storage)
-    print_info(f"Total storage used: {size_str}")
 
 
 @app.command()
-def upload(file_path: Path) -> None:
-    """Upload a file to Telegram storage"""
+def search(
+    query: Optional[str] = typer.Argument(
+        None, help="Text in the file name, or a glob over it such as '*.log'"
+    ),
+    file_type: Optional[str] = typer.Option(
+        None, "--type", help="Mimetype or its prefix, e.g. image/ or application/pdf"
+    ),
+    min_size: Optional[str] = typer.Option(None, "--min-size", help="e.g. 10M"),
+    max_size: Optional[str] = typer.Option(None, "--max-size", help="e.g. 2G"),
+    since: Optional[str] = typer.Option(
+        None, "--since", help="Uploaded on or after this date (YYYY-MM-DD)"
+    ),
+    until: Optional[str] = typer.Option(
+        None, "--until", help="Uploaded on or before this date (YYYY-MM-DD)"
+    ),
+    sort: str = typer.Option("name", "--sort", help="name, size, date or type"),
+    reverse: bool = typer.Option(False, "--reverse", help="Sort in descending order"),
+    limit: int = typer.Option(50, "--limit", help="Files per page, 0 for all"),
+    page: int = typer.Option(1, "--page", help="Page to show, from 1"),
+) -> None:
+    """Find files by name, type, size or upload date"""
+    if sort not in SORT_COLUMNS:
+        print_error(f"Unknown sort key: {sort}")
+        raise typer.Exit(1)
+    if limit < 0 or page < 1:
+        print_error("Limit cannot be negative and pages start at 1")
+        raise typer.Exit(1)
+    try:
+        sizes = [parse_size(s) if s else None for s in (min_size, max_size)]
+    except ValueError as e:
+        print_error(f"Invalid size: {e}")
+        raise typer.Exit(1)
+
+    offset = (page - 1) * limit
+    entries, total = catalog.search(
+        name=query,
+        file_type=file_type,
+        min_size=sizes[0],
+        max_size=sizes[1],
+        since=since,
+        until=until,
+        sort=sort,
+        descending=reverse,
+        limit=limit or None,
+        offset=offset,
+    )
+    if not total:
+        print_warning("No matching files")
+        return
+    print_entries(entries, start=offset + 1)
+    if entries:
+        pages = -(-total // limit) if limit else 1
+        print_info(
+            f"Showing {offset + 1}-{offset + len(entries)} of {total} files "
+            f"(page {page}/{pages})"
+        )
+    else:
+        print_warning(f"Page {page} is past the last of {total} files")
 
-    async def _upload():
-        if not check_pre_requirements():
-            return
-        file_checksum = calculate_checksum(file_path)
 
-        global_metadatas = FileMetadata.get_metadatas(config.global_metafile)
+app.command("ls", help="Alias of search")(search)
+
 
-        for data in global_metadatas:
-            if data.checksum == file_checksum:
+def collect_files(paths: list[Path]) -> list[Path]:
+    """Expand directories (recursively) and glob patterns into a list of files"""
+    files: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.is_file()))
+        elif path.is_file():
+            files.append(path)
+        else:
+            matches = sorted(Path(p) for p in glob.glob(str(path), recursive=True))
+            if not matches:
+                print_warning(f"No files match '{path}'")
+            files.extend(p for p in matches if p.is_file())
+    return list(dict.fromkeys(files))
+
+
+def prepare_upload(
+    file_path: Path, algorithm: str, hashes: HashCache, hash_now: bool = False
+) -> Optional[tuple[FileMetadata, Optional[asyncio.Task]]]:
+    """Build the metadata for a new upload, or None if it is already stored.
+
+    Only a file of the same size can be a duplicate, so the file is hashed up
+    front just for those (or when hash_now is set); otherwise the returned
+    task hashes it alongside the upload. Checksums come from hashes when the
+    file is unchanged since it was last hashed.
+    """
+    file_size = file_path.stat().st_size
+    checksums: dict[str, str] = {}
+    if hash_now:
+        checksums[algorithm] = hashes.checksum(file_path, algorithm)
+    for data in catalog.find_by_size(file_size):
+        data_algorithm = digest_algorithm(data.checksum)
+        if data_algorithm not in HASH_ALGORITHMS:
+            continue
+        if data_algorithm not in checksums:
+            checksums[data_algorithm] = hashes.checksum(file_path, data_algorithm)
+        if data.checksum == checksums[data_algorithm]:
+            print_warning(
+                f"File '{file_path.name}' already exists with name: {data.original_name} and ID: {data.file_id}"
+            )
+            return None
+
+    file_checksum = checksums.get(algorithm)
+    hashing = None
+    if file_checksum is None:
+        hashing = asyncio.create_task(
+            asyncio.to_thread(hashes.checksum, file_path, algorithm)
+        )
+    return FileMetadata.new(file_path, checksum=file_checksum or ""), hashing
+
+
+def print_file_info(metadata: FileMetadata) -> None:
+    print_info(f"Filename: {metadata.original_name}")
+    print_info(f"File Type Detected: {metadata.file_type}")
+    print_info(f"File Format: {metadata.extension}")
+    print_info(f"File Size: {size_in_humanize(metadata.file_size)}")
+
+
+def upload_identity(
+    file_path: Path, chunking: str, average_size: int, algorithm: str
+) -> dict:
+    """What makes two uploads the same transfer, for TransferJournal"""
+    stat = file_path.stat()
+    return {
+        "kind": "upload",
+        "path": str(file_path.resolve()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "chunking": chunking,
+        "average_size": average_size if chunking == "cdc" else 0,
+        "algorithm": algorithm,
+    }
+
+
+async def upload_paths(
+    files: list[Path],
+    concurrency: int,
+    chunking: str,
+    average_size: int,
+    algorithm: str,
+    compression: str,
+    hashes: HashCache,
+    pack_threshold: int = 0,
+) -> None:
+    """Upload files as one batch, resuming any of them that was interrupted.
+
+    Files smaller than pack_threshold are packed together into shared
+    documents instead of taking a message each.
+    """
+    splitter = FileSplitRebuild()
+    # Files sharing a size within the batch are hashed up front so that
+    # duplicates inside the batch are only uploaded once
+    sizes = Counter(f.stat().st_size for f in files)
+    batch_checksums: dict[str, Path] = {}
+
+    uploads = []
+    hashings = []
+    journals: dict[str, TransferJournal] = {}
+    codecs: dict[str, str] = {}
+    packed: dict[Path, FileMetadata] = {}
+    stale: list[TransferJournal] = []
+    try:
+        for file_path in files:
+            pack = 0 < file_path.stat().st_size < pack_threshold
+            prepared = prepare_upload(
+                file_path,
+                algorithm,
+                hashes,
+                hash_now=pack or sizes[file_path.stat().st_size] > 1,
+            )
+            if prepared is None:
+                # Already stored, so an interrupted upload of it has nothing left
+                left = TransferJournal.find(
+                    config.transfers_dir,
+                    upload_identity(file_path, chunking, average_size, algorithm),
+                )
+                if left is not None:
+                    stale.append(left)
+                continue
+            metadata, hashing = prepared
+            if metadata.checksum in batch_checksums:
                 print_warning(
-                    f"File '{file_path.name}' already exists with name: {data.original_name} and ID: {data.file_id}"
+                    f"File '{file_path}' duplicates '{batch_checksums[metadata.checksum]}' in this upload"
                 )
-                return
+                continue
+            if metadata.checksum:
+                batch_checksums[metadata.checksum] = file_path
+            if pack:
+                packed[file_path] = metadata
+                continue
+            with metrics.span("split"):
+                if chunking == "cdc":
+                    chunks = list(
+                        splitter._iter_cdc_slices(file_path, average_size, algorithm)
+                    )
+                else:
+                    chunks = list(splitter._iter_slices(file_path, algorithm))
+            transfer = TransferJournal.open(
+                config.transfers_dir,
+                upload_identity(file_path, chunking, average_size, algorithm),
+                file_id=metadata.file_id,
+            )
+            metadata.file_id = transfer.header["file_id"]
+            journals[metadata.file_id] = transfer
+            codec = choose_codec(file_path, metadata.file_type, compression)
+            if codec is not None:
+                codecs[metadata.file_id] = codec
+            if len(files) == 1:
+                print_file_info(metadata)
+            print_info(
+                f"Uploading {file_path.name} ({len(chunks)} chunks"
+                f"{f', {codec} compressed' if codec else ''})"
+            )
+            uploads.append((metadata, chunks))
+            hashings.append(hashing)
+        if stale:
+            await discard_uploads(stale)
+        if not uploads and not packed:
+            return
 
-        metadata = FileMetadata.new(file_path)
-        print_info(f"Filename: {metadata.original_name}")
-        print_info(f"File Type Detected: {metadata.file_type}")
-        print_info(f"File Format: {metadata.extension}")
-        print_info(f"File Size: {size_in_humanize(metadata.file_size)}")
-        print_info(f"File Checksum: {metadata.checksum}")
-        splitter = FileSplitRebuild()
-        chunks = list(splitter._split_file(file_path))
-
-        print_info(f"Uploading {file_path.name} ({len(chunks)} chunks)")
-        for idx, chunk in enumerate(chunks, start=1):
-            message = await telegram_manager.upload_file(chunk)
-            metadata.chunks.append(
-                ChunkInfo.new(message_id=message.id, file=chunk, index=idx)
+        if packed:
+            packs = [
+                (
+                    PackSlice(paths, f"{uuid.uuid4().hex[:12]}.pack"),
+                    [packed[p] for p in paths],
+                )
+                for paths in group_packs(list(packed))
+            ]
+            print_info(f"Packing {len(packed)} small files into {len(packs)} documents")
+            # Each pack is committed as soon as it is stored: nothing could
+            # resume its members if a later pack or the rest fails
+            await upload_packs(
+                telegram_manager, packs, concurrency, on_stored=catalog.add_many
             )
-            chunk.unlink()
-        global_metadatas.append(metadata)
-        FileMetadata.push_metadatas(global_metadatas, config.global_metafile)
-        global_metadata_message = await telegram_manager.upload_file(
-            config.global_metafile
+
+        if uploads:
+            resumed = [j for j in journals.values() if j.completed]
+            await check_upload_journals(telegram_manager, resumed)
+            for transfer in resumed:
+                print_info(
+                    f"Resuming {Path(transfer.header['path']).name}: "
+                    f"{len(transfer.completed)} chunks already uploaded"
+                )
+
+            await upload_files(
+                telegram_manager,
+                uploads,
+                concurrency,
+                find_chunk=catalog.find_chunk if chunking == "cdc" else None,
+                journals=journals,
+                codecs=codecs,
+            )
+            for (metadata, _), hashing in zip(uploads, hashings):
+                if hashing is not None:
+                    metadata.checksum = await hashing
+            catalog.add_many(metadata for metadata, _ in uploads)
+            # Stored from here on, even if the push below fails
+            for metadata, _ in uploads:
+                journals[metadata.file_id].finish()
+
+        await journal.push()
+        if packed:
+            print_success(f"✅ Upload complete! {len(packed)} small files packed")
+        for metadata, _ in uploads:
+            print_info(f"{metadata.original_name} checksum: {metadata.checksum}")
+            print_success(
+                f"✅ Upload complete! {metadata.original_name} File ID: {metadata.file_id}"
+            )
+    finally:
+        # Hashing left running by a failed upload is of no use any more
+        started = [hashing for hashing in hashings if hashing is not None]
+        for hashing in started:
+            hashing.cancel()
+        await asyncio.gather(*started, return_exceptions=True)
+
+
+async def upload_stream(
+    name: str, concurrency: int, algorithm: str, compression: str
+) -> None:
+    """Upload stdin as a file called name, cutting it into parts as it arrives"""
+    metadata = FileMetadata.new_stream(name)
+    codec = choose_codec(None, metadata.file_type, compression)
+    stream = StreamSlices(sys.stdin.buffer, name, config.stream_part_size, algorithm)
+    print_info(
+        f"Uploading {name} from stdin in parts of "
+        f"{size_in_humanize(config.stream_part_size)}"
+        f"{f', {codec} compressed' if codec else ''}"
+    )
+    try:
+        await upload_files(
+            telegram_manager,
+            [(metadata, stream)],
+            concurrency,
+            codecs={metadata.file_id: codec} if codec else None,
         )
-        config.metadata_message_id = global_metadata_message.id
-        print_success(f"✅ Upload complete! File ID: {metadata.file_id}")
+    except Exception:
+        # A stream cannot be resumed, so its parts would only take up space
+        if metadata.chunks:
+            await delete_messages(c.location for c in metadata.chunks)
+        raise
+    metadata.file_size = stream.size
+    metadata.checksum = stream.checksum()
+
+    for data in catalog.find_by_size(metadata.file_size):
+        if data.checksum == metadata.checksum:
+            print_warning(
+                f"'{name}' already exists with name: {data.original_name} and ID: {data.file_id}"
+            )
+            await delete_messages(c.location for c in metadata.chunks)
+            return
 
-    run_coroutine(_upload())
+    catalog.add_many([metadata])
+    await journal.push()
+    print_info(f"{name}: {size_in_humanize(metadata.file_size)}")
+    print_info(f"{name} checksum: {metadata.checksum}")
+    print_success(f"✅ Upload complete! {name} File ID: {metadata.file_id}")
 
 
 @app.command()
-def download(file_id: str, output_dir: Path = Path.cwd()) -> None:
-    """Download a file from Telegram storage"""
+def upload(
+    paths: list[Path] = typer.Argument(
+        ..., help="Files, directories or glob patterns to upload, or - for stdin"
+    ),
+    name: Optional[str] = typer.Option(
+        None, "--name", help="Name to store stdin under when uploading -"
+    ),
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Chunks to upload in parallel"
+    ),
+    chunking: Optional[str] = typer.Option(
+        None,
+        "--chunking",
+        help="'fixed' size chunks, or content-defined 'cdc' chunks that are "
+        "deduplicated against every stored chunk",
+    ),
+    compression: Optional[str] = typer.Option(
+        None,
+        "--compression",
+        help="'auto' compresses files that look compressible, 'off' disables "
+        "compression, 'zstd' or 'zlib' always compress",
+    ),
+    pack: Optional[bool] = typer.Option(
+        None,
+        "--pack/--no-pack",
+        help="Pack files smaller than pack_threshold into shared documents",
+    ),
+) -> None:
+    """Upload files to Telegram storage"""
+    chunking = chunking or config.chunking
+    if chunking not in ("fixed", "cdc"):
+        print_error(f"Unknown chunking mode: {chunking}")
+        raise typer.Exit(1)
+    compression = compression or config.compression
+    if compression not in ("auto", "off", "zstd", "zlib"):
+        print_error(f"Unknown compression mode: {compression}")
+        raise typer.Exit(1)
+
+    streaming = [str(p) for p in paths] == ["-"]
+    if streaming and not name:
+        print_error("Uploading stdin needs a file name: upload - --name NAME")
+        raise typer.Exit(1)
+    if name and not streaming:
+        print_error("--name only applies when uploading stdin (-)")
+        raise typer.Exit(1)
+    if streaming and chunking == "cdc":
+        print_warning(
+            "Content-defined chunking needs a file, stdin is cut in fixed parts"
+        )
+
+    async def _upload():
+        if not check_pre_requirements():
+            return
+        if streaming:
+            await upload_stream(
+                Path(name).name,
+                concurrency or config.upload_concurrency,
+                resolve_algorithm(config.hash_algorithm),
+                compression,
+            )
+            print_throughput()
+            return
+        files = collect_files(paths)
+        if not files:
+            print_error("No files to upload")
+            return
+        hashes = HashCache(config.hash_cache_file)
+        try:
+            await upload_paths(
+                files,
+                concurrency or config.upload_concurrency,
+                chunking,
+                config.cdc_average_size,
+                resolve_algorithm(config.hash_algorithm),
+                compression,
+                hashes,
+                pack_threshold=config.pack_threshold
+                if (config.pack_small_files if pack is None else pack)
+                else 0,
+            )
+        finally:
+            hashes.close()
+        print_throughput()
+
+    run_coroutine(with_connection(_upload()))
+
+
+def walk_files(root: Path) -> Iterator[tuple[Path, os.stat_result]]:
+    """Every file under root with its stat, in a stable order, not following links"""
+    with os.scandir(root) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(Path(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                yield Path(entry.path), entry.stat(follow_symlinks=False)
+
+
+def stored_file_id(stat: os.stat_result, hashes: HashCache) -> Optional[str]:
+    """Id of a stored file with the contents a local file had when it was hashed"""
+    for algorithm in HASH_ALGORITHMS:
+        checksum = hashes.get(stat, algorithm)
+        if checksum is not None and (matches := catalog.find_by_checksum(checksum)):
+            return matches[0].file_id
+    return None
 
+
+@app.command()
+def mirror(
+    directory: Path = typer.Argument(..., help="Directory to mirror"),
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Chunks to upload in parallel"
+    ),
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="List what would be uploaded, upload nothing"
+    ),
+) -> None:
+    """Upload what is new or changed in a directory since it was last mirrored"""
+    if not directory.is_dir():
+        print_error(f"{directory} is not a directory")
+        raise typer.Exit(1)
+    root = directory.resolve()
+
+    async def _mirror():
+        if not check_pre_requirements():
+            return
+        hashes = HashCache(config.hash_cache_file)
+        try:
+            await mirror_directory(
+                root, concurrency or config.upload_concurrency, hashes, dry_run
+            )
+        finally:
+            hashes.close()
+
+    run_coroutine(with_connection(_mirror()))
+
+
+async def mirror_directory(
+    root: Path, concurrency: int, hashes: HashCache, dry_run: bool
+) -> None:
+    """Upload the files under root that changed since the last mirror of it.
+
+    A file is unchanged if it is stored as it was mirrored last time and its
+    stat matches when hashes last hashed it, so unchanged files are only
+    stat()ed. The file id each path is stored as is recorded in the catalog.
+    """
+    mirrored = catalog.mirrored(str(root))
+    changed: dict[Path, os.stat_result] = {}
+    seen: set[str] = set()
+    unchanged = 0
+    for path, stat in walk_files(root):
+        relative = path.relative_to(root).as_posix()
+        seen.add(relative)
+        checksum = mirrored.get(relative)
+        if checksum and hashes.get(stat, digest_algorithm(checksum)) == checksum:
+            unchanged += 1
+        else:
+            changed[path] = stat
+    gone = mirrored.keys() - seen
+    print_info(
+        f"{root}: {len(changed)} new or changed, {unchanged} unchanged"
+        + (f", {len(gone)} no longer there (kept in storage)" if gone else "")
+    )
+    if dry_run:
+        for path in changed:
+            print_info(f"  {path.relative_to(root)}")
+        return
+
+    if changed:
+        await upload_paths(
+            list(changed),
+            concurrency,
+            config.chunking,
+            config.cdc_average_size,
+            resolve_algorithm(config.hash_algorithm),
+            config.compression,
+            hashes,
+            pack_threshold=config.pack_threshold if config.pack_small_files else 0,
+        )
+        print_throughput()
+    # Files changed since they were hashed are left for the next mirror
+    stored = {
+        path.relative_to(root).as_posix(): file_id
+        for path, stat in changed.items()
+        if (file_id := stored_file_id(stat, hashes)) is not None
+    }
+    catalog.record_mirror(str(root), stored, gone)
+    print_success(
+        f"✅ Mirrored {root}: {len(stored)} files stored, {unchanged} unchanged"
+    )
+
+
+def print_throughput() -> None:
+    """Summarise what the scheduler saw of the transfers just run"""
+    stats = telegram_manager.scheduler.stats()
+    if not stats["bytes"]:
+        return
+    summary = (
+        f"Throughput: {size_in_humanize(int(stats['throughput']))}/s, "
+        f"{stats['window']}/{stats['max_concurrency']} transfers at once"
+    )
+    if stats["flood_waits"]:
+        summary += (
+            f", {stats['flood_waits']} flood waits ({stats['flood_wait_seconds']:.0f}s)"
+        )
+    print_info(summary)
+
+
+def output_paths(metadatas: list[FileMetadata], output_dir: Path) -> list[Path]:
+    """Output path per file, suffixing the file id when names collide"""
+    paths = []
+    used: set[str] = set()
+    for metadata in metadatas:
+        name = metadata.original_name
+        if name in used:
+            stem, suffix = Path(name).stem, Path(name).suffix
+            name = f"{stem}-{metadata.file_id[:8]}{suffix}"
+        used.add(name)
+        paths.append(output_dir / name)
+    return paths
+
+
+def open_chunk_cache() -> Optional[ChunkCache]:
+    if config.chunk_cache_size <= 0:
+        return None
+    return ChunkCache(config.chunk_cache_dir, config.chunk_cache_size)
+
+
+async def download_targets(
+    targets: list[tuple[FileMetadata, Path]], concurrency: int
+) -> None:
+    """Download files to the given paths, resuming any that was interrupted"""
+    journals: dict[Path, TransferJournal] = {}
+    for metadata, output_path in targets:
+        journals[output_path] = TransferJournal.open(
+            config.transfers_dir,
+            {
+                "kind": "download",
+                "file_id": metadata.file_id,
+                "checksum": metadata.checksum,
+                "output_path": str(output_path.resolve()),
+            },
+        )
+        if len(targets) == 1:
+            print_file_info(metadata)
+            print_info(f"File Checksum: {metadata.checksum}")
+        print_info(
+            f"Downloading {metadata.original_name} ({len(metadata.chunks)} chunks)..."
+        )
+
+    cache = open_chunk_cache()
+    try:
+        downloaded = await download_files(
+            telegram_manager, targets, concurrency, journals=journals, cache=cache
+        )
+    finally:
+        if cache is not None:
+            if cache.hits:
+                print_info(f"Chunk cache: {cache.hits} hits, {cache.misses} misses")
+            cache.close()
+    print_throughput()
+    for output_path in downloaded:
+        print_success(f"✅ Download complete: {output_path}")
+
+
+def run_download(file_ids: list[str], output_dir: Path, concurrency: int) -> None:
     async def _download():
         if not check_pre_requirements():
             return
 
-        global_metadatas = FileMetadata.get_metadatas(config.global_metafile)
+        metadatas = []
+        for file_id in dict.fromkeys(file_ids):
+            metadata = catalog.get(file_id)
+            if not metadata:
+                print_error(f"File with ID {file_id} not found in metadata.")
+                return
+            metadatas.append(metadata)
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        targets = output_paths(metadatas, output_dir)
+        await download_targets(list(zip(metadatas, targets)), concurrency)
+
+    run_coroutine(with_connection(_download()))
+
+
+@app.command()
+def download(
+    file_id: str,
+    output_dir: Path = Path.cwd(),
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Chunks to download in parallel"
+    ),
+) -> None:
+    """Download a file from Telegram storage"""
+    run_download([file_id], output_dir, concurrency or config.download_concurrency)
+
+
+@app.command()
+def download_batch(
+    file_ids: list[str] = typer.Argument(..., help="IDs of the files to download"),
+    output_dir: Path = typer.Option(Path.cwd(), "--output-dir", "-o"),
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Chunks to download in parallel"
+    ),
+) -> None:
+    """Download several files from Telegram storage on one shared worker pool"""
+    run_download(file_ids, output_dir, concurrency or config.download_concurrency)
+
 
-        metadata = next((m for m in global_metadatas if m.file_id == file_id), None)
+@app.command()
+def cat(
+    file_id: str,
+    offset: int = typer.Option(0, "--offset", help="First byte to print"),
+    length: Optional[int] = typer.Option(
+        None, "--length", help="Bytes to print, to the end of the file by default"
+    ),
+) -> None:
+    """Write a byte range of a file to stdout, fetching only the chunks it covers"""
+
+    async def _cat():
+        if not check_pre_requirements():
+            return
+        if offset < 0 or (length is not None and length < 0):
+            print_error("Offset and length cannot be negative")
+            return
+        metadata = catalog.get(file_id)
         if not metadata:
             print_error(f"File with ID {file_id} not found in metadata.")
             return
 
-        output_path = output_dir / metadata.original_name
-        output_dir.mkdir(parents=True, exist_ok=True)
+        from core.progress import TransferDashboard
 
-        print_info(f"Filename: {metadata.original_name}")
-        print_info(f"File Type Detected: {metadata.file_type}")
-        print_info(f"File Format: {metadata.extension}")
-        print_info(f"File Size: {size_in_humanize(metadata.file_size)}")
-        print_info(f"File Checksum: {metadata.checksum}")
+        # Progress bars would end up in the output
+        telegram_manager.dashboard = TransferDashboard("quiet")
+        cache = open_chunk_cache()
+        reader = RangeReader(telegram_manager, metadata, chunk_cache=cache)
+        end = reader.size if length is None else min(offset + length, reader.size)
+        out = sys.stdout.buffer
+        try:
+            position = offset
+            while position < end:
+                data = await reader.read(position, min(CAT_READ_SIZE, end - position))
+                out.write(data)
+                position += len(data)
+            out.flush()
+        finally:
+            reader.close()
+            telegram_manager.dashboard = None
+            if cache is not None:
+                cache.close()
+
+    run_coroutine(with_connection(_cat()))
+
+
+def sent_requests() -> int:
+    """Requests sent to Telegram so far, over every shard"""
+    return sum(
+        telegram_manager.shard(i).scheduler.requests
+        for i in range(telegram_manager.shard_count)
+    )
+
+
+def catalog_problems(metadata: FileMetadata) -> list[str]:
+    """Inconsistencies between a file's record and its chunks"""
+    problems = []
+    indexes = sorted(c.index for c in metadata.chunks)
+    if indexes != list(range(1, len(indexes) + 1)):
+        problems.append(f"chunk indexes are {indexes}, expected 1-{len(indexes)}")
+    chunk_bytes = sum(c.size for c in metadata.chunks)
+    if chunk_bytes != metadata.file_size:
+        problems.append(
+            f"chunks hold {chunk_bytes} bytes, the file has {metadata.file_size}"
+        )
+    return problems
+
+
+def chunk_problem(chunk: ChunkInfo, sizes: dict[tuple[int, int], int]) -> Optional[str]:
+    """Why a chunk's stored document does not hold it, if it does not"""
+    shard, message_id = chunk.location
+    where = f"message {message_id}{f' on shard {shard}' if shard else ''}"
+    stored = sizes.get(chunk.location)
+    if stored is None:
+        return f"chunk {chunk.index}: {where} is missing"
+    if chunk.offset is not None:
+        if stored < chunk.offset + chunk.size:
+            return (
+                f"chunk {chunk.index}: {where} is {stored} bytes, "
+                f"too short for bytes {chunk.offset}-{chunk.offset + chunk.size}"
+            )
+    elif stored != chunk.stored_size:
+        return (
+            f"chunk {chunk.index}: {where} is {stored} bytes, "
+            f"expected {chunk.stored_size}"
+        )
+    return None
 
-        print_info(
-            f"Downloading {metadata.original_name} ({len(metadata.chunks)} chunks)..."
+
+@app.command()
+def verify(
+    file_ids: Optional[list[str]] = typer.Argument(
+        None, help="IDs of the files to verify, every file by default"
+    ),
+    deep: bool = typer.Option(
+        False,
+        "--deep",
+        help="Also stream every chunk and check its checksum, writing nothing to disk",
+    ),
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Chunks to stream in parallel per shard"
+    ),
+) -> None:
+    """Check that stored files are intact without downloading them.
+
+    By default only looks up every chunk's document, many per request, and
+    compares its size; --deep checks the stored bytes too. Exits with 1 if
+    a file is damaged, or 2 if some chunks could not be checked.
+    """
+    status = 0
+
+    async def _verify():
+        nonlocal status
+        if not check_pre_requirements():
+            return
+        if file_ids:
+            metadatas = []
+            for file_id in file_ids:
+                metadata = catalog.get(file_id)
+                if metadata is None:
+                    print_error(f"File with ID {file_id} not found in metadata.")
+                    status = 1
+                    continue
+                metadatas.append(metadata)
+        else:
+            metadatas = list(catalog)
+        if not metadatas:
+            print_warning("No files to verify")
+            return
+
+        requests_before = sent_requests()
+        problems: dict[str, list[str]] = {
+            m.file_id: catalog_problems(m) for m in metadatas
+        }
+        locations = {c.location for m in metadatas for c in m.chunks}
+        sizes = await stored_sizes(telegram_manager, locations)
+        # Chunks whose document is there, the only ones worth streaming
+        present = []
+        for metadata in metadatas:
+            for chunk in metadata.chunks:
+                problem = chunk_problem(chunk, sizes)
+                if problem is None:
+                    present.append(chunk)
+                else:
+                    problems[metadata.file_id].append(problem)
+
+        # Errors that kept a chunk from being checked, by file
+        unchecked: dict[str, list[str]] = {m.file_id: [] for m in metadatas}
+        if deep:
+            damaged, unverified = await verify_chunks(
+                telegram_manager, present, concurrency or config.download_concurrency
+            )
+            for failures, found in ((damaged, problems), (unverified, unchecked)):
+                failed = {(c.location, c.offset): e for c, e in failures}
+                for metadata in metadatas:
+                    for chunk in metadata.chunks:
+                        error = failed.get((chunk.location, chunk.offset))
+                        if error is not None:
+                            reason = str(error) or type(error).__name__
+                            found[metadata.file_id].append(
+                                f"chunk {chunk.index}: {reason}"
+                            )
+
+        broken = [m for m in metadatas if problems[m.file_id]]
+        for metadata in broken:
+            print_error(f"{metadata.original_name} (ID: {metadata.file_id}):")
+            for problem in problems[metadata.file_id]:
+                print_error(f"  {problem}")
+        uncertain = [
+            m for m in metadatas if unchecked[m.file_id] and not problems[m.file_id]
+        ]
+        for metadata in uncertain:
+            print_warning(
+                f"{metadata.original_name} (ID: {metadata.file_id}), could not verify:"
+            )
+            for error in unchecked[metadata.file_id]:
+                print_warning(f"  {error}")
+        requests = sent_requests() - requests_before
+        checked = (
+            f"{len(metadatas)} files, {sum(len(m.chunks) for m in metadatas)} chunks "
+            f"in {len(locations)} documents checked{' byte by byte' if deep else ''} "
+            f"with {requests} requests"
         )
+        if broken:
+            status = 1
+            print_warning(f"{len(broken)} files damaged; {checked}")
+        elif uncertain:
+            status = status or 2
+            print_warning(f"{len(uncertain)} files could not be verified; {checked}")
+        else:
+            print_success(f"✅ All intact: {checked}")
+
+    run_coroutine(with_connection(_verify()))
+    if status:
+        raise typer.Exit(status)
+
+
+async def delete_messages(messages: Iterable[tuple[int, int]]) -> bool:
+    """Delete (shard, message id) chunk messages in bulk, reporting failed batches"""
+    by_shard: dict[int, set[int]] = {}
+    for shard, message_id in messages:
+        by_shard.setdefault(shard, set()).add(message_id)
+    if not by_shard:
+        return True
+    total = failed = 0
+    for shard, message_ids in sorted(by_shard.items()):
+        failures = await telegram_manager.shard(shard).delete_files(sorted(message_ids))
+        for batch, error in failures:
+            print_error(
+                f"Failed to delete {len(batch)} chunk messages "
+                f"({', '.join(map(str, batch))}){f' on shard {shard}' if shard else ''}: "
+                f"{error}"
+            )
+        total += len(message_ids)
+        failed += sum(len(batch) for batch, _ in failures)
+    print_info(f"Deleted {total - failed} chunk messages from Telegram")
+    if failed:
+        print_warning(
+            f"{failed} chunk messages were left in the storage chat; delete them there"
+        )
+    return not failed
+
+
+async def discard_uploads(transfers: list[TransferJournal]) -> None:
+    """Drop upload journals, deleting the chunks they sent that no file uses"""
+    uploaded = {
+        ChunkInfo.from_dict(c).location
+        for transfer in transfers
+        for c in transfer.completed.values()
+    }
+    await delete_messages(uploaded - catalog.referenced_messages(uploaded))
+    for transfer in transfers:
+        transfer.finish()
+
 
-        chunk_files = []
-        for chunk in metadata.chunks:
-            chunk_path = output_dir / chunk.name
-            chunk_path = await telegram_manager.download_file(
-                chunk.message_id, chunk_path
+@app.command()
+def resume(
+    concurrency: Optional[int] = typer.Option(
+        None, "--concurrency", "-c", help="Chunks to transfer in parallel"
+    ),
+    discard: bool = typer.Option(
+        False,
+        "--discard",
+        help="Abandon the unfinished transfers instead, deleting chunks they uploaded",
+    ),
+) -> None:
+    """Resume uploads and downloads that were interrupted"""
+
+    async def _resume():
+        if not check_pre_requirements():
+            return
+        transfers = TransferJournal.pending(config.transfers_dir)
+        if not transfers:
+            print_info("No unfinished transfers")
+            return
+
+        if discard:
+            await discard_uploads([t for t in transfers if t.kind == "upload"])
+            for transfer in transfers:
+                if transfer.kind == "download":
+                    output_path = Path(transfer.header["output_path"])
+                    output_path.with_name(f"{output_path.name}.tmp").unlink(
+                        missing_ok=True
+                    )
+                    transfer.finish()
+            print_success(f"✅ Discarded {len(transfers)} unfinished transfers")
+            return
+
+        # Uploads resume with the settings they were started with
+        batches: dict[tuple[str, int, str], list[Path]] = {}
+        for transfer in transfers:
+            if transfer.kind != "upload":
+                continue
+            file_path = Path(transfer.header["path"])
+            if not file_path.exists() or transfer.identity != upload_identity(
+                file_path,
+                transfer.header["chunking"],
+                transfer.header["average_size"],
+                transfer.header["algorithm"],
+            ):
+                print_warning(
+                    f"'{file_path}' changed since its upload started; "
+                    "run 'resume --discard' to drop it"
+                )
+                continue
+            key = (
+                transfer.header["chunking"],
+                transfer.header["average_size"],
+                transfer.header["algorithm"],
             )
-            chunk_files.append(chunk_path)
+            batches.setdefault(key, []).append(file_path)
+        hashes = HashCache(config.hash_cache_file)
+        try:
+            for (chunking, average_size, algorithm), files in batches.items():
+                await upload_paths(
+                    files,
+                    concurrency or config.upload_concurrency,
+                    chunking,
+                    average_size,
+                    algorithm,
+                    config.compression,
+                    hashes,
+                    pack_threshold=config.pack_threshold
+                    if config.pack_small_files
+                    else 0,
+                )
+        finally:
+            hashes.close()
+
+        targets = []
+        for transfer in transfers:
+            if transfer.kind != "download":
+                continue
+            metadata = catalog.get(transfer.header["file_id"])
+            if metadata is None or metadata.checksum != transfer.header["checksum"]:
+                print_warning(
+                    f"File with ID {transfer.header['file_id']} changed or was deleted; "
+                    "run 'resume --discard' to drop its download"
+                )
+                continue
+            targets.append((metadata, Path(transfer.header["output_path"])))
+        if targets:
+            await download_targets(targets, concurrency or config.download_concurrency)
 
-        print_info(f"Rebuilding {metadata.original_name} from chunks...")
-        FileSplitRebuild()._recombine_files(metadata.to_dict(), output_dir)
-        for chunk_path in chunk_files:
-            chunk_path.unlink()
+    run_coroutine(with_connection(_resume()))
 
-        print_success(f"✅ Download complete: {output_path}")
 
-    run_coroutine(_download())
+@app.command()
+def cache(
+    size: Optional[int] = typer.Option(
+        None, "--size", help="Set the cache budget in bytes, 0 disables the cache"
+    ),
+    clear: bool = typer.Option(False, "--clear", help="Remove every cached chunk"),
+) -> None:
+    """Show or manage the local cache of downloaded chunks"""
+    if size is not None:
+        if size < 0:
+            print_error("Cache size cannot be negative")
+            return
+        config.chunk_cache_size = size
+    chunk_cache = ChunkCache(config.chunk_cache_dir, config.chunk_cache_size)
+    try:
+        if clear:
+            chunk_cache.clear()
+            print_success("✅ Chunk cache cleared")
+        elif size is not None:
+            # Evicts down to a smaller budget right away
+            chunk_cache.trim()
+        stats = chunk_cache.stats()
+    finally:
+        chunk_cache.close()
+
+    if not config.chunk_cache_size:
+        print_warning("Chunk cache is disabled, enable it with: cache --size <bytes>")
+    lookups = stats["hits"] + stats["misses"]
+    hit_ratio = f"{stats['hits'] / lookups:.0%}" if lookups else "-"
+    print_info(f"Directory: {config.chunk_cache_dir}")
+    print_info(
+        f"Cached: {stats['entries']} chunks, {size_in_humanize(stats['size'])} "
+        f"of {size_in_humanize(stats['max_size'])}"
+    )
+    print_info(
+        f"Hits: {stats['hits']} ({size_in_humanize(stats['bytes_hit'])}), "
+        f"misses: {stats['misses']}, hit ratio: {hit_ratio}, "
+        f"evictions: {stats['evictions']}"
+    )
 
 
 @app.command()
@@ -235,14 +1253,7 @@ def delete(file_id: str) -> None:
         if not check_pre_requirements():
             return
 
-        global_metadatas = FileMetadata.get_metadatas(config.global_metafile)
-
-        metadata_to_delete: Optional[FileMetadata] = None
-        for data in global_metadatas:
-            if data.file_id == file_id:
-                metadata_to_delete = data
-                break
-
+        metadata_to_delete = catalog.get(file_id)
         if metadata_to_delete is None:
             print_error(f"File with ID {file_id} not found")
             return
@@ -254,25 +1265,36 @@ def delete(file_id: str) -> None:
             print_warning("Deletion cancelled!")
             return
 
-        for chunk_info in metadata_to_delete.chunks:
-            await telegram_manager.delete_file(chunk_info.message_id)
-            print_info(f"Deleted chunk {chunk_info.name} from Telegram")
-
-        FileMetadata.push_metadatas(
-            [data for data in global_metadatas if data.file_id != file_id],
-            config.global_metafile,
-        )
-
-        global_metadata_message = await telegram_manager.upload_file(
-            config.global_metafile
-        )
-        config.metadata_message_id = global_metadata_message.id
-
-        print_success(
-            f"✅ File with ID {file_id} deleted from Telegram and local metadata"
-        )
+        # Deduplicated chunks and packs shared with other files stay in place
+        exclusive = catalog.exclusive_messages([file_id])
+        shared = {c.location for c in metadata_to_delete.chunks} - set(exclusive)
+        deleted = await delete_messages(exclusive)
+
+        catalog.remove(file_id)
+        await journal.push()
+
+        if not deleted:
+            print_warning(f"File with ID {file_id} removed from local metadata")
+        elif shared and not exclusive:
+            kept = (
+                "its pack was kept, as other files are stored in it"
+                if any(c.offset is not None for c in metadata_to_delete.chunks)
+                else "its chunks were kept, as other files share them"
+            )
+            print_success(
+                f"✅ File with ID {file_id} removed from local metadata; {kept}"
+            )
+        elif shared:
+            print_success(
+                f"✅ File with ID {file_id} deleted from Telegram and local metadata, "
+                f"except {len(shared)} chunks other files share"
+            )
+        else:
+            print_success(
+                f"✅ File with ID {file_id} deleted from Telegram and local metadata"
+            )
 
-    run_coroutine(_delete())
+    run_coroutine(with_connection(_delete()))
 
 
 @app.command()
@@ -283,7 +1305,7 @@ def delete_all() -> None:
         if not check_pre_requirements():
             return
 
-        global_metadata = FileMetadata.get_metadatas(config.global_metafile)
+        global_metadata = list(catalog)
 
         if not global_metadata:
             print_warning("No files found!")
@@ -301,22 +1323,19 @@ def delete_all() -> None:
             print_warning("Deletion cancelled")
             return
 
-        for metadata in global_metadata:
-            for chunk_info in metadata.chunks:
-                await telegram_manager.delete_file(chunk_info.message_id)
-                print_info(f"Deleted chunk {chunk_info.name} from Telegram")
-
-        # config.global_metafile.write_text(Json.dumps([], indent=4))
-        FileMetadata.push_metadatas([], config.global_metafile)
-
-        global_metadata_message = await telegram_manager.upload_file(
-            config.global_metafile
+        deleted = await delete_messages(
+            c.location for m in global_metadata for c in m.chunks
         )
-        config.metadata_message_id = global_metadata_message.id
 
-        print_success("✅ All files deleted from Telegram and local metadata")
+        catalog.clear()
+        await journal.push()
+
+        if deleted:
+            print_success("✅ All files deleted from Telegram and local metadata")
+        else:
+            print_warning("All files removed from local metadata")
 
-    run_coroutine(_delete_all())
+    run_coroutine(with_connection(_delete_all()))
 
 
 if __name__ == "__main__":
@@ -1,4 +1,11 @@
-from .config_manager import Config
+from .config_manager import Config, ShardConfig
 from .telegram_client import TelegramManager
 from .metadata import FileMetadata, ChunkInfo
-from .file_processor import FileSplitRebuild, CHUNK_SIZE
+from .file_processor import FileSplitRebuild, FileSlice, CHUNK_SIZE
+from .catalog import Catalog
+from .journal import MetadataJournal
+from .transfer_journal import TransferJournal
+from .chunk_cache import ChunkCache
+from .hash_cache import HashCache
+from .reader import RangeReader, StoredFile
+from .scheduler import RequestScheduler
@@ -0,0 +1,473 @@
+"""Indexed local catalog of stored files"""
+
+import json
+import re
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from .metadata import ChunkInfo, FileMetadata
+
+SCHEMA_VERSION = 3
+
+# Casefolded names by files rowid, as trigrams, so that substring and glob
+# matches are index lookups; needs SQLite 3.34+ built with FTS5. Rowids of
+# files are not kept by VACUUM, after which _index_names has to run again.
+NAME_INDEX_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS name_index USING fts5 (name, tokenize = 'trigram');
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_checksum ON files (checksum);
+CREATE INDEX IF NOT EXISTS files_size ON files (file_size);
+CREATE INDEX IF NOT EXISTS files_name ON files (original_name);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    file_id TEXT NOT NULL REFERENCES files (file_id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    checksum TEXT,
+    data TEXT NOT NULL,
+    shard INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE INDEX IF NOT EXISTS chunks_message ON chunks (shard, message_id);
+CREATE INDEX IF NOT EXISTS chunks_checksum ON chunks (checksum);
+
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- Local to this machine: left out of the journal and of snapshots
+CREATE TABLE IF NOT EXISTS mirrored (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (root, path)
+);
+"""
+
+FILE_COLUMNS = (
+    "file_id",
+    "original_name",
+    "file_type",
+    "extension",
+    "checksum",
+    "file_size",
+    "created_at",
+)
+
+GLOB_CHARS = re.compile(r"[*?\[\]]")
+SORT_COLUMNS = {
+    "name": "casefold(original_name)",
+    "size": "file_size",
+    "date": "created_at",
+    "type": "file_type",
+}
+
+
+def name_glob(query: str) -> str:
+    """GLOB over casefolded names for a query: itself if a glob, else a substring"""
+    query = query.casefold()
+    if GLOB_CHARS.search(query):
+        return query
+    return f"*{query}*"
+
+
+@dataclass(slots=True, frozen=True)
+class FileEntry:
+    """A file as listed: its catalog row without the chunks"""
+
+    file_id: str
+    original_name: str
+    file_type: str
+    file_size: int
+    created_at: str
+    chunk_count: int
+
+
+class Catalog:
+    """SQLite-backed catalog of FileMetadata, indexed by id, checksum, size and name.
+
+    The JSON list written by FileMetadata.push_metadatas stays the snapshot
+    format on Telegram; import_json/export_json convert between the two.
+    add/remove/clear also append an operation to the journal, which
+    MetadataJournal pushes as small deltas between snapshots.
+    """
+
+    def __init__(self, path: Path, legacy_metafile: Optional[Path] = None):
+        is_new = not path.exists()
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        # SQLite's lower() only folds ASCII; names are indexed with casefold
+        self._db.create_function("casefold", 1, str.casefold, deterministic=True)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if not is_new and version < 3:
+            self._add_shards()
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.executescript(NAME_INDEX_SCHEMA)
+            self._name_index = True
+        except sqlite3.OperationalError:
+            # Searches scan every name instead
+            self._name_index = False
+        if self._name_index and not is_new and version < 2:
+            self._index_names()
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if is_new and legacy_metafile is not None and legacy_metafile.exists():
+            self.import_json(legacy_metafile)
+
+    def _index_names(self) -> None:
+        """(Re)build the name index from the files table"""
+        with self._db:
+            self._db.execute("DELETE FROM name_index")
+            self._db.execute(
+                "INSERT INTO name_index (rowid, name) "
+                "SELECT rowid, casefold(original_name) FROM files"
+            )
+
+    def _add_shards(self) -> None:
+        """Give chunks of a version 1-2 catalog a shard, all on the primary chat"""
+        columns = [row["name"] for row in self._db.execute("PRAGMA table_info(chunks)")]
+        if columns and "shard" not in columns:
+            with self._db:
+                self._db.execute(
+                    "ALTER TABLE chunks ADD COLUMN shard INTEGER NOT NULL DEFAULT 0"
+                )
+                self._db.execute("DROP INDEX IF EXISTS chunks_message_id")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def __iter__(self) -> Iterator[FileMetadata]:
+        chunks: dict[str, list[ChunkInfo]] = {}
+        for row in self._db.execute("SELECT file_id, data FROM chunks ORDER BY idx"):
+            chunks.setdefault(row["file_id"], []).append(
+                ChunkInfo.from_dict(json.loads(row["data"]))
+            )
+        for row in self._db.execute("SELECT * FROM files ORDER BY rowid"):
+            yield FileMetadata(**dict(row), chunks=chunks.get(row["file_id"], []))
+
+    def _load(self, rows: Iterable[sqlite3.Row]) -> list[FileMetadata]:
+        metadatas = []
+        for row in rows:
+            chunks = [
+                ChunkInfo.from_dict(json.loads(c["data"]))
+                for c in self._db.execute(
+                    "SELECT data FROM chunks WHERE file_id = ? ORDER BY idx",
+                    (row["file_id"],),
+                )
+            ]
+            metadatas.append(FileMetadata(**dict(row), chunks=chunks))
+        return metadatas
+
+    def _select(self, where: str, *params) -> list[FileMetadata]:
+        rows = self._db.execute(
+            f"SELECT * FROM files WHERE {where} ORDER BY rowid", params
+        ).fetchall()
+        return self._load(rows)
+
+    def get(self, file_id: str) -> Optional[FileMetadata]:
+        found = self._select("file_id = ?", file_id)
+        return found[0] if found else None
+
+    def find_by_checksum(self, checksum: str) -> list[FileMetadata]:
+        return self._select("checksum = ?", checksum)
+
+    def find_by_size(self, file_size: int) -> list[FileMetadata]:
+        return self._select("file_size = ?", file_size)
+
+    def find_by_name(self, original_name: str) -> list[FileMetadata]:
+        return self._select("original_name = ?", original_name)
+
+    def search(
+        self,
+        name: Optional[str] = None,
+        file_type: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> tuple[list[FileEntry], int]:
+        """One page of matching files, and how many match in total.
+
+        name matches case-insensitively, as a substring or, with * ? or [],
+        as a glob over the whole name, through the trigram name index.
+        file_type is a mimetype or its prefix ("image/"),
+        and since/until bound created_at (ISO dates or datetimes). Sorted by
+        a SORT_COLUMNS key, or in the order files were added.
+        """
+        conditions: list[str] = []
+        params: list = []
+        if name:
+            if self._name_index:
+                conditions.append(
+                    "rowid IN (SELECT rowid FROM name_index WHERE name GLOB ?)"
+                )
+            else:
+                conditions.append("casefold(original_name) GLOB ?")
+            params.append(name_glob(name))
+        if file_type:
+            conditions.append("(file_type = ? OR file_type LIKE ? ESCAPE '\\')")
+            prefix = file_type.replace("\\", "\\\\").replace("%", "\\%")
+            params += [file_type, prefix.replace("_", "\\_") + "%"]
+        if min_size is not None:
+            conditions.append("file_size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("file_size <= ?")
+            params.append(max_size)
+        if since:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until:
+            # A bare date includes the whole day
+            conditions.append("created_at < ?")
+            params.append(until if "T" in until else f"{until}T99")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        total = self._db.execute(
+            f"SELECT COUNT(*) FROM files {where}", params
+        ).fetchone()[0]
+        direction = "DESC" if descending else "ASC"
+        order = (
+            f"{SORT_COLUMNS[sort]} {direction}, rowid" if sort else f"rowid {direction}"
+        )
+        rows = self._db.execute(
+            "SELECT file_id, original_name, file_type, file_size, created_at, "
+            "(SELECT COUNT(*) FROM chunks WHERE chunks.file_id = files.file_id) "
+            f"AS chunk_count FROM files {where} ORDER BY {order} LIMIT ? OFFSET ?",
+            [*params, -1 if limit is None else limit, offset],
+        )
+        return [FileEntry(**dict(row)) for row in rows], total
+
+    def total_size(self) -> int:
+        return self._db.execute(
+            "SELECT COALESCE(SUM(file_size), 0) FROM files"
+        ).fetchone()[0]
+
+    def find_chunk(self, checksum: str) -> Optional[ChunkInfo]:
+        """A stored chunk with this checksum, for chunk-level deduplication"""
+        row = self._db.execute(
+            "SELECT data FROM chunks WHERE checksum = ? LIMIT 1", (checksum,)
+        ).fetchone()
+        return ChunkInfo.from_dict(json.loads(row["data"])) if row else None
+
+    def shard_usage(self) -> dict[int, tuple[int, int]]:
+        """(documents, raw bytes of chunks) stored on each shard"""
+        rows = self._db.execute(
+            "SELECT shard, COUNT(DISTINCT message_id) AS documents, "
+            "SUM(json_extract(data, '$.size')) AS size FROM chunks GROUP BY shard"
+        )
+        return {row["shard"]: (row["documents"], row["size"]) for row in rows}
+
+    def exclusive_messages(self, file_ids: list[str]) -> list[tuple[int, int]]:
+        """(shard, message id) of chunks of these files no other file references"""
+        placeholders = ", ".join("?" for _ in file_ids)
+        rows = self._db.execute(
+            f"SELECT DISTINCT shard, message_id FROM chunks "
+            f"WHERE file_id IN ({placeholders}) AND (shard, message_id) NOT IN "
+            f"(SELECT shard, message_id FROM chunks WHERE file_id NOT IN ({placeholders})) "
+            f"ORDER BY shard, message_id",
+            [*file_ids, *file_ids],
+        )
+        return [(row["shard"], row["message_id"]) for row in rows]
+
+    def referenced_messages(
+        self, messages: Iterable[tuple[int, int]]
+    ) -> set[tuple[int, int]]:
+        """Those of messages, as (shard, message id), holding a chunk of some file"""
+        messages = list(messages)
+        referenced = set()
+        # Two parameters each, well under SQLite's limit per statement
+        for start in range(0, len(messages), 500):
+            batch = messages[start : start + 500]
+            placeholders = ", ".join("(?, ?)" for _ in batch)
+            rows = self._db.execute(
+                f"SELECT DISTINCT shard, message_id FROM chunks "
+                f"WHERE (shard, message_id) IN (VALUES {placeholders})",
+                [value for message in batch for value in message],
+            )
+            referenced.update((row["shard"], row["message_id"]) for row in rows)
+        return referenced
+
+    def _insert(self, metadata: FileMetadata, index_name: bool = True) -> None:
+        data = metadata.to_dict()
+        index_name = index_name and self._name_index
+        if index_name:
+            self._unindex_names([metadata.file_id])
+        cursor = self._db.execute(
+            f"INSERT OR REPLACE INTO files ({', '.join(FILE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in FILE_COLUMNS)})",
+            [data[column] for column in FILE_COLUMNS],
+        )
+        if index_name:
+            self._db.execute(
+                "INSERT INTO name_index (rowid, name) VALUES (?, ?)",
+                (cursor.lastrowid, metadata.original_name.casefold()),
+            )
+        self._db.execute("DELETE FROM chunks WHERE file_id = ?", (metadata.file_id,))
+        self._db.executemany(
+            "INSERT INTO chunks (file_id, idx, message_id, checksum, data, shard) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    metadata.file_id,
+                    c.index,
+                    c.message_id,
+                    c.checksum,
+                    json.dumps(c.to_dict()),
+                    c.shard or 0,
+                )
+                for c in metadata.chunks
+            ],
+        )
+
+    def _unindex_names(self, file_ids: list[str]) -> None:
+        self._db.executemany(
+            "DELETE FROM name_index WHERE rowid = "
+            "(SELECT rowid FROM files WHERE file_id = ?)",
+            [(i,) for i in file_ids],
+        )
+
+    def _delete(self, file_ids: list[str]) -> int:
+        if self._name_index:
+            self._unindex_names(file_ids)
+        cursor = self._db.executemany(
+            "DELETE FROM files WHERE file_id = ?", [(i,) for i in file_ids]
+        )
+        return cursor.rowcount
+
+    def _record(self, op: dict) -> None:
+        self._db.execute("INSERT INTO journal (op) VALUES (?)", (json.dumps(op),))
+
+    def add(self, metadata: FileMetadata) -> None:
+        self.add_many([metadata])
+
+    def add_many(self, metadatas: Iterable[FileMetadata]) -> None:
+        """Add files in one transaction"""
+        with self._db:
+            for metadata in metadatas:
+                self._insert(metadata)
+                self._record({"op": "add", "file": metadata.to_dict()})
+
+    def remove(self, file_id: str) -> bool:
+        with self._db:
+            removed = self._delete([file_id]) > 0
+            if removed:
+                self._record({"op": "remove", "file_ids": [file_id]})
+        return removed
+
+    def clear(self) -> None:
+        with self._db:
+            # Recorded as explicit ids so that replaying it elsewhere only
+            # removes files this catalog knew about
+            file_ids = [r[0] for r in self._db.execute("SELECT file_id FROM files")]
+            self._delete(file_ids)
+            if file_ids:
+                self._record({"op": "remove", "file_ids": file_ids})
+
+    def replace_all(self, metadatas: Iterable[FileMetadata]) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM files")
+            for metadata in metadatas:
+                self._insert(metadata, index_name=False)
+        # Indexed in one go, which is much faster than name by name
+        if self._name_index:
+            self._index_names()
+
+    def apply_ops(self, ops: Iterable[dict]) -> None:
+        """Replay journal operations without recording them again"""
+        with self._db:
+            for op in ops:
+                if op["op"] == "add":
+                    self._insert(FileMetadata.from_dict(dict(op["file"])))
+                elif op["op"] == "remove":
+                    self._delete(op["file_ids"])
+                else:
+                    raise ValueError(f"Unknown journal operation: {op['op']}")
+
+    def pending_ops(self) -> list[tuple[int, dict]]:
+        """Recorded operations not yet pushed, as (seq, op) in order"""
+        return [
+            (row["seq"], json.loads(row["op"]))
+            for row in self._db.execute("SELECT seq, op FROM journal ORDER BY seq")
+        ]
+
+    def drop_pending(self, up_to_seq: int) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM journal WHERE seq <= ?", (up_to_seq,))
+
+    def get_state(self, key: str, default: str = "") -> str:
+        row = self._db.execute(
+            "SELECT value FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        return row["value"] if row else default
+
+    def set_state(self, key: str, value: str) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def mirrored(self, root: str) -> dict[str, str]:
+        """Checksum of the stored file each path (relative to root) was mirrored as.
+
+        Paths whose file has since been removed from the catalog are left out.
+        """
+        return {
+            row["path"]: row["checksum"]
+            for row in self._db.execute(
+                "SELECT mirrored.path, files.checksum FROM mirrored "
+                "JOIN files USING (file_id) WHERE mirrored.root = ?",
+                (root,),
+            )
+        }
+
+    def record_mirror(
+        self, root: str, files: dict[str, str], gone: Iterable[str] = ()
+    ) -> None:
+        """Record the file id each path under root is stored as, forgetting gone paths"""
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO mirrored (root, path, file_id) VALUES (?, ?, ?)",
+                ((root, path, file_id) for path, file_id in files.items()),
+            )
+            self._db.executemany(
+                "DELETE FROM mirrored WHERE root = ? AND path = ?",
+                ((root, path) for path in gone),
+            )
+
+    def import_json(self, path: Path) -> None:
+        """Load a metafile in the FileMetadata.push_metadatas format"""
+        self.replace_all(FileMetadata.get_metadatas(path))
+
+    def export_json(self, path: Path) -> None:
+        """Write the catalog in the FileMetadata.push_metadatas format"""
+        FileMetadata.push_metadatas(list(self), path)
@@ -0,0 +1,174 @@
+"""Size-bounded local cache of downloaded chunks"""
+
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+from .metadata import ChunkInfo
+from .metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class ChunkCache:
+    """LRU cache of verified chunk bytes, addressed by message id and checksum.
+
+    Entries are whole raw (decompressed) chunks stored as files, indexed in a
+    small SQLite database next to them. Once the cached bytes exceed
+    max_size, the least recently used chunks are evicted. Hits, misses and
+    evictions are counted for this run and in total.
+    """
+
+    def __init__(self, directory: Path, max_size: int):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Used by one thread at a time, not always the one that opened it
+        self._db = sqlite3.connect(directory / "index.db", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    @staticmethod
+    def key(chunk: ChunkInfo) -> Optional[str]:
+        """Cache key of a chunk, or None if it has no checksum to address it by"""
+        if not chunk.checksum:
+            return None
+        return f"{chunk.message_id}-{chunk.checksum.replace(':', '-')}"
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def _bump(self, name: str, value: int = 1) -> None:
+        self._db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, value),
+        )
+
+    def get(self, chunk: ChunkInfo) -> Optional[Path]:
+        """Path of the cached chunk, marking it recently used, or None on a miss"""
+        key = self.key(chunk)
+        if key is None:
+            return None
+        path = self._path(key)
+        with self._db:
+            row = self._db.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row["size"] != chunk.size or not path.exists():
+                if row is not None:
+                    self._remove(key)
+                self.misses += 1
+                self._bump("misses")
+                metrics.count("cache_misses")
+                return None
+            self._db.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+            self._bump("hits")
+            self._bump("bytes_hit", chunk.size)
+            metrics.count("cache_hits")
+        return path
+
+    @contextmanager
+    def writer(self, chunk: ChunkInfo) -> Iterator[Optional[BinaryIO]]:
+        """File to write the chunk's bytes to, cached only if the block succeeds.
+
+        Yields None for chunks that cannot be cached (no checksum, or larger
+        than the whole cache).
+        """
+        key = self.key(chunk)
+        if key is None or chunk.size > self.max_size:
+            yield None
+            return
+        path = self._path(key)
+        temp_path = path.with_name(f"{key}.part")
+        try:
+            with open(temp_path, "wb") as f:
+                yield f
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        os.replace(temp_path, path)
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+                (key, chunk.size, time.time()),
+            )
+        self.trim()
+
+    def _remove(self, key: str) -> None:
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._path(key).unlink(missing_ok=True)
+
+    def discard(self, chunk: ChunkInfo) -> None:
+        """Drop a chunk, e.g. when its cached bytes turn out to be corrupt"""
+        key = self.key(chunk)
+        if key is not None:
+            with self._db:
+                self._remove(key)
+
+    def trim(self) -> None:
+        """Evict least recently used chunks until the cache fits max_size"""
+        with self._db:
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._db.execute("SELECT key, size FROM entries ORDER BY last_used")
+        for row in rows.fetchall():
+            if total <= self.max_size:
+                break
+            self._remove(row["key"])
+            total -= row["size"]
+            self._bump("evictions")
+            metrics.count("cache_evictions")
+
+    def stats(self) -> dict:
+        entries, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        totals = {
+            row["name"]: row["value"]
+            for row in self._db.execute("SELECT name, value FROM stats")
+        }
+        return {
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+            "hits": totals.get("hits", 0),
+            "misses": totals.get("misses", 0),
+            "bytes_hit": totals.get("bytes_hit", 0),
+            "evictions": totals.get("evictions", 0),
+        }
+
+    def clear(self) -> None:
+        with self._db:
+            for row in self._db.execute("SELECT key FROM entries").fetchall():
+                self._remove(row["key"])
+            self._db.execute("DELETE FROM stats")
@@ -0,0 +1,145 @@
+"""Per-chunk compression for files that are worth compressing"""
+
+import math
+import tempfile
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Final, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is always available
+    zstandard = None
+
+from .file_processor import FileSlice, MemorySlice
+from .metrics import metrics
+
+ZLIB_LEVEL: Final[int] = 1
+ZSTD_LEVEL: Final[int] = 3
+COMPRESS_READ_SIZE: Final[int] = 1024 * 1024  # 1MB
+# Compressed chunks are buffered in memory up to this size, then on disk
+SPOOL_SIZE: Final[int] = 32 * 1024 * 1024  # 32MB
+
+ENTROPY_SAMPLE_SIZE: Final[int] = 64 * 1024  # 64KB
+# Bits per byte above which a sample is treated as already compressed
+MAX_ENTROPY: Final[float] = 7.0
+# A chunk is stored raw unless compression saves at least this fraction
+MIN_SAVING: Final[float] = 0.1
+
+CODECS = ("zstd", "zlib") if zstandard is not None else ("zlib",)
+# What decompressing a damaged chunk raises
+DECOMPRESSION_ERRORS: tuple[type[Exception], ...] = (zlib.error,) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+# Formats that are compressed already, by mimetype or mimetype prefix
+INCOMPRESSIBLE_TYPES = (
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-xz",
+    "application/x-bzip2",
+    "application/zstd",
+    "application/pdf",
+    "application/epub+zip",
+    "application/java-archive",
+    "application/vnd.openxmlformats-officedocument.",
+    "application/vnd.oasis.opendocument.",
+)
+COMPRESSIBLE_IMAGES = ("image/svg+xml", "image/bmp", "image/x-ms-bmp", "image/tiff")
+
+
+def resolve_codec(codec: str) -> str:
+    """Fall back to zlib when zstd (without zstandard installed) is unavailable"""
+    return codec if codec in CODECS else "zlib"
+
+
+def sample_entropy(path: Path) -> float:
+    """Shannon entropy, in bits per byte, of samples from the start, middle and end"""
+    size = path.stat().st_size
+    counts: Counter[int] = Counter()
+    with open(path, "rb") as f:
+        for offset in {
+            0,
+            max(0, size // 2 - ENTROPY_SAMPLE_SIZE // 2),
+            max(0, size - ENTROPY_SAMPLE_SIZE),
+        }:
+            f.seek(offset)
+            counts.update(f.read(ENTROPY_SAMPLE_SIZE))
+    total = counts.total()
+    return -sum(n / total * math.log2(n / total) for n in counts.values())
+
+
+def choose_codec(
+    path: Optional[Path], file_type: str, compression: str
+) -> Optional[str]:
+    """Codec for a file's chunks under the compression setting, or None.
+
+    "off" never compresses and a codec name always does; "auto" uses the best
+    available codec unless the mimetype or a sample says the data is
+    already compressed. A stream (no path) cannot be sampled up front, so
+    only its mimetype counts.
+    """
+    if compression == "off":
+        return None
+    if compression != "auto":
+        return resolve_codec(compression)
+    if file_type.startswith(INCOMPRESSIBLE_TYPES):
+        return None
+    if file_type.startswith("image/") and file_type not in COMPRESSIBLE_IMAGES:
+        return None
+    if path is not None and sample_entropy(path) > MAX_ENTROPY:
+        return None
+    return CODECS[0]
+
+
+def new_compressor(codec: str) -> Any:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    if codec == "zlib":
+        return zlib.compressobj(ZLIB_LEVEL)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def new_decompressor(codec: str) -> Any:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd chunks need zstandard: uv sync --extra fast")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == "zlib":
+        return zlib.decompressobj()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+class CompressedChunk(tempfile.SpooledTemporaryFile):
+    """A compressed copy of a chunk, named like it for upload"""
+
+    def __init__(self, name: str):
+        super().__init__(max_size=SPOOL_SIZE)
+        self._name = name
+
+    @property
+    def name(self) -> str:  # type: ignore[override]
+        return self._name
+
+
+def compress_slice(chunk: FileSlice | MemorySlice, codec: str) -> CompressedChunk:
+    """Compress chunk front to back, which also completes its checksum"""
+    compressed = CompressedChunk(f"{chunk.name}.{codec}")
+    compressor = new_compressor(codec)
+    chunk.seek(0)
+    with metrics.span("compress"):
+        while data := chunk.read(COMPRESS_READ_SIZE):
+            compressed.write(compressor.compress(data))
+        compressed.write(compressor.flush())
+    compressed.seek(0)
+    return compressed
+
+
+def worth_compressing(compressed_size: int, size: int) -> bool:
+    return compressed_size <= size * (1 - MIN_SAVING)
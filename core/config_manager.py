@@ -1,8 +1,9 @@
 import json
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Self
+from typing import Iterator, Self
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 TG_STORAGE_DIR: Path = Path.home() / ".tg-storage"
 TG_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
@@ -10,6 +11,17 @@ TG_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 CONFIG_PATH: Path = TG_STORAGE_DIR / "tg_storage.json"
 SESSION_FILE: Path = TG_STORAGE_DIR / ".tg_storage"
 GLOBAL_METAFILE: Path = TG_STORAGE_DIR / "tg_storage_global.json"
+CATALOG_FILE: Path = TG_STORAGE_DIR / "tg_storage_catalog.db"
+TRANSFERS_DIR: Path = TG_STORAGE_DIR / "transfers"
+CHUNK_CACHE_DIR: Path = TG_STORAGE_DIR / "chunk_cache"
+HASH_CACHE_FILE: Path = TG_STORAGE_DIR / "tg_storage_hashes.db"
+
+
+class ShardConfig(BaseModel):
+    """Another account and storage chat that chunks are spread over"""
+
+    session_file: Path
+    storage_chat_id: int
 
 
 class Config(BaseModel):
@@ -17,22 +29,99 @@ class Config(BaseModel):
     metadata_message_id: int
     session_file: Path = SESSION_FILE
     global_metafile: Path = GLOBAL_METAFILE
+    catalog_file: Path = CATALOG_FILE
+    transfers_dir: Path = TRANSFERS_DIR
+    chunk_cache_dir: Path = CHUNK_CACHE_DIR
+    hash_cache_file: Path = HASH_CACHE_FILE
     chat_verified: bool = False
+    upload_concurrency: int = 4
+    download_concurrency: int = 4
+    media_connections: int = 0
+    reconnect_attempts: int = 2
+    hash_algorithm: str = "md5"
+    journal_compact_every: int = 100
+    chunking: str = "fixed"
+    cdc_average_size: int = 64 * 1024 * 1024
+    compression: str = "auto"
+    # Part size when uploading from stdin; each part in flight is held in memory
+    stream_part_size: int = 64 * 1024 * 1024
+    # Files under pack_threshold bytes share pack documents, see upload --pack
+    pack_small_files: bool = False
+    pack_threshold: int = 4 * 1024 * 1024
+    # Bytes of downloaded chunks to keep in chunk_cache_dir, 0 disables it
+    chunk_cache_size: int = 0
+    # Requests per second (0 for no limit) and the burst allowed above that
+    request_rate: float = 20.0
+    request_burst: int = 20
+    # Longest flood wait, in seconds, to wait out instead of failing
+    max_flood_wait: int = 300
+    # Extra sessions and chats to spread chunks over, shard 1 onwards (the
+    # session and chat above are shard 0), and how to pick one per document
+    shards: list[ShardConfig] = []
+    shard_placement: str = "round-robin"
+
+    # Transfer progress: auto, bar, json (lines on stderr) or quiet
+    progress: str = "auto"
+
+    _batch_depth: int = PrivateAttr(default=0)
+    _dirty: bool = PrivateAttr(default=False)
 
     class Config:
         validate_assignment = True
 
     def __setattr__(self, name, value):
+        if name.startswith("_"):
+            super().__setattr__(name, value)
+            return
+        old_value = getattr(self, name, None)
         super().__setattr__(name, value)
-        self.save()
+        if getattr(self, name) == old_value:
+            return
+        if self._batch_depth:
+            self._dirty = True
+        else:
+            self.save()
+
+    @contextmanager
+    def batch(self) -> Iterator[Self]:
+        """Write the config file once for every assignment made inside the block"""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._dirty:
+                self._dirty = False
+                self.save()
 
     def to_dict(self, **kwargs):
         data = super().dict(**kwargs)
         for key, value in data.items():
             if isinstance(value, Path):
                 data[key] = str(value)
+        for shard in data.get("shards", []):
+            shard["session_file"] = str(shard["session_file"])
         return data
 
+    def shard(self, index: int) -> Self:
+        """This config with shard index's session and chat, 0 being itself"""
+        if index == 0:
+            return self
+        if not 0 < index <= len(self.shards):
+            raise ValueError(f"Shard {index} is not configured")
+        return self.for_shard(self.shards[index - 1])
+
+    def for_shard(self, shard: ShardConfig) -> Self:
+        """This config with shard's session and chat, configured or not"""
+        # Copied without validation, so nothing is saved over the config file
+        return self.model_copy(
+            update={
+                "session_file": shard.session_file,
+                "storage_chat_id": shard.storage_chat_id,
+                "shards": [],
+            }
+        )
+
     def save(self, path: Path = CONFIG_PATH) -> None:
         with open(path, "w") as f:
             json.dump(self.to_dict(), f, indent=4)
@@ -44,7 +133,13 @@ class Config(BaseModel):
                 with open(path, "r") as f:
                     data = json.load(f)
                     for key, value in data.items():
-                        if key in ["session_file", "global_metafile"]:
+                        if key in [
+                            "session_file",
+                            "global_metafile",
+                            "catalog_file",
+                            "transfers_dir",
+                            "chunk_cache_dir",
+                        ]:
                             data[key] = Path(value)
                     return cls(**data)
         except json.JSONDecodeError as e:
@@ -1,22 +1,389 @@
+import asyncio
 import hashlib
+import io
 import os
-from io import BufferedWriter
+import random
+from bisect import bisect_right
+from io import BufferedReader, BufferedWriter
+from itertools import accumulate
 from pathlib import Path
-from typing import Final, Generator, Optional
+from typing import Any, AsyncIterator, BinaryIO, Callable, Final, Generator, Optional
+
+try:
+    import xxhash
+except ImportError:  # optional speedup, hashlib is always available
+    xxhash = None
+
+from .metrics import metrics
 
 BUFFER_SIZE: Final[int] = 10 * 1024  # 10KB
 CHUNK_SIZE: Final[int] = 2000 * 1000 * 1000  # 2000MBi
+# _split_file only checks the part size after a whole buffer has been written,
+# so parts end on the first BUFFER_SIZE boundary at or past CHUNK_SIZE.
+PART_SIZE: Final[int] = -(-CHUNK_SIZE // BUFFER_SIZE) * BUFFER_SIZE
+
+
+HASH_READ_SIZE: Final[int] = 1024 * 1024  # 1MB
+
+CDC_SCAN_SIZE: Final[int] = 8 * 1024 * 1024  # 8MB
+# Fixed seed: cut points must be identical across runs and machines for
+# chunks to deduplicate
+CDC_SEED: Final[int] = 0x7467
+# Reduces every byte value to one pseudo-random bit (as a 0/1 byte)
+CDC_CLASSES: Final[bytes] = (
+    random.Random(CDC_SEED).randbytes(256).translate(bytes(i & 1 for i in range(256)))
+)
+
+HASH_ALGORITHMS: dict[str, Callable[[], Any]] = {
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if xxhash is not None:
+    HASH_ALGORITHMS["xxh3_128"] = xxhash.xxh3_128
+
+
+def resolve_algorithm(algorithm: str) -> str:
+    """Fall back to md5 when a hash (e.g. xxh3_128 without xxhash) is unavailable"""
+    return algorithm if algorithm in HASH_ALGORITHMS else "md5"
+
+
+def new_hasher(algorithm: str):
+    return HASH_ALGORITHMS[algorithm]()
+
+
+def format_digest(algorithm: str, hasher) -> str:
+    # Plain md5 hex is the historical checksum format, other algorithms are tagged
+    if algorithm == "md5":
+        return hasher.hexdigest()
+    return f"{algorithm}:{hasher.hexdigest()}"
+
+
+def digest_algorithm(digest: str) -> str:
+    algorithm, sep, _ = digest.partition(":")
+    return algorithm if sep else "md5"
+
+
+def calculate_checksum(file_path: Path, algorithm: str = "md5") -> str:
+    hasher = new_hasher(algorithm)
+    with metrics.span("checksum"), open(file_path, "rb") as f:
+        while c := f.read(HASH_READ_SIZE):
+            hasher.update(c)
+    return format_digest(algorithm, hasher)
+
+
+def _cdc_pattern(bits: int) -> bytes:
+    rng = random.Random(CDC_SEED + bits)
+    # Starting with 0 and ending with 1 keeps runs of one byte value from matching
+    return bytes([0, *(rng.getrandbits(1) for _ in range(bits - 2)), 1])
+
+
+def cdc_boundaries(
+    input_file: Path, average_size: int
+) -> Generator[tuple[int, int], None, None]:
+    """Yield content-defined (offset, length) chunks of input_file.
+
+    A chunk ends at the first position past average_size / 2 where the bytes
+    just before it, each reduced to a bit by CDC_CLASSES, spell a fixed
+    pattern (or at 4 * average_size). The cut depends only on nearby content,
+    so an insertion moves the boundaries around it and no others. Reduction
+    and search are bytes.translate and bytes.find, so scanning runs at C speed.
+    """
+    min_size = average_size // 2
+    max_size = min(average_size * 4, PART_SIZE)
+    pattern = _cdc_pattern(max(2, (average_size - min_size).bit_length() - 1))
+    file_size = input_file.stat().st_size
+
+    with open(input_file, "rb") as f:
+        start = 0
+        while start < file_size:
+            limit = min(start + max_size, file_size)
+            cut = limit
+            pos = max(start + min_size, start + len(pattern))
+            while pos < limit:
+                block_end = min(pos + CDC_SCAN_SIZE, limit)
+                # The pattern occupies the bytes right before the cut
+                f.seek(pos - len(pattern))
+                classes = f.read(block_end - pos + len(pattern)).translate(CDC_CLASSES)
+                found = classes.find(pattern)
+                if found != -1:
+                    cut = pos + found
+                    break
+                pos = block_end
+            yield start, cut - start
+            start = cut
+
+
+class FileSlice(io.RawIOBase):
+    """Read-only, seekable view over a byte range of a file.
+
+    Bytes read front to back are hashed on the way through, so the consumer's
+    read is also the checksum pass.
+    """
+
+    def __init__(
+        self, path: Path, offset: int, length: int, name: str, algorithm: str = "md5"
+    ):
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name
+        self.algorithm = algorithm
+        self._fp: Optional[BufferedReader] = None
+        self._pos = 0
+        self._hasher = new_hasher(algorithm)
+        self._hashed = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.length + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+        if pos == 0 and 0 < self._hashed < self.length:
+            # The consumer is starting over (e.g. a retried upload)
+            self._hasher = new_hasher(self.algorithm)
+            self._hashed = 0
+        self._pos = pos
+        return pos
 
+    def readinto(self, buffer) -> int:
+        remaining = self.length - self._pos
+        if remaining <= 0:
+            return 0
+        if self._fp is None:
+            self._fp = open(self.path, "rb")
+        view = memoryview(buffer)[:remaining]
+        self._fp.seek(self.offset + self._pos)
+        n = self._fp.readinto(view)
+        if self._pos == self._hashed:
+            self._hasher.update(view[:n])
+            self._hashed += n
+        self._pos += n
+        return n
 
-def calculate_checksum(file_path: Path) -> str:
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        while c := f.read(1024 * 1024):
-            hash_md5.update(c)
-    return hash_md5.hexdigest()
+    def checksum(self) -> str:
+        """Digest of the slice, reading whatever the consumer did not"""
+        if self._hashed != self.length:
+            pos = self._pos
+            self.seek(self._hashed)
+            while self.read(HASH_READ_SIZE):
+                pass
+            self.seek(pos)
+        return format_digest(self.algorithm, self._hasher)
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        super().close()
+
+
+class MemorySlice(io.BytesIO):
+    """A part of a stream held in memory, usable wherever a FileSlice is"""
+
+    def __init__(self, data: bytes, name: str, algorithm: str = "md5"):
+        super().__init__(data)
+        self.name = name
+        self.algorithm = algorithm
+        self.length = len(data)
+        self._checksum: Optional[str] = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def checksum(self) -> str:
+        if self._checksum is None:
+            hasher = new_hasher(self.algorithm)
+            with self.getbuffer() as view:
+                hasher.update(view)
+            self._checksum = format_digest(self.algorithm, hasher)
+        return self._checksum
+
+
+class StreamSlices:
+    """Cuts a stream of unknown length into MemorySlices as it arrives.
+
+    Parts are read off the event loop and only when asked for, so the
+    consumer bounds how many are held in memory. The whole stream is hashed
+    and counted on the way through; size and checksum() are final once
+    iteration ends.
+    """
+
+    def __init__(
+        self, source: BinaryIO, name: str, part_size: int, algorithm: str = "md5"
+    ):
+        self.source = source
+        self.name = name
+        self.part_size = part_size
+        self.algorithm = algorithm
+        self.size = 0
+        self._hasher = new_hasher(algorithm)
+
+    def _read_part(self) -> bytes:
+        parts = []
+        remaining = self.part_size
+        # Raw pipes may return less than asked for before the end
+        while remaining and (data := self.source.read(remaining)):
+            parts.append(data)
+            remaining -= len(data)
+        data = b"".join(parts)
+        self._hasher.update(data)
+        self.size += len(data)
+        return data
+
+    async def __aiter__(self) -> AsyncIterator[MemorySlice]:
+        part_num = 0
+        while data := await asyncio.to_thread(self._read_part):
+            part_num += 1
+            yield MemorySlice(
+                data,
+                Path(self.name).with_suffix(f".part{part_num:03d}").name,
+                self.algorithm,
+            )
+
+    def checksum(self) -> str:
+        return format_digest(self.algorithm, self._hasher)
+
+
+class PackSlice(io.RawIOBase):
+    """Read-only, seekable concatenation of whole files, stored as one document.
+
+    offsets holds where each file starts within the pack.
+    """
+
+    def __init__(self, paths: list[Path], name: str):
+        super().__init__()
+        self.paths = paths
+        self.name = name
+        self.sizes = [path.stat().st_size for path in paths]
+        self.offsets = [0, *accumulate(self.sizes)]
+        self.length = self.offsets.pop()
+        self._fp: Optional[BufferedReader] = None
+        self._member = -1
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.length + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.length:
+            return 0
+        # Last member starting at or before pos, skipping empty files
+        member = bisect_right(self.offsets, self._pos) - 1
+        if member != self._member:
+            self._close_member()
+            self._fp = open(self.paths[member], "rb")
+            self._member = member
+        assert self._fp is not None
+        within = self._pos - self.offsets[member]
+        view = memoryview(buffer)[: self.sizes[member] - within]
+        self._fp.seek(within)
+        n = self._fp.readinto(view)
+        if n == 0:
+            raise ValueError(f"{self.paths[member]} shrank while being packed")
+        self._pos += n
+        return n
+
+    def _close_member(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+            self._member = -1
+
+    def close(self) -> None:
+        self._close_member()
+        super().close()
+
+
+def group_packs(files: list[Path], max_size: int = 0) -> list[list[Path]]:
+    """Group files, in order, into packs of at most max_size (CHUNK_SIZE) bytes"""
+    max_size = max_size or CHUNK_SIZE
+    packs: list[list[Path]] = []
+    pack_size = 0
+    for path in files:
+        size = path.stat().st_size
+        if not packs or pack_size + size > max_size:
+            packs.append([])
+            pack_size = 0
+        packs[-1].append(path)
+        pack_size += size
+    return packs
 
 
 class FileSplitRebuild:
+    def _iter_slices(
+        self, input_file: Path, algorithm: str = "md5"
+    ) -> Generator[FileSlice, None, None]:
+        """Yield the parts _split_file would write, as views over the source file"""
+        file_size = input_file.stat().st_size
+        total_parts = (file_size + PART_SIZE - 1) // PART_SIZE
+        for part_num in range(1, total_parts + 1):
+            offset = (part_num - 1) * PART_SIZE
+            yield FileSlice(
+                input_file,
+                offset=offset,
+                length=min(PART_SIZE, file_size - offset),
+                name=input_file.with_suffix(f".part{part_num:03d}").name,
+                algorithm=algorithm,
+            )
+
+    def _iter_cdc_slices(
+        self, input_file: Path, average_size: int, algorithm: str = "md5"
+    ) -> Generator[FileSlice, None, None]:
+        """Yield content-defined parts (see cdc_boundaries) as views over the file"""
+        for part_num, (offset, length) in enumerate(
+            cdc_boundaries(input_file, average_size), start=1
+        ):
+            yield FileSlice(
+                input_file,
+                offset=offset,
+                length=length,
+                name=input_file.with_suffix(f".part{part_num:03d}").name,
+                algorithm=algorithm,
+            )
+
     def _split_file(self, input_file: Path) -> Generator[Path, None, None]:
         part_num: int = 1
         bytes_written: int = 0
@@ -0,0 +1,87 @@
+"""Persistent checksums of local files, keyed by their stat"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .file_processor import calculate_checksum
+from .metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (device, inode, algorithm)
+);
+"""
+
+# A file modified this recently could change again within the same mtime
+# tick, so its checksum is not kept
+RACY_SECONDS = 2
+
+
+class HashCache:
+    """Checksums of local files by (device, inode, size, mtime_ns).
+
+    A file whose size and mtime are unchanged since it was hashed is taken
+    to be unchanged, so its checksum is known from a stat() alone. Used from
+    worker threads, as checksums are computed in them.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        # Losing the last entries on a power cut only costs hashing them again
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def get(self, stat: os.stat_result, algorithm: str) -> Optional[str]:
+        """The checksum of the file with this stat, if it was hashed as it is"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT checksum FROM hashes WHERE device = ? AND inode = ? "
+                "AND algorithm = ? AND size = ? AND mtime_ns = ?",
+                (stat.st_dev, stat.st_ino, algorithm, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        metrics.count("hash_cache_hits" if row else "hash_cache_misses")
+        return row[0] if row else None
+
+    def put(self, stat: os.stat_result, algorithm: str, checksum: str) -> None:
+        if time.time_ns() - stat.st_mtime_ns < RACY_SECONDS * 1_000_000_000:
+            return
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    stat.st_dev,
+                    stat.st_ino,
+                    algorithm,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    checksum,
+                ),
+            )
+
+    def checksum(self, file_path: Path, algorithm: str) -> str:
+        """file_path's checksum, hashing it only if it changed since last time"""
+        stat = file_path.stat()
+        checksum = self.get(stat, algorithm)
+        if checksum is None:
+            checksum = calculate_checksum(file_path, algorithm)
+            # Kept only if the file did not change while it was read
+            after = file_path.stat()
+            if (after.st_size, after.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                self.put(stat, algorithm, checksum)
+        return checksum
@@ -0,0 +1,148 @@
+"""Incremental metadata sync through an operation journal on Telegram"""
+
+import json
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from .catalog import Catalog
+from .config_manager import Config
+from .metadata import FileMetadata
+from .metrics import metrics
+from .telegram_client import TelegramManager
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+SYNC_TAG = "#tg_storage_sync"
+SNAPSHOT = "snapshot"
+JOURNAL = "journal"
+
+LAST_SEEN_KEY = "last_seen_message_id"
+SINCE_SNAPSHOT_KEY = "ops_since_snapshot"
+
+
+def _entry_kind(message: "Message") -> str:
+    _, _, kind = (message.caption or "").partition(" ")
+    return kind.strip()
+
+
+class MetadataJournal:
+    """Syncs the catalog with Telegram as small deltas plus periodic snapshots.
+
+    Each push uploads the catalog's pending operations as one JSON document
+    captioned "#tg_storage_sync journal". Once config.journal_compact_every
+    operations have accumulated, a full snapshot ("#tg_storage_sync snapshot",
+    referenced by config.metadata_message_id) is pushed instead. Message ids
+    order all entries globally, so pull() only fetches entries newer than
+    the last one it applied.
+    """
+
+    def __init__(
+        self, catalog: Catalog, telegram_manager: TelegramManager, config: Config
+    ):
+        self.catalog = catalog
+        self.telegram_manager = telegram_manager
+        self.config = config
+
+    @property
+    def last_seen(self) -> int:
+        return int(self.catalog.get_state(LAST_SEEN_KEY, "0"))
+
+    async def _load_snapshot(self, message_id: int) -> None:
+        data = await self.telegram_manager.read_file(
+            message_id, "Downloading metadata snapshot"
+        )
+        self.catalog.replace_all(FileMetadata.from_dict(d) for d in json.loads(data))
+        self.config.global_metafile.write_bytes(data)
+
+    async def pull(self) -> int:
+        """Apply remote entries newer than the last seen one, returning how many"""
+        with metrics.span("metadata_pull"):
+            return await self._pull()
+
+    async def _pull(self) -> int:
+        pending = [op for _, op in self.catalog.pending_ops()]
+        last_seen = self.last_seen
+        applied = 0
+
+        if not last_seen and self.config.metadata_message_id:
+            # Nothing pulled on this machine yet: start from the known snapshot
+            await self._load_snapshot(self.config.metadata_message_id)
+            last_seen = self.config.metadata_message_id
+            applied += 1
+
+        entries = await self.telegram_manager.search_messages(
+            SYNC_TAG, newer_than=last_seen
+        )
+        snapshots = [m for m in entries if _entry_kind(m) == SNAPSHOT]
+        if snapshots:
+            # A snapshot already contains every entry before it
+            await self._load_snapshot(snapshots[-1].id)
+            entries = [m for m in entries if m.id > snapshots[-1].id]
+            applied += 1
+
+        for message in entries:
+            if _entry_kind(message) != JOURNAL:
+                continue
+            data = await self.telegram_manager.read_file(
+                message.id, "Downloading metadata journal"
+            )
+            self.catalog.apply_ops(json.loads(data))
+            applied += 1
+
+        if applied:
+            # Local changes that are not pushed yet are newer than anything pulled
+            self.catalog.apply_ops(pending)
+            last_seen = max(
+                [last_seen, *(m.id for m in snapshots), *(m.id for m in entries)]
+            )
+            self.catalog.set_state(LAST_SEEN_KEY, str(last_seen))
+        return applied
+
+    async def push(self) -> bool:
+        """Push pending changes as one journal entry, or a snapshot when due"""
+        with metrics.span("metadata_push"):
+            return await self._push()
+
+    async def _push(self) -> bool:
+        pending = self.catalog.pending_ops()
+        since_snapshot = int(self.catalog.get_state(SINCE_SNAPSHOT_KEY, "0"))
+        if not pending and self.config.metadata_message_id:
+            return False
+
+        if (
+            not self.config.metadata_message_id
+            or since_snapshot + len(pending) >= self.config.journal_compact_every
+        ):
+            # Pull first so the snapshot includes everyone else's entries
+            await self.pull()
+            pending = self.catalog.pending_ops()
+            self.catalog.export_json(self.config.global_metafile)
+            message = await self.telegram_manager.upload_file(
+                self.config.global_metafile, caption=f"{SYNC_TAG} {SNAPSHOT}"
+            )
+            self.config.metadata_message_id = message.id
+            self.catalog.set_state(SINCE_SNAPSHOT_KEY, "0")
+            self.catalog.set_state(LAST_SEEN_KEY, str(message.id))
+        else:
+            document = BytesIO(json.dumps([op for _, op in pending]).encode())
+            document.name = "tg_storage_journal.json"
+            message = await self.telegram_manager.upload_file(
+                document, caption=f"{SYNC_TAG} {JOURNAL}"
+            )
+            self.catalog.set_state(
+                SINCE_SNAPSHOT_KEY, str(since_snapshot + len(pending))
+            )
+            last_seen = self.last_seen
+            if last_seen:
+                # Our own entry needs no pull, unless entries from elsewhere
+                # came before it: the next pull still has to fetch those
+                newer = await self.telegram_manager.search_messages(
+                    SYNC_TAG, newer_than=last_seen
+                )
+                if all(m.id >= message.id for m in newer):
+                    self.catalog.set_state(LAST_SEEN_KEY, str(message.id))
+
+        if pending:
+            self.catalog.drop_pending(pending[-1][0])
+        return True
@@ -6,9 +6,9 @@ import uuid
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import List, Self
+from typing import List, Optional, Self
 
-from core.file_processor import calculate_checksum
+from core.file_processor import FileSlice, MemorySlice, calculate_checksum
 
 
 @dataclass
@@ -17,6 +17,15 @@ class ChunkInfo:
     name: str
     size: int
     index: int
+    checksum: Optional[str] = None
+    # Codec the stored document is compressed with, and its stored size;
+    # size and checksum always describe the raw bytes
+    codec: Optional[str] = None
+    compressed_size: Optional[int] = None
+    # Where the chunk starts in its document, for files packed with others
+    offset: Optional[int] = None
+    # Which of config.shards holds the document; None for the primary chat
+    shard: Optional[int] = None
 
     @classmethod
     def new(cls, message_id: int, file: Path, index: int):
@@ -25,15 +34,61 @@ class ChunkInfo:
             name=file.name,
             size=file.stat().st_size,
             index=index,
+            checksum=calculate_checksum(file),
+        )
+
+    @classmethod
+    def from_slice(
+        cls,
+        message_id: int,
+        chunk: FileSlice | MemorySlice,
+        index: int,
+        codec: Optional[str] = None,
+        compressed_size: Optional[int] = None,
+        shard: Optional[int] = None,
+    ):
+        return cls(
+            message_id=message_id,
+            name=chunk.name,
+            size=len(chunk),
+            index=index,
+            checksum=chunk.checksum(),
+            codec=codec,
+            compressed_size=compressed_size,
+            shard=shard,
         )
 
+    @property
+    def stored_size(self) -> int:
+        """Bytes the chunk takes in its document"""
+        return self.compressed_size if self.codec else self.size
+
+    @property
+    def location(self) -> tuple[int, int]:
+        """(shard, message id) of the stored document, shard 0 being the primary"""
+        return self.shard or 0, self.message_id
+
     def to_dict(self) -> dict:
-        return {
+        data = {
             "message_id": self.message_id,
             "name": self.name,
             "size": self.size,
             "index": self.index,
         }
+        # Fields added since the first format are only written when set. Older
+        # versions load chunks with cls(**data), which rejects unknown keys, so
+        # they can read chunks without these fields but not chunks uploaded
+        # since checksums were added, as every new chunk carries one
+        if self.checksum is not None:
+            data["checksum"] = self.checksum
+        if self.codec is not None:
+            data["codec"] = self.codec
+            data["compressed_size"] = self.compressed_size
+        if self.offset is not None:
+            data["offset"] = self.offset
+        if self.shard:
+            data["shard"] = self.shard
+        return data
 
     @classmethod
     def from_dict(cls, data: dict) -> Self:
@@ -52,7 +107,7 @@ class FileMetadata:
     created_at: str = field(default_factory=lambda: datetime.now().isoformat())
 
     @classmethod
-    def new(cls, file: Path) -> Self:
+    def new(cls, file: Path, checksum: Optional[str] = None) -> Self:
         file_type, _ = mimetypes.guess_type(file)
         file_type = file_type if file_type else "Unknown"
         return cls(
@@ -60,7 +115,20 @@ class FileMetadata:
             file_type=file_type,
             extension=file.suffix,
             file_size=file.stat().st_size,
-            checksum=calculate_checksum(file),
+            checksum=checksum if checksum is not None else calculate_checksum(file),
+            created_at=datetime.now().isoformat(),
+        )
+
+    @classmethod
+    def new_stream(cls, name: str) -> Self:
+        """Metadata for a stream, whose size and checksum are only known at its end"""
+        file_type, _ = mimetypes.guess_type(name)
+        return cls(
+            original_name=name,
+            file_type=file_type if file_type else "Unknown",
+            extension=Path(name).suffix,
+            file_size=0,
+            checksum="",
             created_at=datetime.now().isoformat(),
         )
 
@@ -0,0 +1,193 @@
+"""Per-phase timings and transfer counters, exported as JSON or a Prometheus textfile"""
+
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+PROMETHEUS_PREFIX = "tg_storage"
+
+
+@dataclass
+class PhaseStats:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+@dataclass
+class TransferStats:
+    direction: str
+    name: str
+    bytes: int
+    seconds: float
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Accumulates what one CLI run spent its time on.
+
+    Phases time named spans (overlapping spans of concurrent transfers add
+    up, so a phase can exceed the wall time), events count things like
+    retries and flood waits, and every document sent or received is recorded
+    as a transfer with its own throughput. The Prometheus export adds the
+    transfers up by direction, the JSON export lists each of them.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, command: str = "") -> None:
+        """Start over, for the run of command"""
+        self.command = command
+        self.started_at = time.time()
+        self.phases: dict[str, PhaseStats] = {}
+        self.events: Counter[str] = Counter()
+        self.transfers: list[TransferStats] = []
+
+    @contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def observe(self, phase: str, seconds: float) -> None:
+        stats = self.phases.setdefault(phase, PhaseStats())
+        stats.count += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def count(self, event: str, value: int = 1) -> None:
+        self.events[event] += value
+
+    def transfer(self, direction: str, name: str, nbytes: int, seconds: float) -> None:
+        self.transfers.append(TransferStats(direction, name, nbytes, seconds))
+        self.count(f"{direction}_bytes", nbytes)
+
+    def to_dict(self) -> dict:
+        return {
+            "command": self.command,
+            "started_at": self.started_at,
+            "duration_seconds": time.time() - self.started_at,
+            "phases": {
+                phase: {
+                    "count": stats.count,
+                    "seconds": stats.seconds,
+                    "max_seconds": stats.max_seconds,
+                }
+                for phase, stats in self.phases.items()
+            },
+            "events": dict(self.events),
+            "transfers": [
+                {
+                    "direction": t.direction,
+                    "name": t.name,
+                    "bytes": t.bytes,
+                    "seconds": t.seconds,
+                    "bytes_per_second": t.bytes_per_second,
+                }
+                for t in self.transfers
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        p = PROMETHEUS_PREFIX
+        command = f'command="{_label(self.command)}"'
+        lines = [
+            f"# HELP {p}_last_run_timestamp_seconds When the command started",
+            f"# TYPE {p}_last_run_timestamp_seconds gauge",
+            f"{p}_last_run_timestamp_seconds{{{command}}} {self.started_at}",
+            f"# HELP {p}_duration_seconds Wall time of the command",
+            f"# TYPE {p}_duration_seconds gauge",
+            f"{p}_duration_seconds{{{command}}} {time.time() - self.started_at}",
+            f"# HELP {p}_phase_seconds Time spent in each phase",
+            f"# TYPE {p}_phase_seconds gauge",
+        ]
+        for phase, stats in self.phases.items():
+            labels = f'{command},phase="{_label(phase)}"'
+            lines.append(f"{p}_phase_seconds{{{labels}}} {stats.seconds}")
+        lines += [
+            f"# HELP {p}_phase_count Times each phase ran",
+            f"# TYPE {p}_phase_count gauge",
+        ]
+        for phase, stats in self.phases.items():
+            labels = f'{command},phase="{_label(phase)}"'
+            lines.append(f"{p}_phase_count{{{labels}}} {stats.count}")
+        lines += [
+            f"# HELP {p}_events Retries, flood waits, bytes moved and other counts",
+            f"# TYPE {p}_events gauge",
+        ]
+        for event, value in self.events.items():
+            labels = f'{command},event="{_label(event)}"'
+            lines.append(f"{p}_events{{{labels}}} {value}")
+        # Totals by direction: a series per document would repeat for documents
+        # read more than once (duplicates fail the textfile collector) and
+        # grow with every file; per-document throughput is in the JSON export
+        totals: dict[str, list[float]] = {}
+        for t in self.transfers:
+            total = totals.setdefault(t.direction, [0, 0, 0.0])
+            total[0] += 1
+            total[1] += t.bytes
+            total[2] += t.seconds
+        for metric, help_text, column in (
+            ("transfers", "Documents sent or received", 0),
+            ("transfer_bytes", "Bytes of the documents sent or received", 1),
+            ("transfer_seconds", "Time spent sending or receiving documents", 2),
+        ):
+            lines += [
+                f"# HELP {p}_{metric} {help_text}",
+                f"# TYPE {p}_{metric} gauge",
+            ]
+            for direction, total in totals.items():
+                labels = f'{command},direction="{_label(direction)}"'
+                lines.append(f"{p}_{metric}{{{labels}}} {total[column]}")
+        lines += [
+            f"# HELP {p}_transfer_bytes_per_second Throughput of the documents "
+            "sent or received, over the time spent on them",
+            f"# TYPE {p}_transfer_bytes_per_second gauge",
+        ]
+        for direction, (_, nbytes, seconds) in totals.items():
+            labels = f'{command},direction="{_label(direction)}"'
+            lines.append(
+                f"{p}_transfer_bytes_per_second{{{labels}}} "
+                f"{nbytes / seconds if seconds else 0.0}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        """Write a Prometheus textfile if path ends in .prom, JSON otherwise"""
+        if path.suffix == ".prom":
+            data = self.to_prometheus()
+        else:
+            data = json.dumps(self.to_dict(), indent=4)
+        # Replaced atomically so a collector never reads a half-written file
+        temp_path = path.with_name(f"{path.name}.tmp")
+        temp_path.write_text(data)
+        os.replace(temp_path, path)
+
+
+class _FloodWaitCounter(logging.Handler):
+    """Counts the flood waits pyrogram sleeps through, which it only logs"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if str(record.msg).startswith("[%s] Waiting for %s seconds"):
+            metrics.count("flood_waits")
+            metrics.count("flood_wait_seconds", int(record.args[1]))  # type: ignore[index]
+
+
+metrics = Metrics()
+logging.getLogger("pyrogram.session.session").addHandler(_FloodWaitCounter())
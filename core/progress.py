@@ -0,0 +1,215 @@
+"""Transfer progress display"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional
+
+from rich.filesize import decimal
+from rich.progress import (
+    BarColumn,
+    Progress,
+    ProgressColumn,
+    TaskID,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
+from rich.text import Text
+
+PROGRESS_MODES = ("auto", "bar", "json", "quiet")
+# Least seconds between two redraws of the bars
+REFRESH_INTERVAL = 0.25
+# Least seconds between two progress lines in json mode
+JSON_INTERVAL = 5.0
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class CurrentTotalColumn(ProgressColumn):
+    """Custom column to display current/total file size in human-readable form."""
+
+    def render(self, task):
+        current = decimal(task.completed)  # type: ignore
+        total = decimal(task.total) if task.total else "?"  # type: ignore
+        return Text(f"{current} / {total}", style="progress.data")
+
+
+def new_progress() -> Progress:
+    return Progress(
+        "[progress.description]{task.description}",
+        BarColumn(),
+        CurrentTotalColumn(),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+        refresh_per_second=1 / REFRESH_INTERVAL,
+    )
+
+
+class _Row:
+    """Bytes done of a file, of a transfer that is not part of one, or of all"""
+
+    def __init__(self, label: str, total: int, is_file: bool = False):
+        self.label = label
+        self.total = total
+        self.is_file = is_file
+        self.done = 0
+        self.started = time.monotonic()
+        self.task: Optional[TaskID] = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def to_dict(self) -> dict:
+        elapsed = self.elapsed
+        speed = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / speed if speed and self.total else None
+        return {
+            "name": self.label,
+            "bytes": self.done,
+            "total": self.total or None,
+            "speed": round(speed),
+            "eta": None if eta is None else round(eta, 1),
+        }
+
+
+class TransferDashboard:
+    """One progress display for every transfer a command runs.
+
+    Files announced with add_file get a row once their first bytes arrive,
+    which the transfers of their chunks add to; other transfers get a row of
+    their own, and a last row adds up all of them. Transfers only update
+    counters, and the display is redrawn from them at most every
+    REFRESH_INTERVAL seconds, however many run at once.
+
+    mode is "bar" for rich progress bars, "json" for a JSON line on stderr
+    every JSON_INTERVAL seconds, as each file completes and at the end, or
+    "quiet" to display nothing. "auto" draws bars on a terminal and is quiet
+    otherwise.
+    """
+
+    def __init__(self, mode: str = "auto"):
+        if mode == "auto":
+            mode = "bar" if sys.stdout.isatty() else "quiet"
+        self.mode = mode
+        self.total = _Row("Total", 0)
+        # Every row not finished yet by key, and those with bytes to show
+        self.rows: dict[str, _Row] = {}
+        self.shown: dict[str, _Row] = {}
+        self._progress = new_progress() if mode == "bar" else None
+        self._interval = JSON_INTERVAL if mode == "json" else REFRESH_INTERVAL
+        self._drawn = 0.0
+        self._transfers = 0
+
+    def __enter__(self) -> "TransferDashboard":
+        self.total.started = time.monotonic()
+        if self._progress is not None:
+            self._progress.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._progress is not None:
+            self._draw()
+            self._progress.stop()
+        elif self.mode == "json":
+            self._emit("done", **self.total.to_dict())
+
+    def add_file(self, key: str, label: str, total: int) -> None:
+        """Count total bytes for the file key, which transfers can add to"""
+        self.rows[key] = _Row(label, total, is_file=True)
+        self.total.total += total
+
+    def advance(self, key: str, nbytes: int) -> None:
+        """Count bytes of the file key done without a transfer (cached or deduplicated)"""
+        self._count(key, nbytes)
+
+    @contextmanager
+    def transfer(
+        self,
+        description: str,
+        total: int,
+        file: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> Iterator[ProgressCallback]:
+        """Count one transfer of total bytes, yielding its progress callback.
+
+        With file (a key given to add_file) the transfer adds to that file's
+        row, as `size` bytes of it where that differs from the bytes moved
+        (a compressed chunk, or the parts around a packed range). A transfer
+        that fails takes its bytes back off.
+        """
+        own = file is None or file not in self.rows
+        if own:
+            self._transfers += 1
+            file = f"#{self._transfers}"
+            self.rows[file] = _Row(description, total)
+            self.total.total += total
+            self._show(file)
+        key: str = file  # type: ignore[assignment]
+        size = total if size is None else size
+        counted = 0
+
+        async def progress_callback(current: int, _total: int) -> None:
+            nonlocal counted
+            share = min(current * size // total, size) if total else 0
+            self._count(key, share - counted)
+            counted = share
+
+        completed = False
+        try:
+            yield progress_callback
+            completed = True
+        finally:
+            self._count(key, size - counted if completed else -counted)
+            if own:
+                if not completed:
+                    self.total.total -= total
+                self._finish(key)
+
+    def _show(self, key: str) -> None:
+        row = self.shown[key] = self.rows[key]
+        row.started = time.monotonic()
+        if self._progress is not None:
+            row.task = self._progress.add_task(row.label, total=row.total or None)
+            if self.total.task is None and len(self.rows) > 1:
+                self.total.task = self._progress.add_task(self.total.label)
+
+    def _count(self, key: str, nbytes: int) -> None:
+        row = self.rows.get(key)
+        if row is None or not nbytes:
+            return
+        if key not in self.shown:
+            self._show(key)
+        row.done += nbytes
+        self.total.done += nbytes
+        if row.is_file and row.done >= row.total:
+            self._finish(key)
+        if time.monotonic() - self._drawn >= self._interval:
+            self._draw()
+
+    def _finish(self, key: str) -> None:
+        row = self.rows.pop(key)
+        self.shown.pop(key, None)
+        if row.task is not None:
+            self._progress.remove_task(row.task)  # type: ignore[union-attr]
+        if row.is_file and self.mode == "json":
+            self._emit("file", **row.to_dict(), seconds=round(row.elapsed, 3))
+
+    def _draw(self) -> None:
+        self._drawn = time.monotonic()
+        if self._progress is not None:
+            for row in [*self.shown.values(), self.total]:
+                if row.task is not None:
+                    self._progress.update(
+                        row.task, completed=row.done, total=row.total or None
+                    )
+        elif self.mode == "json" and self.shown:
+            self._emit(
+                "progress",
+                **self.total.to_dict(),
+                transfers=[row.to_dict() for row in self.shown.values()],
+            )
+
+    def _emit(self, event: str, **fields) -> None:
+        print(json.dumps({"event": event, **fields}), file=sys.stderr, flush=True)
@@ -0,0 +1,299 @@
+"""Random access to stored files without downloading them whole"""
+
+import asyncio
+import io
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from itertools import accumulate
+from typing import BinaryIO, Coroutine, Final, Optional, TypeVar
+
+from .catalog import Catalog
+from .chunk_cache import ChunkCache
+from .metadata import ChunkInfo, FileMetadata
+from .metrics import metrics
+from .telegram_client import STREAM_PART_SIZE, TelegramManager
+from .transfer import download_chunk
+
+T = TypeVar("T")
+
+# Reads are served in blocks of the parts Telegram streams
+BLOCK_SIZE: Final[int] = STREAM_PART_SIZE
+# Blocks kept in memory, least recently used dropped first
+CACHE_BLOCKS: Final[int] = 64
+# Largest number of blocks fetched ahead of a sequential read
+READAHEAD_BLOCKS: Final[int] = 16
+
+
+class RangeReader:
+    """Reads byte ranges of a stored file, fetching only the parts they cover.
+
+    Plain chunks are read in blocks of BLOCK_SIZE, kept in a small LRU cache.
+    A miss at the block right after the last one read doubles the readahead
+    window (up to `readahead` blocks, fetched in one request), any other miss
+    resets it, so scans take few requests and random reads stay small.
+    Block reads are checked for size only, as a chunk's checksum covers the
+    whole chunk. Compressed chunks cannot be entered mid-stream, so the
+    first read of one (or of a small file packed with others) downloads and
+    verifies it whole into a temporary file.
+    Chunks already in `chunk_cache` are read from there.
+    """
+
+    def __init__(
+        self,
+        telegram_manager: TelegramManager,
+        metadata: FileMetadata,
+        cache_blocks: int = CACHE_BLOCKS,
+        readahead: int = READAHEAD_BLOCKS,
+        chunk_cache: Optional[ChunkCache] = None,
+    ):
+        self.telegram_manager = telegram_manager
+        self.metadata = metadata
+        self.chunks = sorted(metadata.chunks, key=lambda c: c.index)
+        self.starts = [0, *accumulate(c.size for c in self.chunks)]
+        self.size = self.starts.pop()
+        self.cache_blocks = max(1, cache_blocks)
+        self.readahead = max(1, min(readahead, self.cache_blocks))
+        self.chunk_cache = chunk_cache
+        self._blocks: OrderedDict[tuple[int, int], bytes] = OrderedDict()
+        self._whole: dict[int, Optional[BinaryIO]] = {}
+        self._next_block: Optional[tuple[int, int]] = None
+        self._window = 1
+        self._lock = asyncio.Lock()
+
+    def close(self) -> None:
+        for f in self._whole.values():
+            if f is not None:
+                f.close()
+        self._whole.clear()
+        self._blocks.clear()
+
+    async def read(self, offset: int, size: int) -> bytes:
+        """Up to size bytes starting at offset, fewer only at the end of the file"""
+        end = min(offset + size, self.size)
+        parts = []
+        async with self._lock:
+            while offset < end:
+                position = bisect_right(self.starts, offset) - 1
+                within = offset - self.starts[position]
+                length = min(end - offset, self.chunks[position].size - within)
+                parts.append(await self._read_chunk(position, within, length))
+                offset += length
+        return b"".join(parts)
+
+    async def _read_chunk(self, position: int, within: int, length: int) -> bytes:
+        whole = await self._whole_chunk(position)
+        if whole is not None:
+            whole.seek(within)
+            return whole.read(length)
+        first = within // BLOCK_SIZE
+        last = (within + length - 1) // BLOCK_SIZE
+        parts = []
+        for block in range(first, last + 1):
+            data = await self._block(position, block, last)
+            block_start = block * BLOCK_SIZE
+            parts.append(
+                data[max(within - block_start, 0) : within + length - block_start]
+            )
+        return b"".join(parts)
+
+    async def _whole_chunk(self, position: int) -> Optional[BinaryIO]:
+        """A local copy of the whole chunk, if it has one or has to be fetched whole"""
+        if position in self._whole:
+            return self._whole[position]
+        chunk = self.chunks[position]
+        whole: Optional[BinaryIO] = None
+        cached = self.chunk_cache.get(chunk) if self.chunk_cache else None
+        if cached is not None:
+            whole = open(cached, "rb")
+        elif chunk.codec or chunk.offset is not None:
+            whole = tempfile.TemporaryFile()
+            try:
+                await download_chunk(
+                    self.telegram_manager, chunk, whole, self.chunk_cache
+                )
+            except BaseException:
+                whole.close()
+                raise
+        self._whole[position] = whole
+        return whole
+
+    async def _block(self, position: int, block: int, last_needed: int) -> bytes:
+        chunk = self.chunks[position]
+        block_count = -(-chunk.size // BLOCK_SIZE)
+        key = (position, block)
+        if key in self._blocks:
+            self._blocks.move_to_end(key)
+            metrics.count("block_cache_hits")
+        else:
+            metrics.count("block_cache_misses")
+            if key == self._next_block:
+                self._window = min(self._window * 2, self.readahead)
+            else:
+                self._window = 1
+            count = max(last_needed - block + 1, self._window)
+            count = min(count, block_count - block, self.cache_blocks)
+            await self._fetch(chunk, position, block, count, block_count)
+        self._next_block = (
+            (position, block + 1) if block + 1 < block_count else (position + 1, 0)
+        )
+        return self._blocks[key]
+
+    async def _fetch(
+        self, chunk: ChunkInfo, position: int, block: int, count: int, block_count: int
+    ) -> None:
+        received = block
+        async for part in self.telegram_manager.shard(chunk.shard).stream_file(
+            chunk.message_id, None, offset=block, limit=count
+        ):
+            expected = (
+                chunk.size - received * BLOCK_SIZE
+                if received == block_count - 1
+                else BLOCK_SIZE
+            )
+            if len(part) != expected:
+                raise ValueError(
+                    f"Block {received} of chunk {chunk.name} is {len(part)} bytes, "
+                    f"expected {expected}"
+                )
+            self._blocks[(position, received)] = part
+            self._blocks.move_to_end((position, received))
+            received += 1
+        if received != block + count:
+            raise ValueError(
+                f"Chunk {chunk.name} ended at block {received}, expected {block + count}"
+            )
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+
+
+class StoredFile(io.RawIOBase):
+    """Seekable, read-only file object over a stored file.
+
+    Reads go through a RangeReader on an event loop in a background thread,
+    which holds one Telegram connection until the file is closed, so it can
+    be handed to synchronous code such as tarfile or zipfile.
+    """
+
+    def __init__(
+        self,
+        telegram_manager: TelegramManager,
+        metadata: FileMetadata,
+        cache_blocks: int = CACHE_BLOCKS,
+        readahead: int = READAHEAD_BLOCKS,
+        chunk_cache: Optional[ChunkCache] = None,
+    ):
+        super().__init__()
+        self.name = metadata.original_name
+        self._position = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._stack = AsyncExitStack()
+        try:
+            self._reader = self._call(
+                self._open(
+                    telegram_manager, metadata, cache_blocks, readahead, chunk_cache
+                )
+            )
+        except BaseException:
+            self._stop_loop()
+            super().close()
+            raise
+
+    @classmethod
+    def open(
+        cls,
+        telegram_manager: TelegramManager,
+        catalog: Catalog,
+        file_id: str,
+        **options,
+    ) -> "StoredFile":
+        metadata = catalog.get(file_id)
+        if metadata is None:
+            raise FileNotFoundError(f"File with ID {file_id} not found in metadata")
+        return cls(telegram_manager, metadata, **options)
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _call(self, coroutine: Coroutine[object, object, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _open(
+        self,
+        telegram_manager: TelegramManager,
+        metadata: FileMetadata,
+        cache_blocks: int,
+        readahead: int,
+        chunk_cache: Optional[ChunkCache],
+    ) -> RangeReader:
+        # Created on the loop, as the lock it holds must belong to it
+        await self._stack.enter_async_context(telegram_manager.connection())
+        return RangeReader(
+            telegram_manager, metadata, cache_blocks, readahead, chunk_cache
+        )
+
+    @property
+    def size(self) -> int:
+        return self._reader.size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def read(self, size: int = -1) -> bytes:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            size = max(0, self.size - self._position)
+        data = self._call(self._reader.read(self._position, size))
+        self._position += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self._reader.close()
+            self._call(self._stack.aclose())
+        finally:
+            self._stop_loop()
+            super().close()
+
+    def _stop_loop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,191 @@
+"""Rate limiting and flood-wait aware concurrency for Telegram requests"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from .metrics import metrics
+
+# Fraction of the transfer window kept after a flood wait
+BACKOFF_FACTOR = 0.5
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, up to `burst` at once"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Take a token, waiting for one if needed; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class RequestScheduler:
+    """Paces the requests of one account and adapts how many transfers run.
+
+    Every request takes a token from a TokenBucket of `rate` requests per
+    second. Flood waits are kept per request kind: once Telegram asks to
+    wait before the next send_document, only send_document calls wait, and
+    other kinds of request carry on. A request whose flood waits add up to
+    more than max_flood_wait seconds is failed instead.
+
+    Transfers also take a slot of an AIMD window: each transfer that
+    completes widens it by 1/window (one slot per window's worth of
+    successes), up to max_concurrency, and each flood wait, raised or slept
+    through by pyrogram, halves it. The window only narrows what the worker
+    pools run, so it settles at the concurrency the account sustains.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        max_flood_wait: float,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_flood_wait = max_flood_wait
+        self.max_concurrency = max(1, max_concurrency)
+        self.window = float(self.max_concurrency)
+        self.active = 0
+        self.requests = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self._blocked_until: dict[str, float] = {}
+        self._busy_since = 0.0
+        self._slot_freed = asyncio.Condition()
+        self._sleep_observer = _SleepObserver(self)
+
+    def set_max_concurrency(self, concurrency: int) -> None:
+        """Let the window grow to `concurrency` transfers, starting there"""
+        self.max_concurrency = max(1, concurrency)
+        self.window = float(self.max_concurrency)
+
+    async def wait_turn(self, kind: str) -> None:
+        """Wait out any flood wait on kind, then for a token"""
+        while (delay := self._blocked_until.get(kind, 0) - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        waited = await self.bucket.acquire()
+        if waited:
+            metrics.observe("throttle", waited)
+        self.requests += 1
+
+    def flood_wait(self, kind: str, seconds: float, waited: float = 0.0) -> bool:
+        """Record a flood wait Telegram raised for kind.
+
+        waited is what the request already spent on earlier flood waits.
+        Returns whether the caller should retry, which it can do right away,
+        as its next wait_turn(kind) waits until the flood wait is over.
+        """
+        metrics.count("flood_waits_raised")
+        self._backoff(seconds)
+        if waited + seconds > self.max_flood_wait:
+            return False
+        self._blocked_until[kind] = max(
+            self._blocked_until.get(kind, 0), time.monotonic() + seconds
+        )
+        return True
+
+    def _backoff(self, seconds: float) -> None:
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self.window = max(1.0, self.window * BACKOFF_FACTOR)
+
+    @asynccontextmanager
+    async def transfer(self) -> AsyncIterator[None]:
+        """Hold a slot of the window for the length of one transfer"""
+        async with self._slot_freed:
+            await self._slot_freed.wait_for(lambda: self.active < int(self.window))
+            if self.active == 0:
+                self._busy_since = time.monotonic()
+            self.active += 1
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            async with self._slot_freed:
+                self.active -= 1
+                if self.active == 0:
+                    self.busy_seconds += time.monotonic() - self._busy_since
+                if completed:
+                    self.window = min(
+                        self.max_concurrency, self.window + 1 / self.window
+                    )
+                self._slot_freed.notify_all()
+
+    def moved(self, nbytes: int) -> None:
+        """Count bytes sent or received by a transfer"""
+        self.bytes += nbytes
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second over the time any transfer was running"""
+        busy = self.busy_seconds
+        if self.active:
+            busy += time.monotonic() - self._busy_since
+        return self.bytes / busy if busy else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "throughput": self.throughput,
+            "window": int(self.window),
+            "max_concurrency": self.max_concurrency,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
+
+    def observe_sleeps(self, client_names: set[str]) -> None:
+        """Back off on the flood waits pyrogram sleeps through on these clients"""
+        self._sleep_observer.client_names = client_names
+        logger = logging.getLogger("pyrogram.session.session")
+        if self._sleep_observer not in logger.handlers:
+            logger.addHandler(self._sleep_observer)
+
+    def stop_observing_sleeps(self) -> None:
+        logging.getLogger("pyrogram.session.session").removeHandler(
+            self._sleep_observer
+        )
+
+
+class _SleepObserver(logging.Handler):
+    """Feeds the short flood waits pyrogram sleeps through (and only logs) back"""
+
+    def __init__(self, scheduler: RequestScheduler):
+        super().__init__()
+        self.scheduler = scheduler
+        self.client_names: set[str] = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if (
+            str(record.msg).startswith("[%s] Waiting for %s seconds")
+            and record.args[0] in self.client_names  # type: ignore[index]
+        ):
+            self.scheduler._backoff(float(record.args[1]))  # type: ignore[index]
@@ -1,38 +1,61 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from contextlib import aclosing, asynccontextmanager, contextmanager, nullcontext
+from io import BytesIO
 from pathlib import Path
-
-from pyrogram.client import Client
-from pyrogram.enums import ChatMemberStatus
-from pyrogram.errors import ChannelPrivate
-from pyrogram.types import Message
-from rich.filesize import decimal
-from rich.progress import (
-    BarColumn,
-    Progress,
-    ProgressColumn,
-    TimeRemainingColumn,
-    TransferSpeedColumn,
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    Optional,
+    TYPE_CHECKING,
+    TypeVar,
 )
-from rich.text import Text
 
 from utils import run_coroutine
 
 from .config_manager import Config
+from .compression import CompressedChunk
+from .file_processor import FileSlice
+from .metrics import metrics
+from .scheduler import RequestScheduler
+
+# pyrogram and rich's progress take most of the CLI's startup time, so they
+# are only imported once a command actually talks to Telegram
+if TYPE_CHECKING:
+    from pyrogram.client import Client
+    from pyrogram.types import Message
 
+    from .progress import ProgressCallback, TransferDashboard
 
-class CurrentTotalColumn(ProgressColumn):
-    """Custom column to display current/total file size in human-readable form."""
+T = TypeVar("T")
 
-    def render(self, task):
-        current = decimal(task.completed)  # type: ignore
-        total = decimal(task.total) if task.total else "?"  # type: ignore
-        return Text(f"{current} / {total}", style="progress.data")
+# Raised by pyrogram when a connection drops or a request times out
+RECONNECT_ERRORS = (ConnectionError, TimeoutError)
+# pyrogram streams media in parts of this size
+STREAM_PART_SIZE = 1024 * 1024
+# Most message ids Telegram accepts in one get_messages request
+GET_MESSAGES_LIMIT = 200
+# Most message ids Telegram accepts in one delete_messages request
+DELETE_MESSAGES_LIMIT = 100
 
 
 class TelegramManager:
-    """Manages Telegram connection and permissions"""
+    """Manages Telegram connection and permissions.
+
+    With config.shards, this manager talks to the primary session and chat
+    (shard 0) and shard(index) to the others, each with its own connection
+    and scheduler; placement() picks the shard for each new document.
+    """
 
     @staticmethod
     def create_session(api_id: int, api_hash: str, phone_number: str, config: Config):
+        from pyrogram.client import Client
+
         client = Client(
             name=str(config.session_file),
             api_id=api_id,
@@ -47,15 +70,273 @@ class TelegramManager:
         run_coroutine(_create_session())
 
     def __init__(self, config: Config):
-        self.client: Client = Client(name=str(config.session_file))
+        self._client: Optional["Client"] = None
         self.config: Config = config
+        self.dashboard: Optional["TransferDashboard"] = None
+        self.progress_mode = config.progress
+        self.media_clients: list["Client"] = []
+        self._concurrency = config.upload_concurrency
+        self._connection_lock = asyncio.Lock()
+        self._connection_users = 0
+        self._keep_alive = False
+        self._generations: dict[int, int] = {}
+        self._next_media_client = 0
+        self._primary: Optional[TelegramManager] = None
+        self._shards: dict[int, TelegramManager] = {}
+        self._next_shard = 0
+        self._in_flight: Counter[int] = Counter()
+        self.scheduler = RequestScheduler(
+            rate=config.request_rate,
+            burst=config.request_burst,
+            max_concurrency=self._concurrency,
+            max_flood_wait=config.max_flood_wait,
+        )
+
+    @property
+    def client(self) -> "Client":
+        """The main client, created on first use"""
+        if self._client is None:
+            from pyrogram.client import Client
+
+            self._client = Client(
+                name=str(self.config.session_file),
+                max_concurrent_transmissions=self._concurrency,
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client: "Client") -> None:
+        self._client = client
+
+    @property
+    def shard_count(self) -> int:
+        return 1 + len(self.config.shards)
+
+    def shard(self, index: Optional[int]) -> "TelegramManager":
+        """The manager of shard index (None or 0 for this one), created on first use"""
+        if not index:
+            return self
+        if index not in self._shards:
+            manager = TelegramManager(self.config.shard(index))
+            manager._primary = self
+            # Connected until this manager disconnects, see _disconnect
+            manager._keep_alive = True
+            manager.set_concurrency(self._concurrency)
+            self._shards[index] = manager
+        return self._shards[index]
+
+    @contextmanager
+    def placement(self, size: int) -> Iterator[int]:
+        """Pick the shard to store a document of size bytes on.
+
+        round-robin takes the shards in turn; least-loaded the one with the
+        fewest bytes being uploaded to it, counting this document until the
+        block exits.
+        """
+        if self.config.shard_placement == "least-loaded":
+            index = min(range(self.shard_count), key=lambda i: self._in_flight[i])
+        else:
+            index = self._next_shard % self.shard_count
+            self._next_shard += 1
+        self._in_flight[index] += size
+        try:
+            yield index
+        finally:
+            self._in_flight[index] -= size
+
+    def set_concurrency(self, concurrency: int) -> None:
+        """Allow up to `concurrency` simultaneous media transfers on each client"""
+        self._concurrency = concurrency
+        self.scheduler.set_max_concurrency(concurrency)
+        for shard in self._shards.values():
+            shard.set_concurrency(concurrency)
+        if self._client is None:
+            # Created with this concurrency when first used
+            return
+        for client in [self._client, *self.media_clients]:
+            client.max_concurrent_transmissions = concurrency
+            client.save_file_semaphore = asyncio.Semaphore(concurrency)
+            client.get_file_semaphore = asyncio.Semaphore(concurrency)
+
+    async def start(self) -> None:
+        """Open the long-lived connection that every method reuses until stop()"""
+        self._keep_alive = True
+        async with self._connection_lock:
+            await self._connect()
+
+    async def stop(self) -> None:
+        """Close the long-lived connection and any extra media connections"""
+        self._keep_alive = False
+        async with self._connection_lock:
+            if self._connection_users == 0:
+                await self._disconnect()
+
+    async def __aenter__(self) -> "TelegramManager":
+        # Connect lazily on first use, then hold the connection until exit
+        self._keep_alive = True
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def _connect(self) -> None:
+        if self.client.is_connected:
+            return
+        with metrics.span("connect"):
+            await self._start_clients()
+        self.scheduler.observe_sleeps(
+            {client.name for client in [self.client, *self.media_clients]}
+        )
+
+    async def _start_clients(self) -> None:
+        await self.client.start()
+        if self.config.media_connections:
+            from pyrogram.client import Client
+
+            session_string = await self.client.export_session_string()
+            for idx in range(self.config.media_connections):
+                client = Client(
+                    name=f"{self.client.name}-media{idx}",
+                    session_string=session_string,
+                    in_memory=True,
+                    no_updates=True,
+                    max_concurrent_transmissions=self._concurrency,
+                )
+                await client.start()
+                self.media_clients.append(client)
+
+    async def _disconnect(self) -> None:
+        for shard in self._shards.values():
+            await shard.stop()
+            shard._keep_alive = True
+        for client in [*self.media_clients, self._client]:
+            if client is not None and client.is_connected:
+                await client.stop()
+        self.media_clients = []
+        self.scheduler.stop_observing_sleeps()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator["Client"]:
+        """Connect the client, or reuse the connection that is already open"""
+        async with self._connection_lock:
+            await self._connect()
+            self._connection_users += 1
+        try:
+            yield self.client
+        finally:
+            async with self._connection_lock:
+                self._connection_users -= 1
+                if self._connection_users == 0 and not self._keep_alive:
+                    await self._disconnect()
+
+    def _transfer_client(self) -> "Client":
+        """Pick the connection for the next media transfer, round-robin"""
+        clients = [self.client, *self.media_clients]
+        client = clients[self._next_media_client % len(clients)]
+        self._next_media_client += 1
+        return client
+
+    async def _reconnect(self, client: "Client", generation: int) -> None:
+        async with self._connection_lock:
+            # Another request already restarted this client after the same failure
+            if self._generations.get(id(client), 0) != generation:
+                return
+            metrics.count("reconnects")
+            if client.is_connected:
+                try:
+                    await client.stop()
+                except RECONNECT_ERRORS:
+                    pass
+            await client.start()
+            self._generations[id(client)] = generation + 1
+
+    async def _with_reconnect(
+        self, client: "Client", kind: str, operation: Callable[[], Awaitable[T]]
+    ) -> T:
+        """Run a request of the given kind through the scheduler.
+
+        Flood waits longer than pyrogram sleeps through on its own are waited
+        out by the scheduler (holding back only requests of the same kind)
+        and the request is sent again, up to max_flood_wait seconds in all;
+        dropped connections are reconnected up to reconnect_attempts times.
+        """
+        from pyrogram.errors import FloodWait
+
+        attempt = 0
+        flood_waited = 0.0
+        while True:
+            generation = self._generations.get(id(client), 0)
+            await self.scheduler.wait_turn(kind)
+            try:
+                return await operation()
+            except FloodWait as e:
+                if not self.scheduler.flood_wait(kind, e.value, flood_waited):
+                    raise
+                flood_waited += e.value
+            except RECONNECT_ERRORS:
+                if attempt == self.config.reconnect_attempts:
+                    raise
+                attempt += 1
+                metrics.count("retries")
+                await self._reconnect(client, generation)
+
+    @contextmanager
+    def shared_progress(self) -> Iterator["TransferDashboard"]:
+        """Show every transfer started inside this block on one dashboard"""
+        if self._primary is not None:
+            # Shards report to the primary's dashboard
+            with self._primary.shared_progress() as dashboard:
+                yield dashboard
+            return
+        if self.dashboard is not None:
+            yield self.dashboard
+            return
+        from .progress import TransferDashboard
+
+        with TransferDashboard(self.progress_mode) as dashboard:
+            self.dashboard = dashboard
+            try:
+                yield dashboard
+            finally:
+                self.dashboard = None
+
+    @contextmanager
+    def _progress_task(
+        self,
+        description: str,
+        total: int,
+        file: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> Iterator["ProgressCallback"]:
+        with (
+            self.shared_progress() as dashboard,
+            dashboard.transfer(description, total, file, size) as progress_callback,
+        ):
+            yield progress_callback
+
+    async def _get_message(self, client: "Client", message_id: int) -> "Message":
+        message = await client.get_messages(
+            self.config.storage_chat_id, message_ids=message_id
+        )
+        if isinstance(message, list):
+            raise ValueError("Got list of messages instead of single message")
+        return message
 
     async def validate_chat(self, chat_id: int) -> None:
         """Validate storage chat permissions"""
+        from pyrogram.enums import ChatMemberStatus
+        from pyrogram.errors import ChannelPrivate
+
         try:
-            async with self.client:
-                me = await self.client.get_me()
-                member = await self.client.get_chat_member(chat_id, me.id)
+            async with self.connection():
+                me = await self._with_reconnect(
+                    self.client, "get_me", self.client.get_me
+                )
+                member = await self._with_reconnect(
+                    self.client,
+                    "get_chat_member",
+                    lambda: self.client.get_chat_member(chat_id, me.id),
+                )
                 if member.status not in [
                     ChatMemberStatus.ADMINISTRATOR,
                     ChatMemberStatus.OWNER,
@@ -64,118 +345,290 @@ class TelegramManager:
         except ChannelPrivate as e:
             raise Exception("You don't have access to this chat") from e
 
-    async def send_message(self, text: str) -> Message:
+    async def send_message(self, text: str) -> "Message":
         """Send message to storage chat"""
-        async with self.client:
-            msg = await self.client.send_message(
-                chat_id=self.config.storage_chat_id,
-                text=text,
+        async with self.connection():
+            msg = await self._with_reconnect(
+                self.client,
+                "send_message",
+                lambda: self.client.send_message(
+                    chat_id=self.config.storage_chat_id,
+                    text=text,
+                ),
             )
             if not msg:
                 raise ValueError("Failed to send message")
             return msg
 
-    async def upload_file(self, file_path: Path) -> Message:
-        """Upload file to storage chat with enhanced progress bar"""
-        async with self.client:
-            with Progress(
-                "[progress.description]{task.description}",
-                BarColumn(),
-                CurrentTotalColumn(),
-                TransferSpeedColumn(),
-                TimeRemainingColumn(),
-            ) as progress:
-                task = progress.add_task(
-                    f"Uploading {file_path.name}", total=file_path.stat().st_size
-                )
-
-                async def progress_callback(current, total):
-                    progress.update(task, completed=current)
+    async def upload_file(
+        self,
+        file_path: Path | FileSlice | CompressedChunk | BytesIO,
+        caption: str = "",
+        file: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> "Message":
+        """Upload file (a slice of one, or a named file object) to storage chat.
 
-                msg = await self.client.send_document(
-                    chat_id=self.config.storage_chat_id,
-                    document=str(file_path),
-                    file_name=file_path.name,
-                    progress=progress_callback,
+        file and size place the progress on a file's row, see
+        TransferDashboard.transfer.
+        """
+        if isinstance(file_path, Path):
+            document, file_size = str(file_path), file_path.stat().st_size
+        else:
+            document, file_size = file_path, file_path.seek(0, os.SEEK_END)
+            file_path.seek(0)
+        async with self.connection(), self.scheduler.transfer():
+            client = self._transfer_client()
+            with (
+                self._progress_task(
+                    f"Uploading {file_path.name}", file_size, file, size
+                ) as progress_callback,
+                metrics.span("upload"),
+            ):
+                start = time.perf_counter()
+                msg = await self._with_reconnect(
+                    client,
+                    "send_document",
+                    lambda: client.send_document(
+                        chat_id=self.config.storage_chat_id,
+                        document=document,
+                        file_name=file_path.name,
+                        caption=caption,
+                        progress=progress_callback,
+                    ),
                 )
                 if not msg:
                     raise ValueError("Failed to upload file")
+                self.scheduler.moved(file_size)
+                metrics.transfer(
+                    "upload", file_path.name, file_size, time.perf_counter() - start
+                )
                 return msg
 
     async def download_file(self, message_id: int, output_path: Path) -> Path:
         """Download file from storage chat with enhanced progress bar"""
-        async with self.client:
-            message = await self.client.get_messages(
-                self.config.storage_chat_id, message_ids=message_id
+        async with self.connection(), self.scheduler.transfer():
+            client = self._transfer_client()
+            message = await self._with_reconnect(
+                client, "get_messages", lambda: self._get_message(client, message_id)
             )
-            if isinstance(message, list):
-                raise ValueError("Got list of messages instead of single message")
-
-            with Progress(
-                "[progress.description]{task.description}",
-                BarColumn(),
-                CurrentTotalColumn(),
-                TransferSpeedColumn(),
-                TimeRemainingColumn(),
-            ) as progress:
-                task = progress.add_task(
-                    f"Downloading {output_path.name}", total=message.document.file_size
-                )
-
-                async def progress_callback(current, total):
-                    progress.update(task, completed=current)
 
-                downloaded = await message.download(
-                    file_name=str(output_path), progress=progress_callback
+            with self._progress_task(
+                f"Downloading {output_path.name}", total=message.document.file_size
+            ) as progress_callback:
+                downloaded = await self._with_reconnect(
+                    client,
+                    "download",
+                    lambda: message.download(
+                        file_name=str(output_path), progress=progress_callback
+                    ),
                 )
+                self.scheduler.moved(message.document.file_size)
                 return Path(downloaded)
 
-    async def download_metadata(self, output_path: Path) -> Path:
-        """Download metadata file from storage chat with enhanced progress bar"""
-        async with self.client:
-            if output_path.exists():
-                message = await self.client.get_messages(
-                    self.config.storage_chat_id,
-                    message_ids=self.config.metadata_message_id,
-                )
-                if isinstance(message, list):
-                    raise ValueError("Got list of messages instead of single message")
+    async def stream_file(
+        self,
+        message_id: int,
+        description: Optional[str],
+        offset: int = 0,
+        limit: int = 0,
+        file: Optional[str] = None,
+        size: Optional[int] = None,
+    ) -> AsyncGenerator[bytes, None]:
+        """Stream a stored document part by part, resuming after reconnects.
+
+        offset and limit count parts of STREAM_PART_SIZE bytes (a limit of 0
+        streams to the end), so a range can be read without the rest of the
+        document. Without a description no progress is displayed; file and
+        size place it on a file's row, see TransferDashboard.transfer.
 
-                file_size = message.document.file_size
-                if output_path.stat().st_size == file_size:
-                    return output_path
+        pyrogram logs most failures of a download and ends the stream early,
+        so a stream that ends short is resumed from the byte it reached, as
+        is one that raises a reconnect error; ConnectionError is raised once
+        reconnect_attempts resumes did not complete it. Flood waits are
+        waited out through the scheduler as in _with_reconnect, and the
+        stream then resumes too.
+        The stream holds a transfer slot of the scheduler until it ends.
+        """
+        from pyrogram.errors import FloodWait
 
-            message = await self.client.get_messages(
-                self.config.storage_chat_id,
-                message_ids=self.config.metadata_message_id,
+        async with self.connection(), self.scheduler.transfer():
+            client = self._transfer_client()
+            message = await self._with_reconnect(
+                client, "get_messages", lambda: self._get_message(client, message_id)
             )
-            if isinstance(message, list):
-                raise ValueError("Got list of messages instead of single message")
-
-            with Progress(
-                "[progress.description]{task.description}",
-                BarColumn(),
-                CurrentTotalColumn(),
-                TransferSpeedColumn(),
-                TimeRemainingColumn(),
-            ) as progress:
-                task = progress.add_task(
-                    f"Downloading Metadata {output_path.name}",
-                    total=message.document.file_size,
+            total = max(0, message.document.file_size - offset * STREAM_PART_SIZE)
+            if limit:
+                total = min(total, limit * STREAM_PART_SIZE)
+
+            with (
+                self._progress_task(description, total, file, size)
+                if description is not None
+                else nullcontext(None)
+            ) as progress_callback:
+                received = 0
+                attempt = 0
+                flood_waited = 0.0
+                start = time.perf_counter()
+                while True:
+                    generation = self._generations.get(id(client), 0)
+                    # Bytes of the first part already yielded are skipped
+                    parts_received, skip = divmod(received, STREAM_PART_SIZE)
+                    await self.scheduler.wait_turn("stream_media")
+                    try:
+                        async for part in client.stream_media(
+                            message,
+                            offset=offset + parts_received,
+                            limit=limit - parts_received if limit else 0,
+                        ):
+                            part, skip = part[skip:], 0
+                            if not part:
+                                continue
+                            received += len(part)
+                            self.scheduler.moved(len(part))
+                            if progress_callback is not None:
+                                await progress_callback(received, total)
+                            yield part
+                    except FloodWait as e:
+                        if not self.scheduler.flood_wait(
+                            "stream_media", e.value, flood_waited
+                        ):
+                            raise
+                        flood_waited += e.value
+                        continue
+                    except RECONNECT_ERRORS:
+                        if attempt == self.config.reconnect_attempts:
+                            raise
+                        attempt += 1
+                        metrics.count("retries")
+                        await self._reconnect(client, generation)
+                        continue
+                    if received >= total:
+                        break
+                    if attempt == self.config.reconnect_attempts:
+                        raise ConnectionError(
+                            f"Stream of message {message_id} ended after "
+                            f"{received} of {total} bytes"
+                        )
+                    attempt += 1
+                    metrics.count("retries")
+                    # Fetched again in case its file reference expired
+                    message = await self._with_reconnect(
+                        client,
+                        "get_messages",
+                        lambda: self._get_message(client, message_id),
+                    )
+                elapsed = time.perf_counter() - start
+                metrics.observe("download", elapsed)
+                metrics.transfer(
+                    "download",
+                    message.document.file_name or description or str(message_id),
+                    received,
+                    elapsed,
+                )
+
+    async def read_file(self, message_id: int, description: str) -> bytes:
+        """Download a (small) stored document into memory"""
+        return b"".join(
+            [part async for part in self.stream_file(message_id, description)]
+        )
+
+    async def search_messages(self, query: str, newer_than: int = 0) -> list["Message"]:
+        """Storage chat messages matching query with id > newer_than, oldest first"""
+
+        async def _search() -> list["Message"]:
+            found = []
+            # Closed right away when left early, not whenever it is collected
+            async with aclosing(
+                self.client.search_messages(self.config.storage_chat_id, query=query)
+            ) as messages:
+                async for message in messages:
+                    if message.id <= newer_than:
+                        break
+                    found.append(message)
+            return found[::-1]
+
+        async with self.connection():
+            return await self._with_reconnect(self.client, "search_messages", _search)
+
+    async def document_sizes(self, message_ids: list[int]) -> dict[int, int]:
+        """Size of each stored document among message_ids; missing ones are left out"""
+        sizes: dict[int, int] = {}
+        async with self.connection():
+            for start in range(0, len(message_ids), GET_MESSAGES_LIMIT):
+                batch = message_ids[start : start + GET_MESSAGES_LIMIT]
+                messages = await self._with_reconnect(
+                    self.client,
+                    "get_messages",
+                    lambda: self.client.get_messages(
+                        self.config.storage_chat_id, message_ids=batch
+                    ),
                 )
+                for message in messages:
+                    if not message.empty and message.document:
+                        sizes[message.id] = message.document.file_size
+        return sizes
 
-                async def progress_callback(current, total):
-                    progress.update(task, completed=current)
+    async def download_metadata(self, output_path: Path) -> Path:
+        """Download metadata file from storage chat with enhanced progress bar"""
+        async with self.connection():
+            message = await self._with_reconnect(
+                self.client,
+                "get_messages",
+                lambda: self._get_message(self.client, self.config.metadata_message_id),
+            )
+            if (
+                output_path.exists()
+                and output_path.stat().st_size == message.document.file_size
+            ):
+                return output_path
 
-                downloaded = await message.download(
-                    file_name=str(output_path), progress=progress_callback
+            with self._progress_task(
+                f"Downloading Metadata {output_path.name}",
+                total=message.document.file_size,
+            ) as progress_callback:
+                downloaded = await self._with_reconnect(
+                    self.client,
+                    "download",
+                    lambda: message.download(
+                        file_name=str(output_path), progress=progress_callback
+                    ),
                 )
                 return Path(downloaded)
 
     async def delete_file(self, message_id: int) -> None:
         """Delete file from storage chat"""
-        async with self.client:
-            await self.client.delete_messages(
-                chat_id=self.config.storage_chat_id,
-                message_ids=message_id,
+        async with self.connection():
+            await self._with_reconnect(
+                self.client,
+                "delete_messages",
+                lambda: self.client.delete_messages(
+                    chat_id=self.config.storage_chat_id,
+                    message_ids=message_id,
+                ),
             )
+
+    async def delete_files(
+        self, message_ids: list[int]
+    ) -> list[tuple[list[int], Exception]]:
+        """Delete many files from storage chat in as few requests as possible.
+
+        Returns the batches that failed, with their error; the other batches
+        are deleted regardless.
+        """
+        failures = []
+        async with self.connection():
+            for start in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+                batch = message_ids[start : start + DELETE_MESSAGES_LIMIT]
+                try:
+                    await self._with_reconnect(
+                        self.client,
+                        "delete_messages",
+                        lambda: self.client.delete_messages(
+                            chat_id=self.config.storage_chat_id,
+                            message_ids=batch,
+                        ),
+                    )
+                except Exception as e:
+                    failures.append((batch, e))
+        return failures
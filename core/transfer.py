@@ -0,0 +1,540 @@
+"""Concurrent chunk transfers"""
+
+import asyncio
+import os
+from contextlib import nullcontext
+from itertools import accumulate, zip_longest
+from pathlib import Path
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+from .chunk_cache import ChunkCache
+from .compression import (
+    DECOMPRESSION_ERRORS,
+    compress_slice,
+    new_decompressor,
+    worth_compressing,
+)
+from .file_processor import (
+    FileSlice,
+    HASH_ALGORITHMS,
+    HASH_READ_SIZE,
+    MemorySlice,
+    PackSlice,
+    digest_algorithm,
+    format_digest,
+    new_hasher,
+)
+from .metadata import ChunkInfo, FileMetadata
+from .metrics import metrics
+from .telegram_client import STREAM_PART_SIZE, TelegramManager
+from .transfer_journal import TransferJournal
+
+T = TypeVar("T")
+
+# (message id, codec, compressed size, shard) of an uploaded chunk
+StoredChunk = tuple[int, Optional[str], Optional[int], Optional[int]]
+
+# Times deep verification streams a chunk that fails its check
+VERIFY_ATTEMPTS = 2
+# What a chunk that fails its check raises: a wrong size or checksum, or
+# compressed bytes that do not decompress
+DAMAGE_ERRORS = (ValueError, *DECOMPRESSION_ERRORS)
+
+
+async def _run_workers(worker: Callable[[], Awaitable[None]], concurrency: int) -> None:
+    """Run `concurrency` copies of worker, cancelling the rest if one fails"""
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(concurrency):
+                tg.create_task(worker())
+    except ExceptionGroup as e:
+        raise e.exceptions[0] from None
+
+
+async def upload_files(
+    telegram_manager: TelegramManager,
+    uploads: list[
+        tuple[FileMetadata, Iterable[FileSlice] | AsyncIterable[MemorySlice]]
+    ],
+    concurrency: int,
+    find_chunk: Optional[Callable[[str], Optional[ChunkInfo]]] = None,
+    journals: Optional[dict[str, TransferJournal]] = None,
+    codecs: Optional[dict[str, str]] = None,
+) -> None:
+    """Upload every chunk of every file on one pool of `concurrency` workers.
+
+    Chunks are recorded on their FileMetadata in index order, however they
+    finish. With find_chunk, each chunk is hashed first and, if find_chunk
+    knows the checksum (or an earlier chunk of this upload had it), the
+    stored message is referenced instead of uploading the bytes again.
+    journals (by file id) record each finished chunk, and chunks they already
+    hold are not uploaded again; see check_upload_journals. Files with a
+    codec (by file id) have each chunk compressed, where that pays off.
+    A file's chunks may be an async iterable (see StreamSlices), which is
+    only advanced as workers become free to upload what it yields.
+    Each chunk goes to the shard telegram_manager.placement picks, and
+    `concurrency` applies per shard.
+    """
+    journals = journals or {}
+    codecs = codecs or {}
+
+    async def jobs() -> AsyncIterator[
+        tuple[FileMetadata, int, FileSlice | MemorySlice]
+    ]:
+        for metadata, chunks in uploads:
+            if isinstance(chunks, AsyncIterable):
+                idx = 0
+                async for chunk in chunks:
+                    idx += 1
+                    yield metadata, idx, chunk
+            else:
+                for idx, chunk in enumerate(chunks, start=1):
+                    yield metadata, idx, chunk
+
+    pending = jobs()
+    # Workers take turns to advance pending, which may be waiting on a stream
+    pending_lock = asyncio.Lock()
+    # Each chunk uploaded so far, by checksum
+    stored_chunks: dict[str, asyncio.Future[StoredChunk]] = {}
+
+    async def send(
+        chunk: FileSlice | MemorySlice, codec: Optional[str], file: str
+    ) -> StoredChunk:
+        with telegram_manager.placement(len(chunk)) as shard:
+            manager = telegram_manager.shard(shard)
+            if codec is not None:
+                with await asyncio.to_thread(
+                    compress_slice, chunk, codec
+                ) as compressed:
+                    compressed_size = compressed.seek(0, os.SEEK_END)
+                    if worth_compressing(compressed_size, len(chunk)):
+                        message = await manager.upload_file(
+                            compressed, file=file, size=len(chunk)
+                        )
+                        return message.id, codec, compressed_size, shard or None
+            message = await manager.upload_file(chunk, file=file)
+            return message.id, None, None, shard or None
+
+    async def upload(
+        chunk: FileSlice | MemorySlice, codec: Optional[str], file: str
+    ) -> StoredChunk:
+        if find_chunk is None:
+            return await send(chunk, codec, file)
+        checksum = await asyncio.to_thread(chunk.checksum)
+        if checksum in stored_chunks:
+            stored_chunk = await stored_chunks[checksum]
+            dashboard.advance(file, len(chunk))
+            return stored_chunk
+        stored = find_chunk(checksum)
+        # A packed file's range cannot stand in for a whole document
+        if stored is not None and stored.size == len(chunk) and stored.offset is None:
+            metrics.count("chunks_deduplicated")
+            dashboard.advance(file, len(chunk))
+            return (
+                stored.message_id,
+                stored.codec,
+                stored.compressed_size,
+                stored.shard,
+            )
+        stored_chunks[checksum] = asyncio.get_running_loop().create_future()
+        try:
+            stored_chunks[checksum].set_result(await send(chunk, codec, file))
+        except BaseException as e:
+            stored_chunks[checksum].set_exception(e)
+            # Retrieved here so an unawaited failure is not logged twice
+            stored_chunks[checksum].exception()
+            raise
+        return stored_chunks[checksum].result()
+
+    async def worker():
+        while True:
+            async with pending_lock:
+                job = await anext(pending, None)
+            if job is None:
+                return
+            metadata, idx, chunk = job
+            journal = journals.get(metadata.file_id)
+            done = journal.completed.get(idx) if journal else None
+            if done is not None and done["size"] == len(chunk):
+                metrics.count("chunks_resumed")
+                dashboard.advance(metadata.file_id, len(chunk))
+                metadata.chunks.append(ChunkInfo.from_dict(done))
+                continue
+            with chunk:
+                message_id, codec, compressed_size, shard = await upload(
+                    chunk, codecs.get(metadata.file_id), metadata.file_id
+                )
+                chunk_info = ChunkInfo.from_slice(
+                    message_id=message_id,
+                    chunk=chunk,
+                    index=idx,
+                    codec=codec,
+                    compressed_size=compressed_size,
+                    shard=shard,
+                )
+            metadata.chunks.append(chunk_info)
+            if journal is not None:
+                journal.record(chunk_info.to_dict())
+
+    telegram_manager.set_concurrency(concurrency)
+    async with telegram_manager.connection():
+        with telegram_manager.shared_progress() as dashboard:
+            for metadata, _ in uploads:
+                # A stream's size is only known once it is uploaded
+                if metadata.file_size:
+                    dashboard.add_file(
+                        metadata.file_id,
+                        f"Uploading {metadata.original_name}",
+                        metadata.file_size,
+                    )
+            await _run_workers(worker, concurrency * telegram_manager.shard_count)
+
+    for metadata, _ in uploads:
+        metadata.chunks.sort(key=lambda c: c.index)
+
+
+async def upload_packs(
+    telegram_manager: TelegramManager,
+    packs: list[tuple[PackSlice, list[FileMetadata]]],
+    concurrency: int,
+    on_stored: Optional[Callable[[list[FileMetadata]], None]] = None,
+) -> None:
+    """Upload pack documents on one pool of `concurrency` workers.
+
+    Each member file gets a single chunk pointing at its range of the pack,
+    so restoring it fetches only that range. on_stored is called with the
+    members of each pack as soon as it is uploaded, so that a later pack
+    failing does not leave the earlier ones unreferenced.
+    """
+    pending = iter(packs)
+
+    async def worker():
+        for pack, members in pending:
+            with pack, telegram_manager.placement(len(pack)) as shard:
+                message = await telegram_manager.shard(shard).upload_file(pack)
+            for metadata, offset in zip(members, pack.offsets):
+                metadata.chunks = [
+                    ChunkInfo(
+                        message_id=message.id,
+                        name=metadata.original_name,
+                        size=metadata.file_size,
+                        index=1,
+                        checksum=metadata.checksum,
+                        offset=offset,
+                        shard=shard or None,
+                    )
+                ]
+            metrics.count("files_packed", len(members))
+            if on_stored is not None:
+                on_stored(members)
+
+    telegram_manager.set_concurrency(concurrency)
+    async with telegram_manager.connection():
+        with telegram_manager.shared_progress():
+            await _run_workers(worker, concurrency * telegram_manager.shard_count)
+
+
+def _by_shard(items: Iterable[T], shard: Callable[[T], int]) -> Iterator[T]:
+    """items taken from every shard in turn, so that all of them are kept busy"""
+    by_shard: dict[int, list[T]] = {}
+    for item in items:
+        by_shard.setdefault(shard(item), []).append(item)
+    for round_items in zip_longest(*by_shard.values()):
+        yield from (item for item in round_items if item is not None)
+
+
+async def stored_sizes(
+    telegram_manager: TelegramManager, locations: Iterable[tuple[int, int]]
+) -> dict[tuple[int, int], int]:
+    """Size of the document at each (shard, message id); missing ones are left out.
+
+    Looked up GET_MESSAGES_LIMIT messages per request on each shard.
+    """
+    by_shard: dict[int, set[int]] = {}
+    for shard, message_id in locations:
+        by_shard.setdefault(shard, set()).add(message_id)
+    sizes: dict[tuple[int, int], int] = {}
+    for shard, message_ids in by_shard.items():
+        shard_sizes = await telegram_manager.shard(shard).document_sizes(
+            sorted(message_ids)
+        )
+        sizes.update(((shard, i), size) for i, size in shard_sizes.items())
+    return sizes
+
+
+async def check_upload_journals(
+    telegram_manager: TelegramManager, journals: list[TransferJournal]
+) -> None:
+    """Forget journaled chunks whose message is gone or not the size they were stored at"""
+    sizes = await stored_sizes(
+        telegram_manager,
+        (
+            ChunkInfo.from_dict(done).location
+            for journal in journals
+            for done in journal.completed.values()
+        ),
+    )
+    for journal in journals:
+        for idx, done in list(journal.completed.items()):
+            chunk = ChunkInfo.from_dict(done)
+            if sizes.get(chunk.location) != chunk.stored_size:
+                del journal.completed[idx]
+
+
+def _preallocate(path: Path, size: int) -> None:
+    with open(path, "wb") as f:
+        if size and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(f.fileno(), 0, size)
+        else:
+            f.truncate(size)
+
+
+def _copy_cached(path: Path, chunk: ChunkInfo, out_file: BinaryIO) -> bool:
+    """Copy a cached chunk into out_file at its current position, verifying it"""
+    algorithm = digest_algorithm(chunk.checksum or "")
+    hasher = new_hasher(algorithm)
+    start = out_file.tell()
+    with open(path, "rb") as f:
+        while data := f.read(HASH_READ_SIZE):
+            out_file.write(data)
+            hasher.update(data)
+    if format_digest(algorithm, hasher) == chunk.checksum:
+        return True
+    out_file.seek(start)
+    return False
+
+
+async def _chunk_parts(
+    telegram_manager: TelegramManager, chunk: ChunkInfo, file: Optional[str]
+) -> AsyncIterator[bytes]:
+    """The stored bytes of a chunk: its whole document, or its range of a pack.
+
+    Progress goes to the dashboard row of file, if any.
+    """
+    telegram_manager = telegram_manager.shard(chunk.shard)
+    description = f"Downloading {chunk.name}"
+    if chunk.offset is None:
+        async for part in telegram_manager.stream_file(
+            chunk.message_id, description, file=file, size=chunk.size
+        ):
+            yield part
+        return
+    first_part = chunk.offset // STREAM_PART_SIZE
+    skip = chunk.offset - first_part * STREAM_PART_SIZE
+    remaining = chunk.size
+    async for part in telegram_manager.stream_file(
+        chunk.message_id,
+        description,
+        offset=first_part,
+        limit=-(-(skip + chunk.size) // STREAM_PART_SIZE),
+        file=file,
+        size=chunk.size,
+    ):
+        data = part[skip : skip + remaining]
+        skip = 0
+        remaining -= len(data)
+        yield data
+
+
+async def download_chunk(
+    telegram_manager: TelegramManager,
+    chunk: ChunkInfo,
+    out_file: BinaryIO,
+    cache: Optional[ChunkCache] = None,
+    file: Optional[str] = None,
+) -> None:
+    """Stream a chunk into out_file at its current position, verifying it.
+
+    With a cache, a cached copy is used instead of Telegram when it is still
+    intact, and a downloaded chunk is added to the cache once verified.
+    Its bytes count toward file's row of the progress dashboard, if given.
+    """
+    algorithm = digest_algorithm(chunk.checksum or "")
+    verify = chunk.checksum is not None and algorithm in HASH_ALGORITHMS
+    if not verify:
+        cache = None
+    if cache is not None and (cached := cache.get(chunk)) is not None:
+        if await asyncio.to_thread(_copy_cached, cached, chunk, out_file):
+            if file is not None:
+                with telegram_manager.shared_progress() as dashboard:
+                    dashboard.advance(file, chunk.size)
+            return
+        cache.discard(chunk)
+    hasher = new_hasher(algorithm) if verify else None
+    decompressor = new_decompressor(chunk.codec) if chunk.codec else None
+    written = 0
+
+    with cache.writer(chunk) if cache is not None else nullcontext() as cache_file:
+
+        def write(data: bytes) -> None:
+            nonlocal written
+            out_file.write(data)
+            if cache_file is not None:
+                cache_file.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            written += len(data)
+
+        async for part in _chunk_parts(telegram_manager, chunk, file):
+            write(decompressor.decompress(part) if decompressor else part)
+        if decompressor is not None:
+            write(decompressor.flush())
+        if written != chunk.size:
+            raise ValueError(
+                f"Chunk {chunk.name} is {written} bytes, expected {chunk.size}"
+            )
+        if hasher is not None and format_digest(algorithm, hasher) != chunk.checksum:
+            raise ValueError(f"Chunk {chunk.name} failed checksum verification")
+
+
+async def download_files(
+    telegram_manager: TelegramManager,
+    downloads: list[tuple[FileMetadata, Path]],
+    concurrency: int,
+    journals: Optional[dict[Path, TransferJournal]] = None,
+    cache: Optional[ChunkCache] = None,
+) -> list[Path]:
+    """Download every chunk of every file on one pool of `concurrency` workers.
+
+    Each output file is preallocated as <name>.tmp, chunks are written at their
+    offsets, and the file is renamed into place once all of them arrived.
+    With a journal (by output path) the .tmp file is kept if the download
+    fails, and a later call only fetches the chunks the journal lacks.
+    Chunks found intact in cache are copied from it instead of downloaded.
+    Chunks are taken from every shard in turn, `concurrency` per shard.
+    """
+    journals = journals or {}
+    jobs = []
+    temp_paths = []
+    # Bytes left to fetch, by .tmp path
+    remaining: dict[Path, int] = {}
+    for metadata, output_path in downloads:
+        temp_path = output_path.with_name(f"{output_path.name}.tmp")
+        ordered = sorted(metadata.chunks, key=lambda c: c.index)
+        offsets = [0, *accumulate(c.size for c in ordered)]
+        total = offsets.pop()
+        journal = journals.get(output_path)
+        done: dict[int, dict] = {}
+        if (
+            journal is not None
+            and journal.completed
+            and temp_path.exists()
+            and temp_path.stat().st_size == total
+        ):
+            done = journal.completed
+        else:
+            _preallocate(temp_path, total)
+            if journal is not None:
+                journal.reset()
+        temp_paths.append(temp_path)
+        file_jobs = [
+            (chunk, temp_path, offset, journal)
+            for chunk, offset in zip(ordered, offsets)
+            if done.get(chunk.index, {}).get("size") != chunk.size
+        ]
+        remaining[temp_path] = sum(chunk.size for chunk, *_ in file_jobs)
+        jobs.extend(file_jobs)
+    pending = _by_shard(jobs, lambda job: job[0].shard or 0)
+
+    async def worker():
+        for chunk, temp_path, offset, journal in pending:
+            with open(temp_path, "r+b") as out_file:
+                out_file.seek(offset)
+                await download_chunk(
+                    telegram_manager, chunk, out_file, cache, str(temp_path)
+                )
+            if journal is not None:
+                journal.record({"index": chunk.index, "size": chunk.size})
+
+    telegram_manager.set_concurrency(concurrency)
+    try:
+        async with telegram_manager.connection():
+            with telegram_manager.shared_progress() as dashboard:
+                for temp_path, (_, output_path) in zip(temp_paths, downloads):
+                    if remaining[temp_path]:
+                        dashboard.add_file(
+                            str(temp_path),
+                            f"Downloading {output_path.name}",
+                            remaining[temp_path],
+                        )
+                await _run_workers(worker, concurrency * telegram_manager.shard_count)
+    except BaseException:
+        for temp_path, (_, output_path) in zip(temp_paths, downloads):
+            if output_path not in journals:
+                temp_path.unlink(missing_ok=True)
+        raise
+
+    for temp_path, (_, output_path) in zip(temp_paths, downloads):
+        os.replace(temp_path, output_path)
+        if output_path in journals:
+            journals[output_path].finish()
+    return [output_path for _, output_path in downloads]
+
+
+class _Discard:
+    """Stands in for an output file when only the bytes' checksum matters"""
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+
+async def verify_chunks(
+    telegram_manager: TelegramManager, chunks: Iterable[ChunkInfo], concurrency: int
+) -> tuple[list[tuple[ChunkInfo, Exception]], list[tuple[ChunkInfo, Exception]]]:
+    """Stream every chunk and check its size and checksum, writing nothing.
+
+    Runs `concurrency` workers per shard. Chunks referencing the same stored
+    bytes are checked once. Returns the chunks found damaged and those that
+    could not be checked (a failed request, a missing codec...), each with
+    its error. A chunk that fails the check is streamed again before it is
+    called damaged, as a dropped download can also leave it short.
+    """
+    unique = {(c.location, c.offset): c for c in chunks}
+    pending = _by_shard(unique.values(), lambda chunk: chunk.shard or 0)
+    damaged: list[tuple[ChunkInfo, Exception]] = []
+    unverified: list[tuple[ChunkInfo, Exception]] = []
+
+    async def check(chunk: ChunkInfo) -> None:
+        for attempt in range(VERIFY_ATTEMPTS):
+            try:
+                await download_chunk(
+                    telegram_manager,
+                    chunk,
+                    _Discard(),  # type: ignore[arg-type]
+                    file="verify",
+                )
+                return
+            except DAMAGE_ERRORS:
+                if attempt == VERIFY_ATTEMPTS - 1:
+                    raise
+                metrics.count("retries")
+
+    async def worker():
+        for chunk in pending:
+            try:
+                await check(chunk)
+            except DAMAGE_ERRORS as e:
+                damaged.append((chunk, e))
+            except Exception as e:
+                unverified.append((chunk, e))
+
+    telegram_manager.set_concurrency(concurrency)
+    async with telegram_manager.connection():
+        with telegram_manager.shared_progress() as dashboard:
+            dashboard.add_file(
+                "verify",
+                f"Verifying {len(unique)} chunks",
+                sum(chunk.size for chunk in unique.values()),
+            )
+            await _run_workers(worker, concurrency * telegram_manager.shard_count)
+    return damaged, unverified
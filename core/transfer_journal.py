@@ -0,0 +1,109 @@
+"""On-disk journals that let interrupted transfers resume where they stopped"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional, Self
+
+
+class TransferJournal:
+    """Append-only record of the chunks one transfer has finished.
+
+    The first line holds the transfer's identity (what is being moved, and
+    from where to where) plus any extra header fields; every later line is
+    one finished chunk. Lines are flushed and fsynced as they are written, so
+    a crash loses at most the chunk in flight, and a torn last line is
+    ignored on load. The file name is derived from the identity, so starting
+    the same transfer again picks its journal back up.
+    """
+
+    def __init__(self, path: Path, header: dict):
+        self.path = path
+        self.header = header
+        self.completed: dict[int, dict] = {}
+
+    @staticmethod
+    def _key(identity: dict) -> str:
+        encoded = json.dumps(identity, sort_keys=True).encode()
+        return hashlib.sha1(encoded).hexdigest()[:16]
+
+    @classmethod
+    def _read(cls, path: Path) -> Self:
+        with open(path, "r") as f:
+            journal = cls(path, json.loads(f.readline()))
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                journal.completed[entry["index"]] = entry
+        return journal
+
+    @classmethod
+    def _path(cls, directory: Path, identity: dict) -> Path:
+        return directory / f"{identity['kind']}-{cls._key(identity)}.jsonl"
+
+    @classmethod
+    def find(cls, directory: Path, identity: dict) -> Optional[Self]:
+        """The journal this transfer left behind, if any"""
+        path = cls._path(directory, identity)
+        if path.exists():
+            try:
+                journal = cls._read(path)
+                if journal.identity == identity:
+                    return journal
+            except (json.JSONDecodeError, KeyError):
+                pass
+        return None
+
+    @classmethod
+    def open(cls, directory: Path, identity: dict, **extra) -> Self:
+        """The journal of this transfer, resumed if one was left behind"""
+        directory.mkdir(parents=True, exist_ok=True)
+        journal = cls.find(directory, identity)
+        if journal is not None:
+            return journal
+        path = cls._path(directory, identity)
+        journal = cls(path, {**identity, **extra, "identity": list(identity)})
+        journal.reset()
+        return journal
+
+    @classmethod
+    def pending(cls, directory: Path) -> list[Self]:
+        """Every transfer that was started but never finished"""
+        journals = []
+        for path in sorted(directory.glob("*.jsonl")) if directory.exists() else []:
+            try:
+                journals.append(cls._read(path))
+            except (json.JSONDecodeError, KeyError):
+                continue
+        return journals
+
+    @property
+    def identity(self) -> dict:
+        return {key: self.header[key] for key in self.header.get("identity", [])}
+
+    @property
+    def kind(self) -> str:
+        return self.header["kind"]
+
+    def reset(self) -> None:
+        """Forget every finished chunk and start the journal over"""
+        self.completed.clear()
+        with open(self.path, "w") as f:
+            f.write(json.dumps(self.header) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, entry: dict) -> None:
+        """Mark the chunk entry["index"] as finished"""
+        self.completed[entry["index"]] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finish(self) -> None:
+        """The transfer is complete; nothing is left to resume"""
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,21 @@
+"""Fixtures over benchmarks/fake_telegram.py, so that no test needs Telegram"""
+
+import os
+import tempfile
+
+# Config, catalog and sessions live under ~/.tg-storage, which has to point
+# elsewhere before core is first imported
+os.environ["HOME"] = tempfile.mkdtemp(prefix="tg-storage-tests-")
+
+import pytest  # noqa: E402
+
+from benchmarks.bench import fake_manager  # noqa: E402
+from benchmarks.fake_telegram import FakeClient, NetworkProfile  # noqa: E402
+from core.telegram_client import TelegramManager  # noqa: E402
+
+
+@pytest.fixture
+def fake(tmp_path) -> tuple[TelegramManager, FakeClient]:
+    """A manager over one fake account with an instant network"""
+    manager, (client,) = fake_manager(tmp_path, NetworkProfile())
+    return manager, client
@@ -0,0 +1,204 @@
+import json
+import sqlite3
+
+import pytest
+
+from core.catalog import SCHEMA_VERSION, Catalog
+from core.metadata import ChunkInfo, FileMetadata
+
+
+def stored_file(name: str, message_ids: list[int], size: int = 10) -> FileMetadata:
+    return FileMetadata(
+        original_name=name,
+        file_type="text/plain",
+        extension=".txt",
+        checksum=f"md5-of-{name}",
+        file_size=size,
+        chunks=[
+            ChunkInfo(message_id=m, name=f"{name}.part{i}", size=size, index=i)
+            for i, m in enumerate(message_ids, start=1)
+        ],
+    )
+
+
+def test_json_round_trip(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.db")
+    files = [stored_file("a.txt", [1, 2]), stored_file("b.txt", [3], size=20)]
+    catalog.add_many(files)
+    catalog.export_json(tmp_path / "metadata.json")
+
+    copy = Catalog(tmp_path / "copy.db")
+    copy.import_json(tmp_path / "metadata.json")
+    assert list(copy) == files
+    assert copy.find_by_size(20) == [files[1]]
+    assert copy.find_by_checksum("md5-of-a.txt") == [files[0]]
+
+
+def test_new_catalog_imports_the_legacy_metafile(tmp_path):
+    files = [stored_file("a.txt", [1])]
+    FileMetadata.push_metadatas(files, tmp_path / "metadata.json")
+    catalog = Catalog(
+        tmp_path / "catalog.db", legacy_metafile=tmp_path / "metadata.json"
+    )
+    assert list(catalog) == files
+    # Imported, not changed here: nothing to push
+    assert catalog.pending_ops() == []
+
+
+def test_version_1_catalog_is_migrated(tmp_path):
+    path = tmp_path / "catalog.db"
+    metadata = stored_file("Report.TXT", [7])
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        CREATE TABLE files (
+            file_id TEXT PRIMARY KEY, original_name TEXT NOT NULL,
+            file_type TEXT NOT NULL, extension TEXT NOT NULL,
+            checksum TEXT NOT NULL, file_size INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE TABLE chunks (
+            file_id TEXT NOT NULL REFERENCES files (file_id) ON DELETE CASCADE,
+            idx INTEGER NOT NULL, message_id INTEGER NOT NULL, checksum TEXT,
+            data TEXT NOT NULL, PRIMARY KEY (file_id, idx)
+        );
+        CREATE INDEX chunks_message_id ON chunks (message_id);
+        PRAGMA user_version = 1;
+        """
+    )
+    data = metadata.to_dict()
+    db.execute(
+        "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            data[key]
+            for key in (
+                "file_id",
+                "original_name",
+                "file_type",
+                "extension",
+                "checksum",
+                "file_size",
+                "created_at",
+            )
+        ],
+    )
+    chunk = metadata.chunks[0]
+    db.execute(
+        "INSERT INTO chunks VALUES (?, ?, ?, ?, ?)",
+        (metadata.file_id, 1, 7, None, json.dumps(chunk.to_dict())),
+    )
+    db.commit()
+    db.close()
+
+    catalog = Catalog(path)
+    assert catalog._db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert list(catalog) == [metadata]
+    # Chunks land on the primary chat, and names are indexed for search
+    assert catalog.exclusive_messages([metadata.file_id]) == [(0, 7)]
+    entries, total = catalog.search(name="report")
+    assert total == 1 and entries[0].file_id == metadata.file_id
+
+
+def test_shared_chunks_are_not_exclusive(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.db")
+    first = stored_file("a.txt", [1, 2])
+    second = stored_file("b.txt", [2, 3])
+    catalog.add_many([first, second])
+    assert catalog.exclusive_messages([first.file_id]) == [(0, 1)]
+    assert catalog.exclusive_messages([first.file_id, second.file_id]) == [
+        (0, 1),
+        (0, 2),
+        (0, 3),
+    ]
+    assert catalog.referenced_messages([(0, 2), (0, 4)]) == {(0, 2)}
+    assert catalog.remove(first.file_id)
+    assert catalog.exclusive_messages([second.file_id]) == [(0, 2), (0, 3)]
+
+
+@pytest.fixture(params=["name_index", "scan"])
+def library(request, tmp_path):
+    """A catalog of files added on different days, searched both ways"""
+    catalog = Catalog(tmp_path / "catalog.db")
+    # Without FTS5 trigrams, names are matched by scanning
+    catalog._name_index = request.param == "name_index"
+    files = [
+        ("Holiday Photo.JPG", "image/jpeg", 3000, "2024-01-05T10:00:00"),
+        ("notes.txt", "text/plain", 10, "2024-01-31T23:59:00"),
+        ("photo_backup.tar", "application/x-tar", 9000, "2024-02-01T00:00:00"),
+        ("diagram.png", "image/png", 500, "2024-02-15T12:00:00"),
+        ("photos.txt", "text/plain", 20, "2024-03-01T08:00:00"),
+    ]
+    catalog.add_many(
+        FileMetadata(
+            original_name=name,
+            file_type=file_type,
+            extension=name[name.rindex(".") :],
+            checksum=f"md5-of-{name}",
+            file_size=size,
+            chunks=[],
+            created_at=created_at,
+        )
+        for name, file_type, size, created_at in files
+    )
+    yield catalog
+    catalog.close()
+
+
+def names(result: tuple) -> list[str]:
+    entries, _ = result
+    return [entry.original_name for entry in entries]
+
+
+def test_search_matches_substrings_and_globs(library):
+    assert names(library.search("PHOTO")) == [
+        "Holiday Photo.JPG",
+        "photo_backup.tar",
+        "photos.txt",
+    ]
+    assert names(library.search("photo*")) == ["photo_backup.tar", "photos.txt"]
+    assert names(library.search("*.?pg")) == ["Holiday Photo.JPG"]
+    assert names(library.search("[dn]*")) == ["notes.txt", "diagram.png"]
+    assert names(library.search("to_b")) == ["photo_backup.tar"]
+    assert names(library.search("missing")) == []
+
+
+def test_search_filters_type_size_and_dates(library):
+    assert names(library.search(file_type="image/")) == [
+        "Holiday Photo.JPG",
+        "diagram.png",
+    ]
+    assert names(library.search(file_type="text/plain", min_size=15)) == ["photos.txt"]
+    assert names(library.search(min_size=500, max_size=3000)) == [
+        "Holiday Photo.JPG",
+        "diagram.png",
+    ]
+    # A bare until date takes in the whole day
+    assert names(library.search(since="2024-01-31", until="2024-02-01")) == [
+        "notes.txt",
+        "photo_backup.tar",
+    ]
+    assert names(library.search(until="2024-02-01T00:00:00")) == [
+        "Holiday Photo.JPG",
+        "notes.txt",
+    ]
+
+
+def test_search_pages_sorted_results(library):
+    entries, total = library.search(sort="size", descending=True, limit=2)
+    assert [entry.file_size for entry in entries] == [9000, 3000]
+    assert total == 5
+    entries, total = library.search(sort="size", descending=True, limit=2, offset=4)
+    assert [entry.file_size for entry in entries] == [10]
+    assert total == 5
+    assert names(library.search("photo", sort="name", limit=1, offset=1)) == [
+        "photo_backup.tar"
+    ]
+    assert library.search("photo", limit=1)[1] == 3
+
+
+def test_removed_files_leave_the_name_index(library):
+    (photos,) = library.find_by_name("photos.txt")
+    library.remove(photos.file_id)
+    assert names(library.search("photos")) == []
+    library.add(photos)
+    assert names(library.search("photos")) == ["photos.txt"]
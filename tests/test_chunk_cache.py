@@ -0,0 +1,90 @@
+import itertools
+
+import pytest
+
+from core import chunk_cache
+from core.chunk_cache import ChunkCache
+from core.metadata import ChunkInfo
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # A strictly increasing clock, so recency never ties
+    clock = itertools.count(1)
+    monkeypatch.setattr(chunk_cache.time, "time", lambda: next(clock))
+    cache = ChunkCache(tmp_path / "cache", max_size=300)
+    yield cache
+    cache.close()
+
+
+def chunk(message_id: int, size: int = 100) -> ChunkInfo:
+    return ChunkInfo(
+        message_id=message_id,
+        name=f"file.part{message_id:03d}",
+        size=size,
+        index=message_id - 1,
+        checksum=f"sha256:{message_id:064x}",
+    )
+
+
+def put(cache: ChunkCache, info: ChunkInfo) -> None:
+    with cache.writer(info) as f:
+        f.write(bytes([info.message_id]) * info.size)
+
+
+def test_evicts_least_recently_used(cache):
+    a, b, c, d = (chunk(i) for i in range(1, 5))
+    for info in (a, b, c):
+        put(cache, info)
+    assert cache.get(a) is not None
+    put(cache, d)
+    assert cache.get(b) is None
+    assert cache.get(a).read_bytes() == b"\x01" * 100
+    assert cache.get(c) is not None
+    assert cache.get(d) is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 300
+
+
+def test_counts_hits_and_misses(cache, tmp_path):
+    a, b = chunk(1), chunk(2, size=50)
+    put(cache, a)
+    put(cache, b)
+    assert cache.get(a) is not None
+    assert cache.get(b) is not None
+    assert cache.get(chunk(3)) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.close()
+
+    reopened = ChunkCache(tmp_path / "cache", max_size=300)
+    assert reopened.get(a) is not None
+    stats = reopened.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_hit"]) == (3, 1, 250)
+    assert (reopened.hits, reopened.misses) == (1, 0)
+    reopened.close()
+
+
+def test_skips_uncacheable_chunks(cache):
+    unaddressed = ChunkInfo(message_id=1, name="file.part001", size=10, index=0)
+    with cache.writer(unaddressed) as f:
+        assert f is None
+    with cache.writer(chunk(2, size=301)) as f:
+        assert f is None
+    assert cache.get(unaddressed) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_failed_write_is_not_cached(cache):
+    a = chunk(1)
+    with pytest.raises(RuntimeError):
+        with cache.writer(a) as f:
+            f.write(b"partial")
+            raise RuntimeError("stream dropped")
+    assert cache.get(a) is None
+    assert list(cache.directory.glob("*.part")) == []
+
+
+def test_size_mismatch_is_a_miss(cache):
+    put(cache, chunk(1))
+    assert cache.get(chunk(1, size=99)) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import pytest
+from typer.testing import CliRunner
+
+from benchmarks.fake_telegram import FakeClient, NetworkProfile
+from core.catalog import Catalog
+from core.config_manager import ShardConfig
+from core.telegram_client import TelegramManager
+from core.transfer_journal import TransferJournal
+
+runner = CliRunner()
+
+
+@pytest.fixture
+def cli(monkeypatch, tmp_path):
+    """The cli module, with a catalog of its own over a fake account"""
+    import cli
+
+    for field, value in {
+        "storage_chat_id": 1,
+        "chat_verified": True,
+        "metadata_message_id": 0,
+        "cdc_average_size": 16 * 1024,
+        "global_metafile": tmp_path / "global.json",
+        "transfers_dir": tmp_path / "transfers",
+        "hash_cache_file": tmp_path / "hashes.db",
+    }.items():
+        monkeypatch.setattr(cli.config, field, value)
+    cli.config.global_metafile.write_text("[]")
+    # A manager of its own, as its locks belong to the event loop of one test
+    manager = TelegramManager(cli.config)
+    manager.client = FakeClient(NetworkProfile())
+    monkeypatch.setattr(cli, "telegram_manager", manager)
+    monkeypatch.setattr(cli.journal, "telegram_manager", manager)
+    catalog = Catalog(tmp_path / "catalog.db")
+    monkeypatch.setattr(cli, "catalog", catalog)
+    monkeypatch.setattr(cli.journal, "catalog", catalog)
+    yield cli
+    catalog.close()
+
+
+def invoke(cli, *args) -> int:
+    return runner.invoke(cli.app, [str(arg) for arg in args]).exit_code
+
+
+def chunk_names(client: FakeClient) -> list[str]:
+    return [
+        message.document.file_name
+        for message in client.messages.values()
+        if ".part" in message.document.file_name
+    ]
+
+
+def output(result) -> str:
+    """A command's output, unwrapped from the console width"""
+    return " ".join(result.output.split())
+
+
+def log_lines(size: int) -> bytes:
+    """Compressible text that still has content-defined boundaries"""
+    rng = random.Random(0)
+    words = ["upload", "chunk", "retry", "ok", "flood", "wait", "session", "done"]
+    lines = []
+    while sum(map(len, lines)) < size:
+        lines.append(f"{rng.randrange(10**6)} {' '.join(rng.choices(words, k=8))}\n")
+    return "".join(lines).encode()
+
+
+@pytest.mark.parametrize(
+    "name, data",
+    [("data.bin", os.urandom(256 * 1024)), ("data.log", log_lines(256 * 1024))],
+    ids=["raw", "compressed"],
+)
+def test_resume_finishes_an_interrupted_upload(cli, tmp_path, name, data):
+    client = cli.telegram_manager.client
+    path = tmp_path / name
+    path.write_bytes(data)
+
+    client.send_faults = [None, None, RuntimeError("connection lost")]
+    assert invoke(cli, "upload", path, "--chunking", "cdc", "-c", 1) != 0
+    assert not cli.catalog.find_by_name(name)
+    assert len(TransferJournal.pending(cli.config.transfers_dir)) == 1
+    assert len(chunk_names(client)) == 2
+
+    assert invoke(cli, "resume") == 0
+    assert not TransferJournal.pending(cli.config.transfers_dir)
+    (metadata,) = cli.catalog.find_by_name(name)
+    if name.endswith(".log"):
+        assert all(chunk.codec for chunk in metadata.chunks)
+    # Every chunk was uploaded once, the first two before the interruption
+    names = chunk_names(client)
+    assert len(names) == len(set(names)) == len(metadata.chunks)
+
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    assert invoke(cli, "download", metadata.file_id, "--output-dir", output_dir) == 0
+    assert (output_dir / name).read_bytes() == data
+
+
+def test_stored_uploads_leave_no_journal_to_resume(cli, monkeypatch, tmp_path):
+    client = cli.telegram_manager.client
+    path = tmp_path / "pushed.bin"
+    path.write_bytes(os.urandom(64 * 1024))
+
+    async def failing_push() -> bool:
+        raise ConnectionError("metadata push failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(cli.journal, "push", failing_push)
+        assert invoke(cli, "upload", path, "--chunking", "cdc") != 0
+    (metadata,) = cli.catalog.find_by_name("pushed.bin")
+    assert not TransferJournal.pending(cli.config.transfers_dir)
+
+    # A journal left behind for the stored file, with a chunk no file uses
+    orphan = tmp_path / "orphan.bin"
+    orphan.write_bytes(b"orphan")
+    orphan_id = client.put_document(orphan).id
+    stale = TransferJournal.open(
+        cli.config.transfers_dir,
+        cli.upload_identity(path, "cdc", cli.config.cdc_average_size, "md5"),
+        file_id=metadata.file_id,
+    )
+    stale.record(metadata.chunks[0].to_dict())
+    stale.record({**metadata.chunks[0].to_dict(), "index": 2, "message_id": orphan_id})
+
+    assert invoke(cli, "resume") == 0
+    assert not TransferJournal.pending(cli.config.transfers_dir)
+    assert orphan_id not in client.messages
+    assert metadata.chunks[0].message_id in client.messages
+
+
+def test_upload_stdin_in_parts(cli, monkeypatch, tmp_path):
+    client = cli.telegram_manager.client
+    monkeypatch.setattr(cli.config, "stream_part_size", 100 * 1024)
+    data = os.urandom(250 * 1024)
+    result = runner.invoke(cli.app, ["upload", "-", "--name", "dump.bin"], input=data)
+    assert result.exit_code == 0
+    (metadata,) = cli.catalog.find_by_name("dump.bin")
+    assert metadata.file_size == len(data)
+    assert [chunk.size for chunk in metadata.chunks] == [102400, 102400, 51200]
+    assert sorted(chunk_names(client)) == [
+        "dump.part001",
+        "dump.part002",
+        "dump.part003",
+    ]
+
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    assert invoke(cli, "download", metadata.file_id, "--output-dir", output_dir) == 0
+    assert (output_dir / "dump.bin").read_bytes() == data
+
+
+class SlowHashes:
+    """Stands in for HashCache, taking a while over every file"""
+
+    def checksum(self, file_path, algorithm: str) -> str:
+        time.sleep(0.2)
+        return "0" * 32
+
+
+def test_failed_upload_leaves_no_hashing_behind(cli, tmp_path):
+    client = cli.telegram_manager.client
+    files = []
+    for index in range(3):
+        path = tmp_path / f"file{index}.bin"
+        path.write_bytes(os.urandom(1000 + index))
+        files.append(path)
+    client.send_faults = [RuntimeError("connection lost")]
+
+    async def upload() -> set[asyncio.Task]:
+        before = asyncio.all_tasks()
+        with pytest.raises(RuntimeError):
+            await cli.upload_paths(files, 1, "fixed", 0, "md5", "off", SlowHashes())
+        return {task for task in asyncio.all_tasks() - before if not task.done()}
+
+    assert asyncio.run(upload()) == set()
+
+
+def test_delete_keeps_a_pack_other_files_use(cli, tmp_path):
+    client = cli.telegram_manager.client
+    paths = []
+    for index in range(2):
+        path = tmp_path / f"small{index}.txt"
+        path.write_bytes(os.urandom(100))
+        paths.append(path)
+    assert invoke(cli, "upload", *paths, "--pack") == 0
+    packs = [
+        m for m in client.messages.values() if m.document.file_name.endswith(".pack")
+    ]
+    assert len(packs) == 1
+    (first,) = cli.catalog.find_by_name("small0.txt")
+
+    result = runner.invoke(cli.app, ["delete", first.file_id], input="y\n")
+    assert result.exit_code == 0
+    assert "pack was kept" in result.output
+    assert packs[0].id in client.messages
+    assert not cli.catalog.find_by_name("small0.txt")
+    assert cli.catalog.find_by_name("small1.txt")
+
+
+def test_delete_removes_chunks_from_their_shards(cli, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        cli.config,
+        "shards",
+        [
+            ShardConfig(session_file=tmp_path / f"session{i}", storage_chat_id=1 + i)
+            for i in (1, 2)
+        ],
+    )
+    clients = [cli.telegram_manager.client]
+    for index in (1, 2):
+        clients.append(FakeClient(NetworkProfile(), name=f"fake{index}"))
+        cli.telegram_manager.shard(index).client = clients[-1]
+
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(128 * 1024))
+    assert invoke(cli, "upload", path, "--chunking", "cdc") == 0
+    (metadata,) = cli.catalog.find_by_name("data.bin")
+    assert {chunk.shard for chunk in metadata.chunks} == {None, 1, 2}
+    assert all(chunk_names(client) for client in clients)
+
+    result = runner.invoke(cli.app, ["delete", metadata.file_id], input="y\n")
+    assert result.exit_code == 0
+    assert not cli.catalog.find_by_name("data.bin")
+    assert not any(chunk_names(client) for client in clients)
+
+
+def test_mirror_uploads_only_new_and_changed_files(cli, tmp_path):
+    client = cli.telegram_manager.client
+    root = tmp_path / "photos"
+    root.mkdir()
+    (root / "trip").mkdir()
+    paths = [root / "a.jpg", root / "b.jpg", root / "trip" / "c.jpg"]
+    # Modified a minute ago, so their checksums are kept between mirrors
+    modified = time.time() - 60
+    for path in paths:
+        path.write_bytes(os.urandom(1000))
+        os.utime(path, (modified, modified))
+
+    assert invoke(cli, "mirror", root) == 0
+    assert len(chunk_names(client)) == 3
+    mirrored = cli.catalog.mirrored(str(root.resolve()))
+    assert sorted(mirrored) == ["a.jpg", "b.jpg", "trip/c.jpg"]
+
+    result = runner.invoke(cli.app, ["mirror", str(root)])
+    assert result.exit_code == 0
+    assert "0 new or changed, 3 unchanged" in output(result)
+    assert len(chunk_names(client)) == 3
+
+    paths[1].write_bytes(os.urandom(2000))
+    os.utime(paths[1], (modified + 1, modified + 1))
+    (root / "d.jpg").write_bytes(os.urandom(10))
+    result = runner.invoke(cli.app, ["mirror", str(root)])
+    assert result.exit_code == 0
+    assert "2 new or changed, 2 unchanged" in output(result)
+    assert len(chunk_names(client)) == 5
+    assert cli.catalog.mirrored(str(root.resolve()))["b.jpg"] != mirrored["b.jpg"]
+
+
+def test_metrics_file_records_the_command(cli, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(64 * 1024))
+    assert invoke(cli, "--metrics", tmp_path / "run.json", "upload", path) == 0
+    data = json.loads((tmp_path / "run.json").read_text())
+    assert data["command"] == "upload"
+    assert {"upload", "checksum", "metadata_push"} <= set(data["phases"])
+    assert data["events"]["upload_bytes"] >= path.stat().st_size
+
+    assert invoke(cli, "--metrics", tmp_path / "run.prom", "ls") == 0
+    text = (tmp_path / "run.prom").read_text()
+    assert 'tg_storage_duration_seconds{command="ls"}' in text
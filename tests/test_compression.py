@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+
+from core.compression import CODECS, choose_codec, compress_slice, new_decompressor
+from core.file_processor import FileSplitRebuild, MemorySlice, calculate_checksum
+from core.metadata import FileMetadata
+from core.transfer import download_files, upload_files
+
+TEXT = b"".join(b"%d retry upload chunk\n" % i for i in range(20000))
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_compressed_slice_round_trips(codec):
+    chunk = MemorySlice(TEXT, "log.part001")
+    with compress_slice(chunk, codec) as compressed:
+        data = compressed.read()
+    assert len(data) < len(TEXT) // 4
+    decompressor = new_decompressor(codec)
+    assert decompressor.decompress(data) + decompressor.flush() == TEXT
+    assert chunk.checksum() == MemorySlice(TEXT, "copy").checksum()
+
+
+def test_choose_codec_skips_incompressible_files(tmp_path):
+    text = tmp_path / "app.log"
+    text.write_bytes(TEXT)
+    noise = tmp_path / "noise.bin"
+    noise.write_bytes(os.urandom(256 * 1024))
+    assert choose_codec(text, "text/plain", "auto") == CODECS[0]
+    assert choose_codec(noise, "application/octet-stream", "auto") is None
+    assert choose_codec(text, "video/mp4", "auto") is None
+    assert choose_codec(text, "image/png", "auto") is None
+    assert choose_codec(text, "text/plain", "off") is None
+    assert choose_codec(noise, "video/mp4", "zlib") == "zlib"
+    # A stream is judged by its mimetype alone
+    assert choose_codec(None, "text/plain", "auto") == CODECS[0]
+
+
+def test_upload_stores_chunks_raw_unless_compression_pays_off(fake, tmp_path):
+    manager, client = fake
+    text = tmp_path / "app.log"
+    text.write_bytes(TEXT)
+    noise = tmp_path / "noise.bin"
+    noise.write_bytes(os.urandom(len(TEXT)))
+    uploads = [
+        (FileMetadata.new(path), list(FileSplitRebuild()._iter_slices(path)))
+        for path in (text, noise)
+    ]
+    # Forced on both, as --compression zlib does
+    codecs = {metadata.file_id: "zlib" for metadata, _ in uploads}
+    asyncio.run(upload_files(manager, uploads, 2, codecs=codecs))
+
+    (text_chunk,), (noise_chunk,) = [metadata.chunks for metadata, _ in uploads]
+    assert text_chunk.codec == "zlib"
+    assert client.messages[text_chunk.message_id].document.file_size == (
+        text_chunk.compressed_size
+    )
+    assert noise_chunk.codec is None
+    assert text_chunk.checksum == calculate_checksum(text)
+
+    downloads = [(m, tmp_path / f"{m.original_name}.out") for m, _ in uploads]
+    asyncio.run(download_files(manager, downloads, 2))
+    for (_, output_path), path in zip(downloads, (text, noise)):
+        assert output_path.read_bytes() == path.read_bytes()
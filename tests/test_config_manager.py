@@ -0,0 +1,49 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from core.config_manager import Config
+
+ROOT = Path(__file__).parent.parent
+
+
+def counting_saves(monkeypatch) -> list[Config]:
+    saves: list[Config] = []
+    monkeypatch.setattr(Config, "save", lambda self, *args: saves.append(self))
+    return saves
+
+
+def test_assignment_saves_only_changes(monkeypatch):
+    config = Config(storage_chat_id=1, metadata_message_id=0)
+    saves = counting_saves(monkeypatch)
+    config.storage_chat_id = 5
+    config.storage_chat_id = 5
+    assert len(saves) == 1
+
+
+def test_batch_saves_once(monkeypatch):
+    config = Config(storage_chat_id=1, metadata_message_id=0)
+    saves = counting_saves(monkeypatch)
+    with config.batch():
+        config.storage_chat_id = 5
+        config.chat_verified = True
+        with config.batch():
+            config.metadata_message_id = 9
+        assert saves == []
+    assert len(saves) == 1
+
+
+def test_cli_imports_without_pyrogram_or_rich_progress():
+    # A fresh interpreter, as the CLI starts in
+    code = (
+        "import sys, cli; "
+        "print(sorted(m for m in ('pyrogram', 'rich.progress') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,118 @@
+import asyncio
+import io
+import random
+
+import pytest
+
+import core.file_processor
+from core.file_processor import (
+    FileSplitRebuild,
+    PackSlice,
+    StreamSlices,
+    calculate_checksum,
+    cdc_boundaries,
+    group_packs,
+)
+
+AVERAGE_SIZE = 16 * 1024
+
+
+def random_bytes(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def chunks_of(path, data: bytes) -> list[bytes]:
+    path.write_bytes(data)
+    return [
+        data[offset : offset + length]
+        for offset, length in cdc_boundaries(path, AVERAGE_SIZE)
+    ]
+
+
+def test_fixed_slices_view_the_file_in_order(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(core.file_processor, "PART_SIZE", 1000)
+    path = tmp_path / "data.bin"
+    path.write_bytes(random_bytes(2500))
+    slices = list(FileSplitRebuild()._iter_slices(path))
+    assert [s.name for s in slices] == ["data.part001", "data.part002", "data.part003"]
+    assert [len(s) for s in slices] == [1000, 1000, 500]
+    assert b"".join(s.read() for s in slices) == path.read_bytes()
+    assert capsys.readouterr().out == ""
+
+
+class Pipe(io.RawIOBase):
+    """A source that, like a pipe, returns at most 700 bytes per read"""
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self.source = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.source.read(min(size, 700))
+
+
+async def stream_parts(stream: StreamSlices) -> list:
+    return [part async for part in stream]
+
+
+@pytest.mark.parametrize("size", [0, 999, 3000, 3001])
+def test_stream_slices_cut_full_parts_from_short_reads(tmp_path, size):
+    data = random_bytes(size)
+    stream = StreamSlices(Pipe(data), "dump.sql", 1000, "sha256")
+    parts = asyncio.run(stream_parts(stream))
+    assert [len(part) for part in parts] == [
+        min(1000, size - offset) for offset in range(0, size, 1000)
+    ]
+    assert [part.name for part in parts] == [
+        f"dump.part{index:03d}" for index in range(1, len(parts) + 1)
+    ]
+    assert b"".join(part.read() for part in parts) == data
+    path = tmp_path / "dump.sql"
+    path.write_bytes(data)
+    assert stream.size == size
+    assert stream.checksum() == calculate_checksum(path, "sha256")
+
+
+def test_cdc_chunks_cover_the_file_within_their_bounds(tmp_path):
+    data = random_bytes(1024 * 1024)
+    chunks = chunks_of(tmp_path / "data.bin", data)
+    assert b"".join(chunks) == data
+    assert all(
+        AVERAGE_SIZE // 2 <= len(chunk) <= AVERAGE_SIZE * 4 for chunk in chunks[:-1]
+    )
+    assert AVERAGE_SIZE // 2 < len(data) / len(chunks) < AVERAGE_SIZE * 2
+
+
+def test_cdc_insertion_only_moves_nearby_boundaries(tmp_path):
+    data = random_bytes(1024 * 1024)
+    middle = len(data) // 2
+    edited = data[:middle] + b"inserted" + data[middle:]
+    before = chunks_of(tmp_path / "before.bin", data)
+    after = chunks_of(tmp_path / "after.bin", edited)
+    # Every chunk but the one or two around the insertion is found again
+    assert len(set(before) - set(after)) <= 2
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_pack_slice_reads_its_files_back_to_back(tmp_path):
+    paths = []
+    for index, size in enumerate([0, 10, 5000, 1]):
+        path = tmp_path / f"file{index}"
+        path.write_bytes(random_bytes(size, index))
+        paths.append(path)
+    with PackSlice(paths, "test.pack") as pack:
+        data = pack.read()
+        assert data == b"".join(path.read_bytes() for path in paths)
+        pack.seek(pack.offsets[2] + 100)
+        assert pack.read(10) == paths[2].read_bytes()[100:110]
+
+
+def test_group_packs_keeps_order_and_size_limit(tmp_path):
+    paths = []
+    for index in range(5):
+        path = tmp_path / f"file{index}"
+        path.write_bytes(bytes(40))
+        paths.append(path)
+    packs = group_packs(paths, max_size=100)
+    assert [path for pack in packs for path in pack] == paths
+    assert all(sum(path.stat().st_size for path in pack) <= 100 for pack in packs)
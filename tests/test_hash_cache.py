@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+from core import hash_cache
+from core.file_processor import calculate_checksum
+from core.hash_cache import HashCache
+
+
+@pytest.fixture
+def hashes(tmp_path, monkeypatch):
+    hashed = []
+
+    def counted(file_path, algorithm="md5"):
+        hashed.append(file_path.name)
+        return calculate_checksum(file_path, algorithm)
+
+    monkeypatch.setattr(hash_cache, "calculate_checksum", counted)
+    cache = HashCache(tmp_path / "hashes.db")
+    cache.hashed = hashed
+    yield cache
+    cache.close()
+
+
+def settled(path, data: bytes, age: float = 60):
+    """path written with data, last modified age seconds ago"""
+    path.write_bytes(data)
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+    return path
+
+
+def test_unchanged_files_are_not_hashed_again(hashes, tmp_path):
+    path = settled(tmp_path / "a.bin", b"first")
+    expected = calculate_checksum(path)
+    assert hashes.checksum(path, "md5") == expected
+    assert hashes.checksum(path, "md5") == expected
+    assert hashes.get(path.stat(), "md5") == expected
+    assert hashes.hashed == ["a.bin"]
+    # Each algorithm has its own checksum
+    assert hashes.checksum(path, "sha256") == calculate_checksum(path, "sha256")
+    assert hashes.hashed == ["a.bin", "a.bin"]
+
+
+def test_changed_files_are_hashed_again(hashes, tmp_path):
+    path = settled(tmp_path / "a.bin", b"first")
+    hashes.checksum(path, "md5")
+    # Same size, but a new mtime
+    settled(path, b"other", age=30)
+    assert hashes.checksum(path, "md5") == calculate_checksum(path)
+    assert hashes.hashed == ["a.bin", "a.bin"]
+
+
+def test_recently_modified_files_are_not_kept(hashes, tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"still being written")
+    hashes.checksum(path, "md5")
+    assert hashes.get(path.stat(), "md5") is None
+    hashes.checksum(path, "md5")
+    assert hashes.hashed == ["a.bin", "a.bin"]
+
+
+def test_checksums_survive_reopening(hashes, tmp_path):
+    path = settled(tmp_path / "a.bin", b"first")
+    hashes.checksum(path, "md5")
+    reopened = HashCache(tmp_path / "hashes.db")
+    assert reopened.get(path.stat(), "md5") == calculate_checksum(path)
+    reopened.close()
@@ -0,0 +1,85 @@
+import asyncio
+
+from benchmarks.bench import fake_manager
+from benchmarks.fake_telegram import NetworkProfile
+from core.catalog import Catalog
+from core.journal import LAST_SEEN_KEY, MetadataJournal
+from core.metadata import ChunkInfo, FileMetadata
+
+
+def machine(tmp_path, name: str, client) -> MetadataJournal:
+    """A catalog and journal of their own, over the shared fake account"""
+    workdir = tmp_path / name
+    workdir.mkdir()
+    manager, _ = fake_manager(workdir, NetworkProfile())
+    manager.shard(0).client = client
+    return MetadataJournal(
+        Catalog(manager.config.catalog_file), manager, manager.config
+    )
+
+
+def stored_file(name: str, message_id: int) -> FileMetadata:
+    return FileMetadata(
+        file_id=name,
+        original_name=name,
+        file_size=10,
+        file_type="text/plain",
+        extension=".txt",
+        checksum=name,
+        chunks=[ChunkInfo(message_id=message_id, name=name, size=10, index=1)],
+    )
+
+
+def test_push_skips_its_own_entry_on_the_next_pull(fake, tmp_path):
+    _, client = fake
+    journal = machine(tmp_path, "a", client)
+    asyncio.run(journal.push())
+    journal.catalog.add(stored_file("a.txt", 100))
+    asyncio.run(journal.push())
+    assert journal.last_seen == max(client.messages)
+    assert asyncio.run(journal.pull()) == 0
+
+
+def test_push_leaves_earlier_remote_entries_to_pull(fake, tmp_path):
+    _, client = fake
+    first = machine(tmp_path, "a", client)
+    asyncio.run(first.push())
+    second = machine(tmp_path, "b", client)
+    second.config.metadata_message_id = first.config.metadata_message_id
+    asyncio.run(second.pull())
+
+    second.catalog.add(stored_file("b.txt", 101))
+    asyncio.run(second.push())
+    first.catalog.add(stored_file("a.txt", 100))
+    asyncio.run(first.push())
+
+    assert first.catalog.get_state(LAST_SEEN_KEY) == str(
+        first.config.metadata_message_id
+    )
+    assert asyncio.run(first.pull()) == 2
+    assert first.catalog.get("b.txt") is not None
+    assert first.catalog.get("a.txt") is not None
+
+
+def test_machines_converge_on_each_others_changes(fake, tmp_path):
+    _, client = fake
+    first = machine(tmp_path, "a", client)
+    first.catalog.add(stored_file("shared.txt", 100))
+    asyncio.run(first.push())
+    second = machine(tmp_path, "b", client)
+    second.config.metadata_message_id = first.config.metadata_message_id
+    asyncio.run(second.pull())
+    assert second.catalog.get("shared.txt") is not None
+
+    first.catalog.add(stored_file("a.txt", 101))
+    asyncio.run(first.push())
+    second.catalog.add(stored_file("b.txt", 102))
+    second.catalog.remove("shared.txt")
+    asyncio.run(second.push())
+    asyncio.run(first.pull())
+    asyncio.run(second.pull())
+
+    for journal in (first, second):
+        assert journal.catalog.get("a.txt") is not None
+        assert journal.catalog.get("b.txt") is not None
+        assert journal.catalog.get("shared.txt") is None
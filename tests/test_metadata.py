@@ -0,0 +1,24 @@
+from core.metadata import ChunkInfo
+
+ORIGINAL_FIELDS = {"message_id", "name", "size", "index"}
+
+
+def test_chunk_without_newer_fields_keeps_the_original_format():
+    chunk = ChunkInfo(message_id=1, name="a.bin", size=10, index=1)
+    assert set(chunk.to_dict()) == ORIGINAL_FIELDS
+    assert ChunkInfo.from_dict(chunk.to_dict()) == chunk
+
+
+def test_chunk_round_trips_its_optional_fields():
+    chunk = ChunkInfo(
+        message_id=1,
+        name="a.bin",
+        size=10,
+        index=1,
+        checksum="sha256:00",
+        codec="zstd",
+        compressed_size=4,
+        offset=20,
+        shard=2,
+    )
+    assert ChunkInfo.from_dict(chunk.to_dict()) == chunk
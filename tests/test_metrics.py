@@ -0,0 +1,45 @@
+import json
+
+from core.metrics import Metrics
+
+
+def series(text: str) -> list[str]:
+    """The metric and labels of every sample in a Prometheus textfile"""
+    return [
+        line.rsplit(" ", 1)[0]
+        for line in text.splitlines()
+        if line and not line.startswith("#")
+    ]
+
+
+def test_prometheus_adds_transfers_up_by_direction():
+    metrics = Metrics()
+    metrics.reset("cat")
+    # The same block read twice, as RangeReader does
+    metrics.transfer("download", "x.part001", 1000, 0.5)
+    metrics.transfer("download", "x.part001", 1000, 0.5)
+    metrics.transfer("upload", "y.part001", 3000, 1.0)
+    with metrics.span("download"):
+        pass
+    metrics.count("retries")
+
+    text = metrics.to_prometheus()
+    samples = series(text)
+    assert len(samples) == len(set(samples))
+    assert "x.part001" not in text
+    values = dict(line.rsplit(" ", 1) for line in text.splitlines() if line[0] != "#")
+    download = 'command="cat",direction="download"'
+    assert float(values[f"tg_storage_transfers{{{download}}}"]) == 2
+    assert float(values[f"tg_storage_transfer_bytes{{{download}}}"]) == 2000
+    assert float(values[f"tg_storage_transfer_bytes_per_second{{{download}}}"]) == 2000
+
+
+def test_json_keeps_each_transfer(tmp_path):
+    metrics = Metrics()
+    metrics.reset("cat")
+    metrics.transfer("download", "x.part001", 1000, 0.5)
+    metrics.transfer("download", "x.part001", 1000, 0.25)
+    metrics.write(tmp_path / "run.json")
+    data = json.loads((tmp_path / "run.json").read_text())
+    assert [t["bytes_per_second"] for t in data["transfers"]] == [2000, 4000]
+    assert data["events"]["download_bytes"] == 2000
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from core.progress import TransferDashboard
+
+
+def events(capsys) -> list[dict]:
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    return [json.loads(line) for line in captured.err.splitlines()]
+
+
+def report(callback, *progress: int) -> None:
+    async def run() -> None:
+        for current in progress:
+            await callback(current, progress[-1])
+
+    asyncio.run(run())
+
+
+def test_json_mode_reports_each_file_and_the_total(capsys):
+    with TransferDashboard("json") as dashboard:
+        dashboard.add_file("a", "a.log", 1000)
+        dashboard.add_file("b", "b.bin", 300)
+        # A compressed chunk: 200 bytes moved stand for 600 of the file
+        with dashboard.transfer("a.part001", 200, file="a", size=600) as callback:
+            report(callback, 100, 200)
+        assert dashboard.rows["a"].done == 600
+        dashboard.advance("a", 400)
+        with dashboard.transfer("b.part001", 300, file="b") as callback:
+            report(callback, 300)
+    reported = events(capsys)
+    # The first bytes are reported at once, later ones every JSON_INTERVAL
+    assert reported[0]["event"] == "progress"
+    (row,) = reported[0]["transfers"]
+    assert (row["name"], row["bytes"], row["total"]) == ("a.log", 300, 1000)
+    file_a, file_b, done = [e for e in reported if e["event"] != "progress"]
+    assert (file_a["event"], file_a["name"], file_a["bytes"]) == ("file", "a.log", 1000)
+    assert (file_b["name"], file_b["bytes"], file_b["total"]) == ("b.bin", 300, 300)
+    assert (done["event"], done["bytes"], done["total"]) == ("done", 1300, 1300)
+
+
+def test_failed_transfers_take_their_bytes_back():
+    dashboard = TransferDashboard("quiet")
+    dashboard.add_file("a", "a.bin", 1000)
+    with pytest.raises(ConnectionError):
+        with dashboard.transfer("a.part001", 500, file="a") as callback:
+            report(callback, 200, 500)
+            raise ConnectionError
+    assert (dashboard.rows["a"].done, dashboard.total.done) == (0, 0)
+
+    # A transfer of its own is dropped from the total altogether
+    with pytest.raises(ConnectionError):
+        with dashboard.transfer("metadata", 50) as callback:
+            report(callback, 20, 50)
+            raise ConnectionError
+    assert (dashboard.total.done, dashboard.total.total) == (0, 1000)
+
+    with dashboard.transfer("a.part001", 500, file="a") as callback:
+        report(callback, 500)
+    assert dashboard.rows["a"].done == dashboard.total.done == 500
+
+
+def test_file_rows_show_from_their_first_bytes_until_done(capsys):
+    with TransferDashboard("bar") as dashboard:
+        progress = dashboard._progress
+        dashboard.add_file("a", "a.bin", 200)
+        dashboard.add_file("b", "b.bin", 200)
+        assert progress.tasks == []
+        dashboard.advance("a", 100)
+        assert [task.description for task in progress.tasks] == ["a.bin", "Total"]
+        dashboard.advance("b", 200)
+        dashboard.advance("a", 100)
+        assert [task.description for task in progress.tasks] == ["Total"]
+        assert dashboard.rows == {}
+
+
+def test_quiet_mode_prints_nothing(capsys):
+    # auto is quiet when stdout is not a terminal
+    with TransferDashboard("auto") as dashboard:
+        assert dashboard.mode == "quiet"
+        dashboard.add_file("a", "a.bin", 10)
+        with dashboard.transfer("a.part001", 10, file="a") as callback:
+            report(callback, 10)
+    assert capsys.readouterr() == ("", "")
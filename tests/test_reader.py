@@ -0,0 +1,119 @@
+import asyncio
+import dataclasses
+import os
+
+import pytest
+
+from core.chunk_cache import ChunkCache
+from core.file_processor import FileSplitRebuild, PackSlice
+from core.metadata import FileMetadata
+from core.reader import BLOCK_SIZE, RangeReader
+from core.transfer import upload_files, upload_packs
+
+TEXT = b"".join(b"%d seek into the archive\n" % i for i in range(100000))
+
+
+def upload(manager, path, codec=None) -> FileMetadata:
+    metadata = FileMetadata.new(path)
+    slices = list(FileSplitRebuild()._iter_slices(path))
+    codecs = {metadata.file_id: codec} if codec else None
+    asyncio.run(upload_files(manager, [(metadata, slices)], 1, codecs=codecs))
+    return metadata
+
+
+def count_streams(client) -> list:
+    """Offsets and limits of every stream the client is asked for"""
+    calls = []
+    stream_media = client.stream_media
+
+    def counted(message, limit=0, offset=0):
+        calls.append((offset, limit))
+        return stream_media(message, limit=limit, offset=offset)
+
+    client.stream_media = counted
+    return calls
+
+
+def read(reader: RangeReader, offset: int, size: int) -> bytes:
+    return asyncio.run(reader.read(offset, size))
+
+
+@pytest.fixture
+def plain(fake, tmp_path):
+    manager, client = fake
+    path = tmp_path / "disk.img"
+    path.write_bytes(os.urandom(8 * BLOCK_SIZE - 100))
+    return upload(manager, path), path.read_bytes()
+
+
+def test_sequential_reads_widen_readahead(fake, plain):
+    manager, client = fake
+    metadata, data = plain
+    calls = count_streams(client)
+    reader = RangeReader(manager, metadata, readahead=4)
+    step = 64 * 1024
+    scanned = b"".join(read(reader, o, step) for o in range(0, len(data), step))
+    assert scanned == data
+    # Windows of 1, 2 and 4 blocks, then the last block
+    assert calls == [(0, 1), (1, 2), (3, 4), (7, 1)]
+    reader.close()
+
+
+def test_random_reads_fetch_only_their_blocks(fake, plain):
+    manager, client = fake
+    metadata, data = plain
+    calls = count_streams(client)
+    reader = RangeReader(manager, metadata, readahead=4)
+    offset = 5 * BLOCK_SIZE + 10
+    assert read(reader, offset, 100) == data[offset : offset + 100]
+    offset = 2 * BLOCK_SIZE - 50
+    assert read(reader, offset, 100) == data[offset : offset + 100]
+    assert read(reader, 5 * BLOCK_SIZE, 10) == data[5 * BLOCK_SIZE :][:10]
+    # The read straddling blocks 1 and 2 takes both in one request
+    assert calls == [(5, 1), (1, 2)]
+    assert read(reader, len(data) - 10, 100) == data[-10:]
+    reader.close()
+
+
+def test_reads_span_compressed_and_packed_chunks(fake, plain, tmp_path):
+    manager, client = fake
+    metadata, data = plain
+    text = tmp_path / "app.log"
+    text.write_bytes(TEXT)
+    compressed = upload(manager, text, codec="zlib")
+    small = [tmp_path / "a.txt", tmp_path / "b.txt"]
+    for path in small:
+        path.write_bytes(os.urandom(3000))
+    members = [FileMetadata.new(path) for path in small]
+    asyncio.run(upload_packs(manager, [(PackSlice(small, "all.pack"), members)], 1))
+
+    (plain_chunk,) = metadata.chunks
+    (text_chunk,) = compressed.chunks
+    (packed_chunk,) = members[1].chunks
+    assert text_chunk.codec == "zlib" and packed_chunk.offset is not None
+    # One file whose chunks are stored each way, in this order
+    chunks = [
+        dataclasses.replace(chunk, index=index)
+        for index, chunk in enumerate([text_chunk, packed_chunk, plain_chunk])
+    ]
+    combined = dataclasses.replace(metadata, chunks=chunks)
+    whole = TEXT + small[1].read_bytes() + data
+
+    cache = ChunkCache(tmp_path / "cache", max_size=64 * 1024 * 1024)
+    calls = count_streams(client)
+    reader = RangeReader(manager, combined, readahead=4, chunk_cache=cache)
+    start = len(TEXT) - 1000
+    assert read(reader, start, 5000) == whole[start : start + 5000]
+    # Both whole chunks and the first plain block
+    assert len(calls) == 3
+    assert read(reader, 10, 20) == whole[10:30]
+    assert read(reader, len(TEXT) + 10, 20) == whole[len(TEXT) + 10 :][:20]
+    assert len(calls) == 3
+    reader.close()
+
+    # A new reader finds the whole chunks in the chunk cache
+    reader = RangeReader(manager, combined, chunk_cache=cache)
+    assert read(reader, 0, len(TEXT) + 3000) == whole[: len(TEXT) + 3000]
+    assert len(calls) == 3
+    reader.close()
+    cache.close()
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from core import scheduler
+from core.scheduler import RequestScheduler, TokenBucket
+
+# The real asyncio.sleep, which the clock fixture replaces
+sleep = asyncio.sleep
+
+
+class Clock:
+    """Virtual time for the scheduler: sleeping advances it at once"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.now += delay
+        await sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    # Only the scheduler's clock, as the event loop runs on time.monotonic too
+    monkeypatch.setattr(scheduler, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(scheduler.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_paces(clock):
+    async def acquire_all() -> list[float]:
+        bucket = TokenBucket(rate=4, burst=3)
+        return [await bucket.acquire() for _ in range(6)]
+
+    start = clock.now
+    waits = asyncio.run(acquire_all())
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3:] == [0.25, 0.25, 0.25]
+    assert clock.now - start == 0.75
+
+
+def test_bucket_refills_while_idle(clock):
+    async def acquire(bucket: TokenBucket, count: int) -> list[float]:
+        return [await bucket.acquire() for _ in range(count)]
+
+    async def run() -> list[float]:
+        bucket = TokenBucket(rate=2, burst=2)
+        await acquire(bucket, 2)
+        clock.now += 10
+        # Only burst tokens were saved up, however long it was idle
+        return await acquire(bucket, 3)
+
+    assert asyncio.run(run()) == pytest.approx([0, 0, 0.5])
+
+
+def test_flood_waits_hold_back_only_their_kind(clock):
+    requests = RequestScheduler(rate=0, burst=1, max_concurrency=4, max_flood_wait=60)
+    assert requests.flood_wait("send_document", 30)
+
+    async def turn(kind: str) -> float:
+        start = clock.now
+        await requests.wait_turn(kind)
+        return clock.now - start
+
+    assert asyncio.run(turn("get_messages")) == 0
+    assert asyncio.run(turn("send_document")) == 30
+    assert asyncio.run(turn("send_document")) == 0
+    assert requests.requests == 3
+    # Waits that add up past max_flood_wait fail the request instead
+    assert not requests.flood_wait("send_document", 31, waited=30)
+    assert requests.flood_waits == 2
+
+
+def test_window_halves_on_flood_waits_and_regrows(clock):
+    requests = RequestScheduler(rate=0, burst=1, max_concurrency=8, max_flood_wait=60)
+
+    async def complete(count: int) -> None:
+        for _ in range(count):
+            async with requests.transfer():
+                pass
+
+    for expected in (4, 2, 1, 1):
+        requests.flood_wait("send_document", 1)
+        assert requests.window == expected
+    # One slot per window's worth of completed transfers
+    asyncio.run(complete(1))
+    assert requests.window == 2
+    asyncio.run(complete(3))
+    assert int(requests.window) == 3
+    asyncio.run(complete(100))
+    assert requests.window == 8
+
+
+def test_window_bounds_concurrent_transfers(clock):
+    requests = RequestScheduler(rate=0, burst=1, max_concurrency=4, max_flood_wait=60)
+    requests.flood_wait("send_document", 1)
+    peak = 0
+
+    async def transfer() -> None:
+        nonlocal peak
+        async with requests.transfer():
+            peak = max(peak, requests.active)
+            await sleep(0.01)
+
+    async def run() -> None:
+        await asyncio.gather(*(transfer() for _ in range(6)))
+
+    asyncio.run(run())
+    assert peak == 2
+    assert requests.active == 0
+
+
+def test_failed_transfers_do_not_widen_the_window(clock):
+    requests = RequestScheduler(rate=0, burst=1, max_concurrency=4, max_flood_wait=60)
+    requests.flood_wait("send_document", 1)
+
+    async def fail() -> None:
+        async with requests.transfer():
+            raise ConnectionError
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(fail())
+    assert requests.window == 2
+
+
+def test_flood_waits_pyrogram_sleeps_through_shrink_the_window():
+    requests = RequestScheduler(rate=0, burst=1, max_concurrency=8, max_flood_wait=60)
+    requests.observe_sleeps({"fake0"})
+    logger = logging.getLogger("pyrogram.session.session")
+    try:
+        for name in ("fake0", "other"):
+            logger.warning(
+                '[%s] Waiting for %s seconds before continuing (required by "%s")',
+                name,
+                3,
+                "messages.SendMedia",
+            )
+    finally:
+        requests.stop_observing_sleeps()
+    assert requests.window == 4
+    assert requests.flood_wait_seconds == 3
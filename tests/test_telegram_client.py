@@ -0,0 +1,124 @@
+import asyncio
+import os
+
+import pytest
+from pyrogram.errors import FloodWait
+
+from benchmarks.bench import fake_manager
+from benchmarks.fake_telegram import NetworkProfile
+from core.telegram_client import STREAM_PART_SIZE
+
+
+def stored(client, tmp_path, size: int):
+    path = tmp_path / "document.bin"
+    path.write_bytes(os.urandom(size))
+    return path.read_bytes(), client.put_document(path)
+
+
+def test_stream_ending_early_is_resumed(fake, tmp_path):
+    manager, client = fake
+    data, message = stored(client, tmp_path, 3 * STREAM_PART_SIZE + 100)
+    client.stream_faults = ["drop", "drop"]
+    assert asyncio.run(manager.read_file(message.id, "document")) == data
+    assert client.stream_faults == []
+
+
+def test_range_ending_early_is_resumed(fake, tmp_path):
+    manager, client = fake
+    data, message = stored(client, tmp_path, 5 * STREAM_PART_SIZE)
+    client.stream_faults = ["drop"]
+
+    async def read():
+        parts = manager.stream_file(message.id, None, offset=1, limit=3)
+        return b"".join([part async for part in parts])
+
+    assert asyncio.run(read()) == data[STREAM_PART_SIZE : 4 * STREAM_PART_SIZE]
+
+
+def test_stream_that_keeps_ending_early_fails(fake, tmp_path):
+    manager, client = fake
+    _, message = stored(client, tmp_path, 5 * STREAM_PART_SIZE)
+    client.stream_faults = ["drop"] * (manager.config.reconnect_attempts + 1)
+    with pytest.raises(ConnectionError, match="ended after"):
+        asyncio.run(manager.read_file(message.id, "document"))
+
+
+def test_dropped_connection_is_reconnected(fake, tmp_path):
+    manager, client = fake
+    data, message = stored(client, tmp_path, 2 * STREAM_PART_SIZE)
+    client.stream_faults = [ConnectionError("connection lost")]
+    assert asyncio.run(manager.read_file(message.id, "document")) == data
+
+
+def test_stream_flood_wait_goes_through_the_scheduler(fake, tmp_path):
+    manager, client = fake
+    data, message = stored(client, tmp_path, 2 * STREAM_PART_SIZE)
+    window = manager.scheduler.window
+    client.stream_faults = [FloodWait(value=0)]
+    assert asyncio.run(manager.read_file(message.id, "document")) == data
+    assert manager.scheduler.flood_waits == 1
+    assert manager.scheduler.window < window
+
+
+def test_stream_flood_wait_over_the_limit_is_raised(fake, tmp_path):
+    manager, client = fake
+    _, message = stored(client, tmp_path, STREAM_PART_SIZE)
+    manager.scheduler.max_flood_wait = 5
+    client.stream_faults = [FloodWait(value=60)]
+    with pytest.raises(FloodWait):
+        asyncio.run(manager.read_file(message.id, "document"))
+
+
+def test_delete_files_batches_requests(fake, tmp_path, monkeypatch):
+    manager, client = fake
+    path = tmp_path / "document.bin"
+    path.write_bytes(b"x")
+    message_ids = [client.put_document(path).id for _ in range(250)]
+    batches = []
+    delete_messages = client.delete_messages
+
+    async def record(chat_id, message_ids):
+        batches.append(list(message_ids))
+        if len(batches) == 2:
+            raise RuntimeError("MESSAGE_DELETE_FORBIDDEN")
+        return await delete_messages(chat_id, message_ids)
+
+    monkeypatch.setattr(client, "delete_messages", record)
+    failures = asyncio.run(manager.delete_files(message_ids))
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    # The failed batch is reported, and the others are deleted regardless
+    assert [(batch, str(e)) for batch, e in failures] == [
+        (message_ids[100:200], "MESSAGE_DELETE_FORBIDDEN")
+    ]
+    assert sorted(client.messages) == message_ids[100:200]
+
+
+def sharded(tmp_path, placement: str):
+    manager, clients = fake_manager(tmp_path, NetworkProfile(), shards=3)
+    # A copy, as assigning a Config field would save it
+    manager.config = manager.config.model_copy(update={"shard_placement": placement})
+    return manager
+
+
+def test_round_robin_takes_shards_in_turn(tmp_path):
+    manager = sharded(tmp_path, "round-robin")
+    picked = []
+    for size in [100, 1, 1, 100, 1]:
+        with manager.placement(size) as shard:
+            picked.append(shard)
+    assert picked == [0, 1, 2, 0, 1]
+
+
+def test_least_loaded_counts_documents_in_flight(tmp_path):
+    manager = sharded(tmp_path, "least-loaded")
+    with manager.placement(100) as first:
+        with manager.placement(50) as second:
+            with manager.placement(80) as third:
+                with manager.placement(10) as fourth:
+                    pass
+                assert (first, second, third, fourth) == (0, 1, 2, 1)
+            with manager.placement(10) as fifth:
+                assert fifth == 2
+    # Nothing in flight once every upload is done
+    with manager.placement(10) as shard:
+        assert shard == 0
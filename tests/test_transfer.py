@@ -0,0 +1,222 @@
+import asyncio
+import os
+
+import pytest
+
+from benchmarks.bench import fake_manager
+from benchmarks.fake_telegram import NetworkProfile
+from core.compression import CODECS
+from core.file_processor import FileSplitRebuild, PackSlice
+from core.metadata import ChunkInfo, FileMetadata
+from core.telegram_client import STREAM_PART_SIZE
+from core.transfer import (
+    download_files,
+    upload_files,
+    upload_packs,
+    verify_chunks,
+)
+from core.transfer_journal import TransferJournal
+
+AVERAGE_SIZE = 16 * 1024
+
+
+def cdc_upload(path):
+    """path's metadata and content-defined chunks, ready for upload_files"""
+    slices = list(FileSplitRebuild()._iter_cdc_slices(path, AVERAGE_SIZE))
+    return FileMetadata.new(path), slices
+
+
+def download(manager, metadata: FileMetadata, output_path, **kwargs) -> bytes:
+    asyncio.run(download_files(manager, [(metadata, output_path)], 1, **kwargs))
+    return output_path.read_bytes()
+
+
+def stored_chunk(client, tmp_path, size: int, index: int = 1) -> ChunkInfo:
+    path = tmp_path / f"chunk{index}.bin"
+    path.write_bytes(os.urandom(size))
+    message = client.put_document(path)
+    return ChunkInfo.new(message.id, path, index)
+
+
+def test_verify_reports_damaged_chunks(fake, tmp_path):
+    manager, client = fake
+    intact = stored_chunk(client, tmp_path, 1000, 1)
+    flipped = stored_chunk(client, tmp_path, 1000, 2)
+    document = client._path(flipped.message_id)
+    data = bytearray(document.read_bytes())
+    data[0] ^= 1
+    document.write_bytes(bytes(data))
+    damaged, unverified = asyncio.run(verify_chunks(manager, [intact, flipped], 2))
+    assert [chunk for chunk, _ in damaged] == [flipped]
+    assert unverified == []
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_verify_reports_chunks_that_do_not_decompress(fake, tmp_path, codec):
+    manager, client = fake
+    chunk = stored_chunk(client, tmp_path, 1000)
+    # Stored as if compressed, but not valid for the codec
+    chunk.codec, chunk.compressed_size = codec, 1000
+    damaged, unverified = asyncio.run(verify_chunks(manager, [chunk], 1))
+    assert [c for c, _ in damaged] == [chunk]
+    assert unverified == []
+
+
+def test_verify_streams_a_failed_chunk_again(fake, tmp_path):
+    manager, client = fake
+    chunk = stored_chunk(client, tmp_path, 1000)
+    client.stream_faults = [ValueError("short read")]
+    assert asyncio.run(verify_chunks(manager, [chunk], 1)) == ([], [])
+
+
+def test_verify_tells_unchecked_chunks_from_damaged_ones(fake, tmp_path):
+    manager, client = fake
+    dropped = stored_chunk(client, tmp_path, 5 * STREAM_PART_SIZE, 1)
+    failing = stored_chunk(client, tmp_path, 1000, 2)
+    intact = stored_chunk(client, tmp_path, 1000, 3)
+    # One worker streams the chunks in order, each taking its faults in turn
+    client.stream_faults = [
+        RuntimeError("zstandard is not installed"),
+        *["drop"] * (manager.config.reconnect_attempts + 1),
+    ]
+    damaged, unverified = asyncio.run(
+        verify_chunks(manager, [failing, dropped, intact], 1)
+    )
+    assert damaged == []
+    assert {chunk.index: type(e) for chunk, e in unverified} == {
+        1: ConnectionError,
+        2: RuntimeError,
+    }
+
+
+def test_upload_packs_reports_each_pack_as_it_is_stored(fake, tmp_path):
+    manager, client = fake
+    paths = []
+    for index in range(4):
+        path = tmp_path / f"small{index}.txt"
+        path.write_bytes(os.urandom(100))
+        paths.append(path)
+    packs = [
+        (PackSlice(paths[:2], "first.pack"), [FileMetadata.new(p) for p in paths[:2]]),
+        (PackSlice(paths[2:], "second.pack"), [FileMetadata.new(p) for p in paths[2:]]),
+    ]
+    stored = []
+    # Let the first pack through, then fail the second
+    client.send_faults = [None, RuntimeError("upload rejected")]
+    with pytest.raises(RuntimeError):
+        asyncio.run(upload_packs(manager, packs, 1, on_stored=stored.extend))
+    assert [metadata.original_name for metadata in stored] == [
+        "small0.txt",
+        "small1.txt",
+    ]
+    assert all(metadata.chunks for metadata in stored)
+
+
+def test_upload_references_chunks_already_stored(fake, tmp_path):
+    manager, client = fake
+    shared = os.urandom(256 * 1024)
+    original = tmp_path / "original.bin"
+    original.write_bytes(shared)
+    edited = tmp_path / "edited.bin"
+    edited.write_bytes(os.urandom(64 * 1024) + shared)
+
+    first = cdc_upload(original)
+    asyncio.run(upload_files(manager, [first], 2, find_chunk=lambda _: None))
+    stored = {chunk.checksum: chunk for chunk in first[0].chunks}
+    sent = len(client.messages)
+    second = cdc_upload(edited)
+    asyncio.run(upload_files(manager, [second], 2, find_chunk=stored.get))
+
+    reused = [c for c in second[0].chunks if c.checksum in stored]
+    # Only the chunk where the prepended bytes meet the shared ones is new
+    assert len(reused) >= len(first[0].chunks) - 2
+    assert len(client.messages) - sent == len(second[0].chunks) - len(reused)
+    assert download(manager, second[0], tmp_path / "out.bin") == edited.read_bytes()
+
+
+def test_upload_resumes_from_its_journal(fake, tmp_path):
+    manager, client = fake
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(256 * 1024))
+    identity = {"kind": "upload", "path": str(path)}
+
+    metadata, slices = cdc_upload(path)
+    journal = TransferJournal.open(tmp_path / "transfers", identity)
+    client.send_faults = [None, None, RuntimeError("connection lost")]
+    with pytest.raises(RuntimeError):
+        asyncio.run(
+            upload_files(
+                manager, [(metadata, slices)], 1, journals={metadata.file_id: journal}
+            )
+        )
+    assert len(journal.completed) == 2
+
+    metadata, slices = cdc_upload(path)
+    journal = TransferJournal.open(tmp_path / "transfers", identity)
+    sent = len(client.messages)
+    asyncio.run(
+        upload_files(
+            manager, [(metadata, slices)], 1, journals={metadata.file_id: journal}
+        )
+    )
+    assert len(client.messages) - sent == len(slices) - 2
+    assert download(manager, metadata, tmp_path / "out.bin") == path.read_bytes()
+
+
+def test_download_resumes_from_its_journal(fake, tmp_path):
+    manager, client = fake
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(256 * 1024))
+    metadata, slices = cdc_upload(path)
+    asyncio.run(upload_files(manager, [(metadata, slices)], 1))
+
+    requests = client.requests
+    download(manager, metadata, tmp_path / "whole.bin")
+    whole = client.requests - requests
+
+    output_path = tmp_path / "out.bin"
+    identity = {"kind": "download", "file_id": metadata.file_id}
+    journal = TransferJournal.open(tmp_path / "transfers", identity)
+    client.stream_faults = [None, RuntimeError("connection lost")]
+    with pytest.raises(RuntimeError):
+        download(manager, metadata, output_path, journals={output_path: journal})
+    assert len(journal.completed) == 1
+
+    journal = TransferJournal.open(tmp_path / "transfers", identity)
+    requests = client.requests
+    data = download(manager, metadata, output_path, journals={output_path: journal})
+    assert data == path.read_bytes()
+    assert not journal.path.exists()
+    # The chunk the first attempt finished is not fetched again
+    assert client.requests - requests < whole
+
+
+def test_packed_files_download_from_their_ranges(fake, tmp_path):
+    manager, client = fake
+    paths = []
+    for index, size in enumerate([100, 0, 5000, 1]):
+        path = tmp_path / f"small{index}.txt"
+        path.write_bytes(os.urandom(size))
+        paths.append(path)
+    members = [FileMetadata.new(path) for path in paths]
+    asyncio.run(upload_packs(manager, [(PackSlice(paths, "all.pack"), members)], 1))
+    assert len(client.messages) == 1
+    for path, metadata in zip(paths, members):
+        output_path = tmp_path / f"{path.name}.out"
+        assert download(manager, metadata, output_path) == path.read_bytes()
+
+
+def test_chunks_spread_over_shards_and_download_back(tmp_path):
+    manager, clients = fake_manager(tmp_path, NetworkProfile(), shards=3)
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(256 * 1024))
+    metadata, slices = cdc_upload(path)
+    asyncio.run(upload_files(manager, [(metadata, slices)], 1))
+
+    by_shard = [[c for c in metadata.chunks if (c.shard or 0) == i] for i in range(3)]
+    assert all(by_shard)
+    # Each chunk is stored on its own shard's account, under its message id
+    for client, chunks in zip(clients, by_shard):
+        assert sorted(client.messages) == sorted(c.message_id for c in chunks)
+    assert {c.shard for c in by_shard[0]} == {None}
+    assert download(manager, metadata, tmp_path / "data.out") == path.read_bytes()
@@ -22,6 +22,17 @@ def size_in_humanize(size: int) -> str:
     return f"{size / (1024**3):.2f} GB"
 
 
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str) -> int:
+    """Bytes in a size such as 4096, 512K, 1.5G (raises ValueError otherwise)"""
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
 class Json:
     @staticmethod
     def dumps(data: dict | list, indent: int = 4) -> str: